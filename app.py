@@ -29,12 +29,17 @@ st.caption("基于 Chroma RAG + 外部 Prompt | 风格：冷酷/逻辑/数据驱
 # 初始化缓存（防止每次提问都重读文件）
 @st.cache_resource
 def init_brain():
-    """初始化 KAI 大脑 V3.6"""
-    return KAIBrain()
+    """初始化 KAI 大脑 V3.6（进程启动时并行预热 Embedding 与 Rerank 模型）"""
+    return KAIBrain(preload=True)
 
 try:
-    brain = init_brain()
+    with st.spinner("🔥 正在预热检索模型..."):
+        brain = init_brain()
     st.success("🧠 KAI v3.6 已上线 | RAG + External Prompt + I/O")
+    if brain.warmup_timings and brain.warmup_timings.get("remote"):
+        st.caption("🛰️ 使用常驻检索服务（本进程不加载检索模型）")
+    elif brain.warmup_timings:
+        st.caption(f"🔥 模型预热耗时 {brain.warmup_timings['total_ms'] / 1000:.1f}s")
 except Exception as e:
     st.error(f"❌ 大脑加载失败: {e}")
     st.stop()
@@ -55,18 +60,39 @@ if prompt := st.chat_input("输入业务问题..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # KAI 回复
+    # KAI 回复（流式：首字到达即开始渲染）
     with st.chat_message("assistant"):
-        with st.spinner("🧠 KAI 正在调取 RAG 记忆库..."):
-            result = brain.think(prompt)
+        record = {}
+        status = st.empty()
+        status.caption("🧠 KAI 正在调取 RAG 记忆库...")
 
-        # result 格式: {"response": str, "retrieved": list}
-        response = result["response"]
-        retrieved = result.get("retrieved", [])
+        def token_stream():
+            # think_stream 先产出 token(str)，最后产出结构化结果(dict)
+            for item in brain.think_stream(prompt, on_retrieved=lambda hits: status.empty()):
+                if isinstance(item, dict):
+                    record.update(item)
+                else:
+                    yield item
+
+        response = st.write_stream(token_stream())
+
+        # record 格式: {"response": str, "retrieved": list, "timings": dict, ...}
+        response = record.get("response", response)
+        retrieved = record.get("retrieved", [])
+        timings = record.get("timings", {})
+        tokens = record.get("tokens")
 
-        st.markdown(response)
         st.session_state.messages.append({"role": "assistant", "content": response})
 
+        if timings:
+            first_token = timings.get("first_token_ms")
+            first_token_str = f"{first_token / 1000:.1f}s" if first_token is not None else "-"
+            st.caption(
+                f"⏱️ 检索 {timings['retrieval_ms'] / 1000:.1f}s | "
+                f"首字 {first_token_str} | 总耗时 {timings['total_ms'] / 1000:.1f}s"
+                + (f" | Prompt {tokens['prompt'] or '≈' + str(tokens['prompt_estimate'])} tokens" if tokens else "")
+            )
+
         # 可选：显示检索到的记忆片段
         if retrieved:
             with st.expander("📎 检索到的记忆片段"):
@@ -21,22 +21,20 @@ import os
 import sys
 import logging
 from datetime import datetime
+from types import SimpleNamespace
 from dotenv import load_dotenv
 
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_openai import ChatOpenAI
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
+# 注意：langchain / torch 等重依赖只在用到的函数里导入，
+# 不带参数运行（打印用法）时不付出数秒的导入开销
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "kai_engine"))
+from retrieval import CHROMA_PATH, remote_retrieve, retrieve, get_db  # noqa: E402
 
 # ========== 配置 ==========
-PERSIST_DIR = "./chroma_db_data"
 OUTPUT_DIR = "./outputs"
 
-# Rerank 配置 (V3.3)
+# Rerank 配置 (V3.3)；粗排候选数、精排模型等见 kai_engine/retrieval.py
 RERANK_ENABLED = True
-RERANK_MODEL = "BAAI/bge-reranker-v2-m3"
-RERANK_TOP_K = 20    # 粗排：向量检索返回候选数
 RERANK_TOP_N = 5     # 精排：Rerank 后返回最终数
 
 # 加载环境变量（用于 LLM API）
@@ -95,33 +93,6 @@ def save_output(question, answer, sources):
     return filepath
 
 
-def get_embedding_model():
-    """
-    获取 embedding 模型
-
-    ⚠️ 重要：必须与 build_index.py 使用相同的模型！
-    这里使用本地 HuggingFace 中文模型，与写入端保持一致。
-    """
-    try:
-        from langchain_huggingface import HuggingFaceEmbeddings
-
-        logger.info("使用本地 HuggingFace 中文 embedding 模型: shibing624/text2vec-base-chinese")
-        embeddings = HuggingFaceEmbeddings(
-            model_name="shibing624/text2vec-base-chinese",
-            model_kwargs={'device': 'cpu'}
-        )
-        return embeddings
-    except ImportError:
-        # Fallback to sentence-transformers
-        from langchain_community.embeddings import SentenceTransformerEmbeddings
-
-        logger.info("使用 SentenceTransformer 中文 embedding 模型: shibing624/text2vec-base-chinese")
-        embeddings = SentenceTransformerEmbeddings(
-            model_name="shibing624/text2vec-base-chinese"
-        )
-        return embeddings
-
-
 def get_llm():
     """
     获取 LLM 模型用于生成回答
@@ -137,6 +108,8 @@ def get_llm():
 
     # 如果有配置 API，使用在线 LLM
     if api_base and api_key:
+        from langchain_openai import ChatOpenAI
+
         logger.info(f"使用在线 LLM: {chat_model}")
         llm = ChatOpenAI(
             model=chat_model,
@@ -153,88 +126,13 @@ def get_llm():
     return llm
 
 
-# Rerank 模型缓存（全局变量，避免重复加载）
-_reranker_model = None
-
-
-def get_reranker():
-    """
-    获取 Rerank 模型（单例模式）
-    V3.3 新增：使用 BAAI/bge-reranker-v2-m3 进行精排
-    """
-    global _reranker_model
-
-    if _reranker_model is None:
-        try:
-            from FlagEmbedding import FlagReranker
-            logger.info(f"加载 Rerank 模型: {RERANK_MODEL}")
-            _reranker_model = FlagReranker(RERANK_MODEL, use_fp16=True)
-            logger.info("✅ Rerank 模型加载成功")
-        except Exception as e:
-            logger.warning(f"❌ Rerank 模型加载失败: {e}")
-            _reranker_model = None
-
-    return _reranker_model
-
-
-def rerank_docs(query, documents):
-    """
-    V3.3 新增：使用 Rerank 模型对文档进行精排
-
-    流程：Top-K (20) -> Rerank -> Top-N (5)
-
-    Args:
-        query: 用户问题
-        documents: 粗排候选文档列表
-
-    Returns:
-        精排后的文档列表（Top-N）
-    """
-    if not RERANK_ENABLED:
-        logger.info("Rerank 未启用，直接返回粗排结果")
-        return documents[:RERANK_TOP_N]
-
-    if len(documents) <= RERANK_TOP_N:
-        logger.info(f"候选文档数量 ({len(documents)}) <= {RERANK_TOP_N}，无需 Rerank")
-        return documents
-
-    # 加载 Rerank 模型
-    reranker = get_reranker()
-    if reranker is None:
-        logger.warning("Rerank 模型不可用，返回粗排结果")
-        return documents[:RERANK_TOP_N]
-
-    logger.info(f"🔄 Rerank 精排中: {len(documents)} -> {RERANK_TOP_N}")
-
-    try:
-        # 构造配对：[[query, doc1], [query, doc2], ...]
-        pairs = [[query, doc.page_content] for doc in documents]
-
-        # 计算分数
-        scores = reranker.compute_score(pairs, normalize=True)
-
-        # 合并文档和分数
-        combined = list(zip(documents, scores))
-
-        # 按分数降序排序（分数高的在前）
-        combined.sort(key=lambda x: x[1], reverse=True)
-
-        # 取 Top-N
-        reranked = [doc for doc, score in combined[:RERANK_TOP_N]]
-
-        logger.info(f"✅ Rerank 完成，Top-{RERANK_TOP_N} 分数范围: {combined[0][1]:.4f} - {combined[RERANK_TOP_N-1][1]:.4f}")
-
-        return reranked
-
-    except Exception as e:
-        logger.warning(f"Rerank 计算失败: {e}，返回粗排结果")
-        return documents[:RERANK_TOP_N]
-
-
 def create_qa_chain(vectorstore):
     """
     创建问答链
     """
+    from langchain.chains import RetrievalQA
+    from langchain.prompts import PromptTemplate
+
     llm = get_llm()
 
     # 定制 prompt
@@ -263,6 +161,37 @@ def create_qa_chain(vectorstore):
     return qa_chain
 
 
+def retrieve_docs_remote(question):
+    """
+    通过常驻检索服务获取精排结果（模型常驻，省去加载时间）
+
+    Returns:
+        文档列表（带 page_content / metadata）；服务未启动时返回 None
+    """
+    hits = remote_retrieve(question, top_k=RERANK_TOP_N, rerank=RERANK_ENABLED)
+    if hits is None:
+        return None
+    logger.info(f"🛰️ 使用常驻检索服务，命中 {len(hits)} 条")
+    print("🔍 检索相关知识（常驻检索服务）...\n")
+    return _hits_to_docs(hits)
+
+
+def retrieve_docs_local(question):
+    """
+    进程内检索：与 brain.py 相同走 retrieval.retrieve()（get_db() 选择分片 / NumPy / 量化后端，
+    混合检索、过滤与 small-to-big 均生效）
+    """
+    print(f"📚 已索引 {get_db().count()} 个知识片段\n")
+    print("🔍 检索相关知识...\n")
+    hits = retrieve(question, top_k=RERANK_TOP_N, rerank=RERANK_ENABLED)
+    return _hits_to_docs(hits)
+
+
+def _hits_to_docs(hits):
+    """结构化结果 -> 文档列表；small-to-big：优先用扩展后的小节正文（旧版服务没有 section 字段）"""
+    return [SimpleNamespace(page_content=hit.get("section", hit["content"]), metadata=hit["metadata"]) for hit in hits]
+
+
 def main():
     """
     主流程：加载向量库 -> 检索相关内容 -> 生成回答
@@ -280,39 +209,18 @@ def main():
     print(f"\n问题：{question}\n")
 
     # 1. 检查向量库
-    if not os.path.exists(PERSIST_DIR):
+    if not os.path.exists(CHROMA_PATH):
         print("❌ 向量库不存在，请先运行 build_index.py")
         return
 
-    logger.info(f"加载向量库: {PERSIST_DIR}")
-
-    # 2. 加载 embedding 模型
-    logger.info("初始化 embedding 模型...")
-    embeddings = get_embedding_model()
-
-    # 3. 加载向量库
-    logger.info("加载向量数据库...")
-    vectorstore = Chroma(
-        persist_directory=PERSIST_DIR,
-        embedding_function=embeddings
-    )
-
-    # 4. 检查数据
-    count = vectorstore._collection.count()
-    logger.info(f"向量库中共有 {count} 个片段")
-    print(f"📚 已索引 {count} 个知识片段\n")
-
-    # 5. 检索相关内容（V3.3 Rerank 流程）
-    print("🔍 检索相关知识...\n")
-
-    # 5.1 粗排：从向量库获取更多候选 (Top-K)
-    logger.info(f"📊 粗排：向量检索 Top-{RERANK_TOP_K}")
-    raw_docs = vectorstore.similarity_search(question, k=RERANK_TOP_K)
-    logger.info(f"   粗排候选数: {len(raw_docs)}")
-
-    # 5.2 精排：Rerank 模型打分排序 (Top-N)
-    logger.info(f"📊 精排：Rerank 模型打分")
-    docs = rerank_docs(question, raw_docs)
+    # 2. 检索：优先使用常驻检索服务（scripts/kai_engine/server.py），未启动时进程内加载
+    try:
+        docs = retrieve_docs_remote(question)
+        if docs is None:
+            docs = retrieve_docs_local(question)
+    except Exception as e:
+        logger.error(f"检索出错，按无检索结果继续: {e}")
+        docs = []
     logger.info(f"   精排结果数: {len(docs)}")
 
     # 收集来源列表（去重）
@@ -339,7 +247,7 @@ def main():
         content = doc.page_content[:200].replace('\n', ' ')
         print(f"{content}...")
 
-    # 6. 生成回答（使用 Rerank 后的文档）
+    # 3. 生成回答（使用 Rerank 后的文档）
     print("\n" + "=" * 60)
     print("🤖 KAI 回答：")
     print("=" * 60)
@@ -370,7 +278,7 @@ def main():
     answer = response.content if hasattr(response, 'content') else str(response)
     print(answer)
 
-    # 7. 保存到文件
+    # 4. 保存到文件
     filepath = save_output(question, answer, sources)
     print(f"\n✅ 已保存到: {filepath}")
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+切分器基准：单遍原生切分 vs LangChain 两遍切分
+
+对知识库中的每个 .md 文件（去掉 Frontmatter 后的正文）分别运行：
+    - langchain：MarkdownHeaderTextSplitter + RecursiveCharacterTextSplitter（原 build_index.py 切分）
+    - native：kai_engine/chunker.py chunk_markdown
+比较总耗时、片段数，并逐片段核对 (标题元数据, start_index, 正文) 是否完全一致。
+
+使用方法：
+    python3 scripts/bench_chunker.py                     # 读取 knowledge_base/
+    python3 scripts/bench_chunker.py --dir KAI_Brain     # 指定目录
+    python3 scripts/bench_chunker.py --repeat 5          # 重复 5 轮取最快
+"""
+
+import os
+import sys
+import time
+import argparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "kai_engine"))
+
+from chunker import HEADER_NAMES, SEPARATORS, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP, chunk_markdown  # noqa: E402
+
+PROJECT_ROOT = os.path.dirname(SCRIPTS_DIR)
+KNOWLEDGE_BASE_DIR = os.path.join(PROJECT_ROOT, "knowledge_base")
+
+
+def load_texts(base_dir):
+    """读取 base_dir 下全部 .md 的正文；无法解析的文件（如 Frontmatter 格式错误）跳过并提示，同 build_index.py"""
+    import frontmatter
+
+    texts = []
+    for root, _, files in os.walk(base_dir, followlinks=True):
+        for name in sorted(files):
+            if name.endswith(".md"):
+                try:
+                    with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+                        texts.append(frontmatter.load(f).content)
+                except Exception as e:
+                    print(f"⚠️ 跳过 {os.path.join(root, name)}: {e}")
+    return texts
+
+
+def langchain_chunker(chunk_size, chunk_overlap):
+    from langchain.text_splitter import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+
+    markdown_splitter = MarkdownHeaderTextSplitter(
+        headers_to_split_on=[("#" * (i + 1), name) for i, name in enumerate(HEADER_NAMES)]
+    )
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=list(SEPARATORS),
+        length_function=len,
+        add_start_index=True,
+    )
+
+    def run(text):
+        records = []
+        for section_no, split in enumerate(markdown_splitter.split_text(text)):
+            for chunk in text_splitter.split_documents([split]):
+                meta = dict(chunk.metadata)
+                start_index = meta.pop("start_index")
+                records.append((section_no, meta, start_index, chunk.page_content))
+        return records
+
+    return run
+
+
+def timed(fn, texts, repeat):
+    best, outputs = float("inf"), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        outputs = [fn(text) for text in texts]
+        best = min(best, time.perf_counter() - t)
+    return best, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KAI 切分器基准")
+    parser.add_argument("--dir", default=KNOWLEDGE_BASE_DIR, help="知识库目录（默认 knowledge_base/）")
+    parser.add_argument("--repeat", type=int, default=3, help="重复轮数，取最快一轮")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_OVERLAP)
+    args = parser.parse_args()
+
+    texts = load_texts(args.dir)
+    if not texts:
+        print(f"❌ {args.dir} 下没有 .md 文件")
+        sys.exit(1)
+
+    legacy_s, legacy = timed(langchain_chunker(args.chunk_size, args.chunk_overlap), texts, args.repeat)
+    native_s, native = timed(lambda text: chunk_markdown(text, args.chunk_size, args.chunk_overlap),
+                             texts, args.repeat)
+
+    mismatched = [i for i, (a, b) in enumerate(zip(legacy, native)) if a != b]
+    chars = sum(len(text) for text in texts)
+
+    print("=" * 64)
+    print(f"KAI 切分器基准（{len(texts)} 个文件, {chars / 1e6:.2f}M 字符, 最快 {args.repeat} 轮）")
+    print("=" * 64)
+    print(f"{'切分器':<12}{'片段数':>10}{'耗时':>14}{'吞吐':>18}")
+    for name, seconds, outputs in (("langchain", legacy_s, legacy), ("native", native_s, native)):
+        print(f"{name:<12}{sum(map(len, outputs)):>10}{seconds * 1000:>11.1f} ms"
+              f"{chars / seconds / 1e6:>13.2f} M/s")
+    print(f"加速比: {legacy_s / native_s:.1f}x")
+    if mismatched:
+        print(f"❌ {len(mismatched)} 个文件输出不一致，例如第 {mismatched[0]} 个文件")
+        sys.exit(1)
+    print("✅ 全部文件输出一致")
+    print("=" * 64)
+
+
+if __name__ == "__main__":
+    main()
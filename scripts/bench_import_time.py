@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+冷启动导入耗时基准：基于 python -X importtime
+
+检查 KAI 引擎入口的导入开销，两类回退都会让脚本以非 0 退出：
+    1. 重依赖（torch / transformers / langchain / chromadb / FlagEmbedding / openai / numpy）
+       出现在入口的导入图里
+    2. 导入总耗时超过预算（取多次运行的最小值，降低抖动）
+
+使用方法：
+    python3 scripts/bench_import_time.py
+    python3 scripts/bench_import_time.py --budget-ms 300 --repeat 5
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+KAI_ENGINE_DIR = os.path.join(SCRIPTS_DIR, "kai_engine")
+
+# 入口：(名称, python 参数, 工作目录)
+TARGETS = [
+    ("import retrieval", ["-c", "import retrieval"], KAI_ENGINE_DIR),
+    ("import brain", ["-c", "import brain"], KAI_ENGINE_DIR),
+    ("ask_kai.py (无参数)", [os.path.join(SCRIPTS_DIR, "ask_kai.py")], SCRIPTS_DIR),
+]
+
+# 冷启动阶段不允许出现的顶层包
+HEAVY_MODULES = {
+    "torch", "transformers", "sentence_transformers", "FlagEmbedding",
+    "langchain", "langchain_core", "langchain_community", "langchain_huggingface", "langchain_openai",
+    "chromadb", "openai", "numpy",
+}
+
+DEFAULT_BUDGET_MS = 250
+DEFAULT_REPEAT = 3
+
+
+def measure(args, cwd):
+    """
+    运行一次 python -X importtime，解析 stderr
+
+    Returns:
+        (总耗时 ms, 导入过的顶层包集合)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd, capture_output=True, text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    total_us = 0
+    packages = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 顶层导入（名字前没有缩进）的累计耗时之和 = 总导入耗时
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+        packages.add(name.strip().split(".")[0])
+    return total_us / 1000, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KAI 引擎冷启动导入耗时基准")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"单个入口的导入耗时预算（默认 {DEFAULT_BUDGET_MS} ms）")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"每个入口运行次数，取最小值（默认 {DEFAULT_REPEAT}）")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("KAI 冷启动导入耗时")
+    print("=" * 60)
+
+    failed = False
+    for name, target_args, cwd in TARGETS:
+        runs = [measure(target_args, cwd) for _ in range(args.repeat)]
+        best_ms = min(ms for ms, _ in runs)
+        heavy = sorted(runs[0][1] & HEAVY_MODULES)
+
+        ok = best_ms <= args.budget_ms and not heavy
+        failed = failed or not ok
+        print(f"{'✅' if ok else '❌'} {name:<24} {best_ms:8.1f} ms (预算 {args.budget_ms:.0f} ms)")
+        if heavy:
+            print(f"   ⚠️ 冷启动导入了重依赖: {', '.join(heavy)}")
+
+    print("=" * 60)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
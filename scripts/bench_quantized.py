@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+量化向量索引基准：常驻内存 vs 召回损失
+
+对同一批向量分别构建 fp16 / int8 / int8+PQ 量化索引，与 float32 暴力检索的精确 top-k 对比：
+    - recall@k：量化检索结果与精确结果的重合比例
+    - 常驻内存：检索时需要常驻的字节数（float32 基线 = n × dim × 4）
+    - 单次查询平均耗时
+
+查询向量取自库内向量加高斯噪声（模拟相近但不相同的问题），不需要加载 embedding 模型。
+
+使用方法：
+    python3 scripts/bench_quantized.py                    # 读取 chroma_db_data 中的向量
+    python3 scripts/bench_quantized.py --synthetic 50000  # 无向量库时用随机向量
+    python3 scripts/bench_quantized.py --pq-subspaces 96 --queries 500 --k 20
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "kai_engine"))
+
+from quantized_index import QuantizedIndex  # noqa: E402
+
+PROJECT_ROOT = os.path.dirname(SCRIPTS_DIR)
+CHROMA_PATH = os.path.join(PROJECT_ROOT, "chroma_db_data")
+COLLECTION_NAME = "langchain"   # LangChain Chroma 默认集合名
+
+DEFAULT_QUERIES = 200
+DEFAULT_K = 20
+DEFAULT_PQ_SUBSPACES = 96
+NOISE_SCALE = 0.3         # 噪声标准差 / 向量各维标准差
+
+
+def load_chroma_vectors():
+    import chromadb
+
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collection = client.get_collection(COLLECTION_NAME)
+    ids, vectors = [], []
+    offset = 0
+    while True:
+        rows = collection.get(include=["embeddings"], limit=5000, offset=offset)
+        if not len(rows["ids"]):
+            break
+        ids.extend(rows["ids"])
+        vectors.extend(rows["embeddings"])
+        offset += len(rows["ids"])
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def exact_top_k(vectors, norms, query, k):
+    dists = norms - 2 * vectors @ query + query @ query
+    part = np.argpartition(dists, min(k, len(dists) - 1))[:k]
+    return set(part[np.argsort(dists[part])].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KAI 量化向量索引基准")
+    parser.add_argument("--synthetic", type=int, default=0, help="用 N 条随机向量代替向量库")
+    parser.add_argument("--dim", type=int, default=768, help="随机向量维度（仅 --synthetic）")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--k", type=int, default=DEFAULT_K)
+    parser.add_argument("--pq-subspaces", type=int, default=DEFAULT_PQ_SUBSPACES,
+                        help=f"PQ 子空间数（默认 {DEFAULT_PQ_SUBSPACES}）")
+    parser.add_argument("--rescore-k", type=int, default=100)
+    parser.add_argument("--pq-shortlist", type=int, default=400)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        ids = [f"v{i}" for i in range(args.synthetic)]
+        vectors = rng.standard_normal((args.synthetic, args.dim)).astype(np.float32)
+    else:
+        ids, vectors = load_chroma_vectors()
+    if len(ids) == 0:
+        print("❌ 没有向量，请先运行 build_index.py 或使用 --synthetic")
+        sys.exit(1)
+
+    n, dim = vectors.shape
+    sample = rng.choice(n, size=min(args.queries, n), replace=False)
+    noise = rng.standard_normal((len(sample), dim)).astype(np.float32) * vectors.std(0) * NOISE_SCALE
+    queries = vectors[sample] + noise
+    norms = (vectors ** 2).sum(1)
+    truth = [exact_top_k(vectors, norms, q, args.k) for q in queries]
+    baseline_bytes = n * dim * 4
+
+    configs = [("fp16", 0), ("int8", 0)]
+    if args.pq_subspaces and dim % args.pq_subspaces == 0:
+        configs.append(("int8", args.pq_subspaces))
+
+    print("=" * 72)
+    print(f"KAI 量化向量索引基准（{n} 条 × {dim} 维, {len(queries)} 个查询, recall@{args.k}）")
+    print("=" * 72)
+    print(f"{'配置':<14}{'recall':>10}{'常驻内存':>14}{'压缩比':>10}{'查询耗时':>14}")
+    print(f"{'float32':<14}{1.0:>10.4f}{baseline_bytes / 2**20:>11.1f} MB{1.0:>9.1f}x{'-':>14}")
+
+    tmp_root = tempfile.mkdtemp(prefix="kai_quant_")
+    try:
+        for dtype, pq_m in configs:
+            index_dir = os.path.join(tmp_root, f"{dtype}_{pq_m}")
+            QuantizedIndex.build(index_dir, ids, vectors, dtype=dtype, pq_m=pq_m)
+            index = QuantizedIndex.load(index_dir)
+            row_of = {chunk_id: i for i, chunk_id in enumerate(ids)}
+
+            recalls = []
+            t = time.perf_counter()
+            for query, expected in zip(queries, truth):
+                hits = index.search(query, k=args.k, rescore_k=args.rescore_k, pq_shortlist=args.pq_shortlist)
+                recalls.append(len({row_of[c] for c, _ in hits} & expected) / len(expected))
+            per_query_ms = (time.perf_counter() - t) * 1000 / len(queries)
+
+            resident = index.resident_bytes()
+            name = dtype + (f"+PQ{pq_m}" if pq_m else "")
+            print(f"{name:<14}{np.mean(recalls):>10.4f}{resident / 2**20:>11.1f} MB"
+                  f"{baseline_bytes / resident:>9.1f}x{per_query_ms:>11.2f} ms")
+    finally:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+批量检索吞吐基准：逐条 search_knowledge_base() vs 一次 search_many()
+
+两种方式每轮前都清空查询向量 / 结果 / 精排分数缓存，且强制走进程内检索
+（不转发常驻服务），比较的是编码 + 粗排 + 精排的真实开销。
+
+使用方法：
+    python3 scripts/bench_search_many.py
+    python3 scripts/bench_search_many.py --queries-file queries.txt --repeat 5
+    python3 scripts/bench_search_many.py --no-rerank
+"""
+
+import os
+import sys
+import time
+import argparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "kai_engine"))
+
+import retrieval  # noqa: E402
+from rerank import clear_score_cache  # noqa: E402
+
+DEFAULT_QUERIES = [
+    "GVM 公式是什么？",
+    "如何做复盘？",
+    "联想文化的核心是什么？",
+    "怎么写一篇公众号文章？",
+    "AI 时代的个人成长",
+    "如何管理团队？",
+    "产品定位的方法",
+    "知识管理的最佳实践",
+]
+DEFAULT_REPEAT = 3
+
+
+def reset_caches():
+    retrieval.clear_caches()
+    clear_score_cache()
+
+
+def run_sequential(queries, top_k, rerank):
+    return [retrieval.search_knowledge_base(q, top_k=top_k, rerank=rerank) for q in queries]
+
+
+def run_batched(queries, top_k, rerank):
+    return retrieval.search_many(queries, top_k=top_k, rerank=rerank)
+
+
+def measure(fn, queries, top_k, rerank, repeat):
+    """返回 (最短耗时秒, 最后一次结果)"""
+    best = float("inf")
+    results = None
+    for _ in range(repeat):
+        reset_caches()
+        t = time.perf_counter()
+        results = fn(queries, top_k, rerank)
+        best = min(best, time.perf_counter() - t)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KAI 批量检索吞吐基准")
+    parser.add_argument("--queries-file", help="每行一个查询（默认使用内置查询）")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"每种方式运行次数，取最小值（默认 {DEFAULT_REPEAT}）")
+    parser.add_argument("--no-rerank", action="store_true", help="只比较粗排")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    rerank = not args.no_rerank
+
+    retrieval.USE_REMOTE = False
+    retrieval.warmup()
+
+    seq_s, seq_results = measure(run_sequential, queries, args.top_k, rerank, args.repeat)
+    batch_s, batch_results = measure(run_batched, queries, args.top_k, rerank, args.repeat)
+
+    print("=" * 60)
+    print(f"KAI 批量检索吞吐（{len(queries)} 条查询, top_k={args.top_k}, rerank={rerank}）")
+    print("=" * 60)
+    print(f"逐条 search_knowledge_base: {seq_s * 1000:8.1f} ms  ({len(queries) / seq_s:6.1f} q/s)")
+    print(f"批量 search_many:           {batch_s * 1000:8.1f} ms  ({len(queries) / batch_s:6.1f} q/s)")
+    print(f"加速比: {seq_s / batch_s:.2f}x")
+    if seq_results != batch_results:
+        print("⚠️ 两种方式的结果不一致（逐条路径的早停 / 初筛会带来少量差异，可设 KAI_ADAPTIVE_RERANK=0 对齐）")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
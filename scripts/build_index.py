@@ -3,7 +3,12 @@
 向量化脚本：将 knowledge_base 下的所有 .md 文件向量化并存储到 Chroma
 
 使用方法：
-    python3 scripts/build_index.py
+    python3 scripts/build_index.py                  # 全量重建
+    python3 scripts/build_index.py --incremental    # 增量更新（只处理新增/修改/删除的文件）
+    python3 scripts/build_index.py --quantize int8 --pq-subspaces 96   # 额外生成量化向量索引
+    python3 scripts/build_index.py --backend numpy --ivf-lists 64      # 检索端改用 NumPy 向量库
+    python3 scripts/build_index.py --shards on                         # 按目录分片构建
+    python3 scripts/build_index.py --incremental --shard 00-Inbox/wechat   # 只更新一个分片
 
 依赖：
     - langchain
@@ -15,34 +20,127 @@
 切分策略 (V3.3):
     - 第一层：按 Markdown 标题切分（保证语义完整性）
     - 第二层：递归细切（防止单章过长）
+    - 两层在 kai_engine/chunker.py 中单遍完成，输出与 LangChain 两层切分器一致（见 scripts/bench_chunker.py）
 
 元数据 (V5.1 四大金刚):
     - source: 来源平台 (xiaohongshu/wechat/douyin)
     - created_at: 创建日期
     - author: 作者
     - content_type: 内容类型 (post/article/script/doc)
+    - 派生过滤字段：created_date (YYYYMMDD 整数)、relpath、path_l1~l3（见 kai_engine/filters.py）
+
+增量索引:
+    - index_manifest.json 记录每个文件的内容哈希与其 chunk ID
+    - 只对新增/修改的文件重新切分、向量化并写入；删除已移除文件的 chunk
+
+关键词索引:
+    - 与 Chroma 同步维护 BM25 倒排索引（chroma_db_data/bm25/），供检索端混合召回
+    - 增量模式只对变化的 chunk 重新分词
+
+近重复去重:
+    - 解析时为每个片段计算 SimHash（kai_engine/near_dup.py），与已索引片段汉明距离 <= --near-dup-distance
+      的片段只登记为代表片段的别名（chroma_db_data/near_dup/），不向量化、不写入；日志按目录报告重复比例
+    - 增量构建时代表片段被删除，别名所在文件会一并重新处理
+    - 分片构建时各分片共用一份判重索引（合并读入各分片的 near_dup/），跨分片的副本同样只写入一份
+
+小节索引:
+    - 多片段标题小节的全文边解析边追加写入 chroma_db_data/sections/（内存只保留偏移索引），
+      其片段元数据带 section_id（见 kai_engine/sections.py），
+      检索端在小片段上匹配、注入 Prompt 时换成所在小节并去重（small-to-big）
+
+量化索引:
+    - --quantize fp16/int8 在 chroma_db_data/quantized/ 生成量化向量（可选 PQ），检索端用它粗排、
+      再用 float32 原向量精确重排，常驻内存缩小 2~4 倍（见 scripts/bench_quantized.py）
+    - 之后的增量构建沿用已有量化配置；--quantize none 删除量化索引
+
+检索后端:
+    - Chroma 始终是构建端的主库（增量清单、BM25 重建都从它读取）
+    - --backend numpy 额外导出 chroma_db_data/numpy/（归一化向量 memmap + 正文/元数据，
+      --ivf-lists 指定 IVF 分区数），检索端据此改用 NumPy 后端，不再打开 Chroma
+    - 之后的增量构建沿用已有后端配置；--backend chroma 删除 NumPy 库
+
+分片索引:
+    - --shards on 按顶层目录分片（00-Inbox 再细分一级，见 kai_engine/shards.py），每个分片是
+      chroma_db_data/shards/<分片>/ 下完整独立的索引目录（向量库、BM25、量化索引、清单、index_version）
+    - --shard NAME 只构建指定分片（可重复），其余分片不受影响；检索端只重新加载变化的分片
+    - 之后的构建沿用分片布局；--shards off 删除全部分片，回到单一索引
+
+构建流水线:
+    - 解析切分 -> 向量化 -> 写入，阶段间有界队列；按 FILE_BATCH_SIZE 个文件一批，
+      逐文档、逐标题小节切分，内存占用不随语料规模增长
+    - Frontmatter 解析与两层切分由 --workers 个进程并行，返回紧凑的 (chunk_id, 正文, 元数据) 记录，
+      按文件顺序汇总（chunk ID、Header 1~3、start_index 与串行完全一致）
+    - 向量化按 --batch-size 分批，由 --embed-workers 个进程并行编码
+    - embedding_cache/ 按 (模型, 文本哈希) 缓存向量，未变化的片段不再重复编码
 """
 
 import os
 import glob
+import sys
+import json
+import queue
+import hashlib
 import logging
-from pathlib import Path
+import time
+import shutil
+import argparse
+import threading
+
+import numpy as np
 
 from dotenv import load_dotenv
-from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader
-from langchain.text_splitter import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "kai_engine"))
+from embedder import (  # noqa: E402
+    EMBEDDING_MODEL_NAME, DEFAULT_BATCH_SIZE, DEFAULT_THREADS_PER_WORKER, ParallelEmbedder
+)
+from embedding_cache import EmbeddingCache  # noqa: E402
+from bm25 import BM25Index  # noqa: E402
+from chunker import split_sections, split_text  # noqa: E402
+from sections import SectionIndex, SectionWriter, make_section_id  # noqa: E402
+from near_dup import DEFAULT_MAX_DISTANCE, NearDuplicateIndex, simhash  # noqa: E402
+from filters import date_to_int, path_levels  # noqa: E402
+from quantized_index import QUANTIZE_TYPES, QuantizedIndex  # noqa: E402
+from vector_store import NumpyStore  # noqa: E402
+from shards import shard_of, shard_dir_name, list_shards  # noqa: E402
+
 # ========== 配置 ==========
 # 知识库目录（相对于项目根目录）
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 KNOWLEDGE_BASE_DIR = os.path.join(PROJECT_ROOT, "knowledge_base")
 PERSIST_DIR = os.path.join(PROJECT_ROOT, "chroma_db_data")
+# 增量索引清单：{相对路径: {"hash": 内容哈希, "chunk_ids": [...]}}
+MANIFEST_PATH = os.path.join(PERSIST_DIR, "index_manifest.json")
+# 索引版本：每次写库后更新，检索端据此让查询结果缓存失效
+INDEX_VERSION_PATH = os.path.join(PERSIST_DIR, "index_version")
+# BM25 倒排索引目录
+BM25_DIR = os.path.join(PERSIST_DIR, "bm25")
+# 片段 -> 标题小节索引目录（检索端 small-to-big）
+SECTIONS_DIR = os.path.join(PERSIST_DIR, "sections")
+# 近重复片段指纹与别名表目录
+NEAR_DUP_DIR = os.path.join(PERSIST_DIR, "near_dup")
+# 量化向量索引目录
+QUANTIZED_DIR = os.path.join(PERSIST_DIR, "quantized")
+# NumPy 向量库目录（检索端 NumPy 后端）
+NUMPY_STORE_DIR = os.path.join(PERSIST_DIR, "numpy")
+# 分片索引根目录（每个子目录的布局与 PERSIST_DIR 相同）
+SHARDS_DIR = os.path.join(PERSIST_DIR, "shards")
 
 # 切分参数 (V3.3 混合切分策略)
 CHUNK_SIZE = 500       # 每个块约 300-500 中文字
 CHUNK_OVERLAP = 50     # 重叠 50 字，防止上下文丢失
 
+# Chroma 单次写入上限（SQLite 变量数限制）
+WRITE_BATCH_SIZE = 1000
+
+# 构建流水线：阶段间队列上限（背压，防止某一阶段把整个语料堆进内存）
+QUEUE_MAXSIZE = 8
+# 解析切分阶段每批文件数（一批为一个进程池任务；内存中最多 QUEUE_MAXSIZE + 2 × workers 批片段记录）
+FILE_BATCH_SIZE = 16
+# 解析切分进程数（与 embedding 进程池共享 CPU，默认取一半核数且不超过 4）
+DEFAULT_PARSE_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
 # V5.1 Frontmatter 四大金刚字段
 FRONTMATTER_FIELDS = ['source', 'created_at', 'author', 'content_type']
 
@@ -67,9 +165,9 @@ def get_embedding_model():
     try:
         from langchain_huggingface import HuggingFaceEmbeddings
 
-        logger.info("使用本地 HuggingFace 中文 embedding 模型: shibing624/text2vec-base-chinese")
+        logger.info(f"使用本地 HuggingFace 中文 embedding 模型: {EMBEDDING_MODEL_NAME}")
         embeddings = HuggingFaceEmbeddings(
-            model_name="shibing624/text2vec-base-chinese",
+            model_name=EMBEDDING_MODEL_NAME,
             model_kwargs={'device': 'cpu'}
         )
         return embeddings
@@ -77,132 +175,985 @@ def get_embedding_model():
         # Fallback to sentence-transformers
         from langchain_community.embeddings import SentenceTransformerEmbeddings
 
-        logger.info("使用 SentenceTransformer 中文 embedding 模型: shibing624/text2vec-base-chinese")
+        logger.info(f"使用 SentenceTransformer 中文 embedding 模型: {EMBEDDING_MODEL_NAME}")
         embeddings = SentenceTransformerEmbeddings(
-            model_name="shibing624/text2vec-base-chinese"
+            model_name=EMBEDDING_MODEL_NAME
         )
         return embeddings
 
 
-def load_markdown_files(base_dir):
+def set_index_dir(persist_dir):
+    """切换当前读写的索引目录（分片构建时逐个切换，清单/版本/BM25/小节/去重/量化/NumPy 路径随之改变）"""
+    global PERSIST_DIR, MANIFEST_PATH, INDEX_VERSION_PATH, BM25_DIR, SECTIONS_DIR, NEAR_DUP_DIR
+    global QUANTIZED_DIR, NUMPY_STORE_DIR
+    PERSIST_DIR = persist_dir
+    MANIFEST_PATH = os.path.join(persist_dir, "index_manifest.json")
+    INDEX_VERSION_PATH = os.path.join(persist_dir, "index_version")
+    BM25_DIR = os.path.join(persist_dir, "bm25")
+    SECTIONS_DIR = os.path.join(persist_dir, "sections")
+    NEAR_DUP_DIR = os.path.join(persist_dir, "near_dup")
+    QUANTIZED_DIR = os.path.join(persist_dir, "quantized")
+    NUMPY_STORE_DIR = os.path.join(persist_dir, "numpy")
+
+
+def find_markdown_files(base_dir):
+    """递归扫描目录下所有 .md 文件（按路径排序，保证构建顺序稳定）"""
+    return sorted(glob.glob(os.path.join(base_dir, "**/*.md"), recursive=True))
+
+
+def load_markdown_file(file_path):
     """
-    递归加载目录下所有 .md 文件
-    V5.1 新增：解析 YAML Frontmatter 四大金刚字段
+    加载单个 .md 文件，解析 YAML Frontmatter 四大金刚字段
+
+    Returns:
+        Document，加载失败返回 None
     """
     import frontmatter
+    from langchain.schema import Document
 
-    # 递归扫描所有子目录
-    md_files = glob.glob(os.path.join(base_dir, "**/*.md"), recursive=True)
-    logger.info(f"找到 {len(md_files)} 个 .md 文件")
+    filename = os.path.basename(file_path)
+    try:
+        # V5.1 使用 python-frontmatter 解析 Frontmatter
+        with open(file_path, 'r', encoding='utf-8') as f:
+            post = frontmatter.load(f)
 
-    documents = []
+        # 获取 Frontmatter 元数据（四大金刚）
+        fm_metadata = post.metadata
 
-    for file_path in md_files:
-        filename = os.path.basename(file_path)
-        try:
-            # V5.1 使用 python-frontmatter 解析 Frontmatter
-            with open(file_path, 'r', encoding='utf-8') as f:
-                post = frontmatter.load(f)
-
-            # 获取 Frontmatter 元数据（四大金刚）
-            fm_metadata = post.metadata
-
-            # 基础元数据
-            metadata = {
-                "source": fm_metadata.get('source', 'unknown'),
-                "filepath": file_path,
-                "filename": filename,
-                "created_at": fm_metadata.get('created_at', ''),
-                "author": fm_metadata.get('author', 'KAI'),
-                "content_type": fm_metadata.get('content_type', 'note')
-            }
-
-            # 创建 Document
-            from langchain.schema import Document
-            doc = Document(page_content=post.content, metadata=metadata)
-
-            documents.append(doc)
-            logger.info(f"  ✓ 加载: {filename} [{metadata['source']}]")
+        # 基础元数据
+        created_at = fm_metadata.get('created_at', '')
+        metadata = {
+            "source": fm_metadata.get('source', 'unknown'),
+            "filepath": file_path,
+            "filename": filename,
+            # 未加引号的 YAML 日期会被解析成 date，Chroma 元数据只接受标量
+            "created_at": str(created_at) if not isinstance(created_at, (str, int, float)) else created_at,
+            "author": fm_metadata.get('author', 'KAI'),
+            "content_type": fm_metadata.get('content_type', 'note')
+        }
+
+        # 过滤字段：数值日期 + 路径层级（检索端下推到 Chroma where）
+        created_date = date_to_int(created_at)
+        if created_date is not None:
+            metadata["created_date"] = created_date
+        metadata.update(path_levels(relative_path(file_path)))
+
+        # 创建 Document
+        doc = Document(page_content=post.content, metadata=metadata)
+        logger.info(f"  ✓ 加载: {filename} [{metadata['source']}]")
+        return doc
+
+    except Exception as e:
+        logger.warning(f"  ✗ 加载失败 {filename}: {e}")
+        return None
 
-        except Exception as e:
-            logger.warning(f"  ✗ 加载失败 {filename}: {e}")
+
+def iter_markdown_batches(md_files, batch_size=FILE_BATCH_SIZE):
+    """按固定文件数分批加载，逐批产出 [Document, ...]（加载失败的文件跳过）"""
+    for start in range(0, len(md_files), batch_size):
+        docs = [load_markdown_file(file_path) for file_path in md_files[start:start + batch_size]]
+        yield [doc for doc in docs if doc is not None]
+
+
+def load_markdown_files(base_dir, md_files=None):
+    """
+    递归加载目录下所有 .md 文件
+    V5.1 新增：解析 YAML Frontmatter 四大金刚字段
+
+    一次性返回全部文档，只用于小规模调试；构建流水线用 parse_files 分批解析切分
+
+    Args:
+        base_dir: 知识库根目录
+        md_files: 只加载指定的文件列表（增量模式），默认扫描整个目录
+    """
+    # 递归扫描所有子目录
+    if md_files is None:
+        md_files = find_markdown_files(base_dir)
+    logger.info(f"找到 {len(md_files)} 个 .md 文件")
+
+    documents = [doc for batch in iter_markdown_batches(md_files) for doc in batch]
 
     logger.info(f"成功加载 {len(documents)} 个文档")
     return documents
 
 
-def split_documents(documents):
+def iter_sections(documents):
     """
-    V3.3 混合切分策略：MarkdownHeaderTextSplitter + RecursiveCharacterTextSplitter
+    逐文档、逐标题小节切分（单遍切分，见 kai_engine/chunker.py）
 
-    第一层：按 Markdown 标题切分（保证语义完整性）
-    第二层：递归细切（防止单章过长）
+    Yields:
+        (小节元数据, 小节正文, [(片段正文, 片段元数据), ...])
     """
-    # 1. 第一层：按标题切分（保留层级元数据）
-    headers_to_split_on = [
-        ("#", "Header 1"),      # 一级标题
-        ("##", "Header 2"),     # 二级标题
-        ("###", "Header 3"),    # 三级标题
-    ]
-
-    # 先按标题切分
-    markdown_splitter = MarkdownHeaderTextSplitter(
-        headers_to_split_on=headers_to_split_on
-    )
-    header_splits = []
     for doc in documents:
-        splits = markdown_splitter.split_text(doc.page_content)
-        for split in splits:
+        for headers, content in split_sections(doc.page_content):
             # 保留原有元数据 + 添加标题元数据
-            split.metadata = {**doc.metadata, **split.metadata}
-            split.metadata['filepath'] = doc.metadata.get('filepath', '')
-            header_splits.append(split)
-
-    logger.info(f"第一层按标题切分: {len(header_splits)} 个片段")
-
-    # 2. 第二层：递归细切（防止单章过长）
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", "。", "！", "？", " "],  # 优先按段落和句子切
-        length_function=len,
-        add_start_index=True
-    )
+            metadata = {**doc.metadata, **headers}
+            chunks = [(text, {**metadata, 'start_index': start_index})
+                      for start_index, text in split_text(content, CHUNK_SIZE, CHUNK_OVERLAP)]
+            yield metadata, content, chunks
+
+
+def split_documents(documents, quiet=False):
+    """
+    V3.3 混合切分策略：按标题切分 + 递归细切
+
+    第一层：按标题切分（保证语义完整性）
+    第二层：递归细切（防止单章过长）
+
+    Args:
+        quiet: 流水线中逐文件调用时不打印统计日志
+    """
+    from langchain.schema import Document
 
-    chunks = text_splitter.split_documents(header_splits)
+    chunks = []
+    num_header_splits = 0
+    for _, _, section_chunks in iter_sections(documents):
+        num_header_splits += bool(section_chunks)
+        chunks.extend(Document(page_content=text, metadata=metadata) for text, metadata in section_chunks)
 
-    logger.info(f"第二层递归细切后: {len(chunks)} 个片段")
+    if not quiet:
+        logger.info(f"第一层按标题切分: {num_header_splits} 个片段")
+        logger.info(f"第二层递归细切后: {len(chunks)} 个片段")
     return chunks
 
 
-def create_vector_store(chunks, embeddings):
+def relative_path(file_path):
+    """文件相对知识库根目录的路径（作为清单的 key，不受软链接挂载位置影响）"""
+    return os.path.relpath(file_path, KNOWLEDGE_BASE_DIR)
+
+
+def file_content_hash(file_path):
+    """计算文件内容哈希（sha256）"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest():
+    """读取增量索引清单，不存在或损坏时返回 None"""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"读取索引清单失败，将全量重建: {e}")
+        return None
+
+
+def save_manifest(manifest):
+    """原子写入增量索引清单"""
+    os.makedirs(PERSIST_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def bump_index_version():
+    """写入新的索引版本号（纳秒时间戳）"""
+    os.makedirs(PERSIST_DIR, exist_ok=True)
+    tmp_path = INDEX_VERSION_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, INDEX_VERSION_PATH)
+
+
+def make_chunk_id(meta):
+    """
+    由片段元数据中的 (文件相对路径, 标题路径, start_index) 派生稳定的 chunk ID
+
+    同一文件内容不变时，重复构建得到完全相同的 ID，写入即幂等。
+    """
+    key = "\x1f".join([
+        relative_path(meta.get('filepath', '')),
+        meta.get('Header 1', ''),
+        meta.get('Header 2', ''),
+        meta.get('Header 3', ''),
+        str(meta.get('start_index', 0)),
+    ])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def assign_chunk_ids(metadatas):
+    """
+    为每个片段分配确定性 ID，并写入其元数据的 'chunk_id'
+
+    同一文件中标题路径与 start_index 完全相同的片段（如两个同名小节）
+    追加序号后缀区分，保证同批次 ID 唯一。
+
+    Returns:
+        ids: 与 metadatas 一一对应的 ID 列表
+        file_chunk_ids: {相对路径: [chunk_id, ...]}
+    """
+    ids = []
+    file_chunk_ids = {}
+    seen = {}
+    for meta in metadatas:
+        rel = relative_path(meta.get('filepath', ''))
+        base_id = make_chunk_id(meta)
+        dup = seen.get(base_id, 0)
+        seen[base_id] = dup + 1
+        chunk_id = base_id if dup == 0 else f"{base_id}-{dup}"
+        meta['chunk_id'] = chunk_id
+        file_chunk_ids.setdefault(rel, []).append(chunk_id)
+        ids.append(chunk_id)
+    return ids, file_chunk_ids
+
+
+def delete_ids(vectorstore, ids):
+    """
+    分批删除 chunk
+
+    Returns:
+        向量库中实际存在并被删除的片段数（近重复别名从未写入，不计入）
+    """
+    deleted = 0
+    for start in range(0, len(ids), WRITE_BATCH_SIZE):
+        existing = vectorstore._collection.get(ids=ids[start:start + WRITE_BATCH_SIZE], include=[])['ids']
+        if existing:
+            vectorstore.delete(ids=existing)
+        deleted += len(existing)
+    return deleted
+
+
+# ========== 构建流水线 ==========
+# 解析切分 -> 向量化 -> 写入，阶段之间用有界队列连接（背压），
+# 各阶段并发执行：解析切分与向量化各在自己的进程池里跑，同时写入不停。
+
+_STAGE_DONE = object()
+
+
+class _StageError:
+    """上游阶段异常，沿队列传递到写入端抛出"""
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _iter_queue(q):
+    """消费上游队列直到结束标记"""
+    while True:
+        item = q.get()
+        if item is _STAGE_DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.exc
+        yield item
+
+
+def _start_stage(stage, out_q):
+    """在后台线程中运行一个阶段（生成器），产出写入 out_q"""
+    def runner():
+        try:
+            for item in stage:
+                out_q.put(item)
+            out_q.put(_STAGE_DONE)
+        except Exception as e:
+            out_q.put(_StageError(e))
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    return thread
+
+
+def _init_parse_worker(knowledge_base_dir):
+    """解析 worker 进程初始化：同步知识库根目录（chunk ID 与清单 key 依赖相对路径）"""
+    global KNOWLEDGE_BASE_DIR
+    KNOWLEDGE_BASE_DIR = knowledge_base_dir
+
+
+def parse_files(md_files, fingerprints=False):
+    """
+    加载 + 切分一批文件（可在 worker 进程中执行）
+
+    多片段小节的片段元数据写入 section_id，小节全文单独返回（见 kai_engine/sections.py）
+
+    Args:
+        fingerprints: 同时计算每个片段的 SimHash（近重复检测，见 kai_engine/near_dup.py）
+
+    Returns:
+        records: 紧凑片段记录 [(chunk_id, 正文, 元数据), ...]，按文件顺序、文件内片段顺序
+        sections: 多片段小节 [(section_id, 相对路径, 小节正文), ...]
+        simhashes: 与 records 一一对应的 SimHash；未要求时为 None
+    """
+    records = []
+    sections = []
+    for file_path in md_files:
+        doc = load_markdown_file(file_path)
+        if doc is None:
+            continue
+        rel = relative_path(file_path)
+        chunks = []
+        seen = {}
+        for section_meta, content, section_chunks in iter_sections([doc]):
+            if len(section_chunks) > 1:
+                # 同一文件中标题路径相同的小节追加序号区分
+                base_id = make_section_id(rel, section_meta)
+                dup = seen.get(base_id, 0)
+                seen[base_id] = dup + 1
+                section_id = base_id if dup == 0 else f"{base_id}-{dup}"
+                sections.append((section_id, rel, content))
+                for _, metadata in section_chunks:
+                    metadata['section_id'] = section_id
+            chunks.extend(section_chunks)
+        ids, _ = assign_chunk_ids([metadata for _, metadata in chunks])
+        records.extend((chunk_id, text, metadata) for chunk_id, (text, metadata) in zip(ids, chunks))
+    simhashes = [simhash(text) for _, text, _ in records] if fingerprints else None
+    return records, sections, simhashes
+
+
+def _parse_stage(md_files, workers, fingerprints=False):
+    """
+    按 FILE_BATCH_SIZE 个文件一批解析切分，按文件顺序产出 parse_files 的结果 (片段记录, 小节, SimHash)
+
+    workers > 1 且不止一批时用进程池（spawn），同时在途的批数不超过 workers * 2
+    """
+    batches = [md_files[i:i + FILE_BATCH_SIZE] for i in range(0, len(md_files), FILE_BATCH_SIZE)]
+    workers = min(workers, len(batches))
+    if workers <= 1:
+        for files in batches:
+            yield parse_files(files, fingerprints)
+        return
+
+    import multiprocessing
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_parse_worker,
+        initargs=(KNOWLEDGE_BASE_DIR,),
+    ) as pool:
+        in_flight = deque()
+        for files in batches:
+            in_flight.append(pool.submit(parse_files, files, fingerprints))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def _rebatch_stage(parsed, batch_size, sections=None, near_dup=None, aliased=None):
+    """
+    把按文件批产出的片段记录重新攒成 batch_size 个一批（向量化批次）
+
+    sections（SectionWriter）不为 None 时，各批的小节直接追加写入小节数据文件；near_dup 不为 None 时，
+    与已登记片段近重复的片段不进入向量化批次，(chunk_id, 相对路径) 记入 aliased
+    """
+    batch = []
+    for records, file_sections, simhashes in parsed:
+        if sections is not None:
+            sections.add(file_sections)
+        for i, record in enumerate(records):
+            if near_dup is not None:
+                chunk_id, _, metadata = record
+                rel = relative_path(metadata.get('filepath', ''))
+                if near_dup.add(chunk_id, simhashes[i], rel) is not None:
+                    aliased.append((chunk_id, rel))
+                    continue
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def run_index_pipeline(md_files, vectorstore, embedder, bm25=None, workers=1, sections=None, near_dup=None):
+    """
+    流式构建：解析切分 -> 向量化 -> 写入
+
+    bm25 不为 None 时，写入的片段同时加入 BM25 索引；sections（SectionWriter）不为 None 时，多片段小节流式写入小节数据文件；
+    near_dup 不为 None 时，近重复片段只登记为别名，不向量化、不写入（仍计入 file_chunk_ids，
+    增量构建时随文件一起清理）。
+
+    Args:
+        workers: 解析切分进程数（1 = 在后台线程内串行解析）
+
+    Returns:
+        file_chunk_ids: {相对路径: [chunk_id, ...]}
+    """
+    records_q = queue.Queue(maxsize=QUEUE_MAXSIZE)
+    batches_q = queue.Queue(maxsize=QUEUE_MAXSIZE)
+    vectors_q = queue.Queue(maxsize=QUEUE_MAXSIZE)
+
+    aliased = []
+    _start_stage(_parse_stage(md_files, workers, fingerprints=near_dup is not None), records_q)
+    _start_stage(_rebatch_stage(_iter_queue(records_q), embedder.batch_size, sections, near_dup, aliased),
+                 batches_q)
+    _start_stage(
+        embedder.map_batches(
+            (batch, [text for _, text, _ in batch])
+            for batch in _iter_queue(batches_q)
+        ),
+        vectors_q,
+    )
+
+    # 写入阶段在主线程：按 ID upsert 预先算好的向量
+    file_chunk_ids = {}
+    written = 0
+    for batch, vectors in _iter_queue(vectors_q):
+        ids = [chunk_id for chunk_id, _, _ in batch]
+        texts = [text for _, text, _ in batch]
+        vectorstore._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            metadatas=[metadata for _, _, metadata in batch],
+            documents=texts,
+        )
+        if bm25 is not None:
+            bm25.add(ids, texts)
+        for chunk_id, _, metadata in batch:
+            rel = relative_path(metadata.get('filepath', ''))
+            file_chunk_ids.setdefault(rel, []).append(chunk_id)
+        written += len(batch)
+        logger.info(f"  写入 {written} 个片段")
+
+    # 写入阶段结束时重组阶段已退出，aliased 不再变化
+    for chunk_id, rel in aliased:
+        file_chunk_ids.setdefault(rel, []).append(chunk_id)
+    if aliased:
+        logger.info(f"  近重复片段 {len(aliased)} 个（只登记别名，未写入）")
+    return file_chunk_ids
+
+
+def iter_collection(vectorstore, include):
+    """分批读出 Chroma 全部片段，逐批产出 Chroma get() 的结果"""
+    offset = 0
+    while True:
+        rows = vectorstore._collection.get(include=include, limit=WRITE_BATCH_SIZE, offset=offset)
+        if not len(rows['ids']):
+            return
+        yield rows
+        offset += len(rows['ids'])
+
+
+def read_collection(vectorstore, include):
+    """
+    读出 Chroma 全部片段：{"ids": [...], 各 include 字段: [...]}
+
+    embeddings 直接拼成 float32 矩阵（逐批写入预分配数组，不经过 Python float 列表）
+    """
+    data = {"ids": [], **{field: [] for field in include if field != "embeddings"}}
+    matrix = None
+    for rows in iter_collection(vectorstore, include):
+        start = len(data["ids"])
+        for field in data:
+            data[field].extend(rows[field])
+        if "embeddings" in include:
+            batch = np.asarray(rows["embeddings"], dtype=np.float32)
+            if matrix is None:
+                matrix = np.empty((vectorstore._collection.count(), batch.shape[1]), dtype=np.float32)
+            matrix[start:start + len(batch)] = batch
+    if "embeddings" in include:
+        data["embeddings"] = matrix[:len(data["ids"])] if matrix is not None else np.zeros((0, 0), np.float32)
+    return data
+
+
+def _remove_index_dir(index_dir):
+    for name in os.listdir(index_dir):
+        os.remove(os.path.join(index_dir, name))
+    os.rmdir(index_dir)
+
+
+def quantized_config():
+    """已有量化索引的配置 (dtype, pq_m)，没有时返回 None"""
+    meta_path = os.path.join(QUANTIZED_DIR, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return meta["dtype"], meta.get("pq_m", 0)
+
+
+def resolve_quantize_config(dtype, pq_m):
+    """
+    命令行参数 -> 本次要写的量化配置 (dtype, pq_m)
+
+    未指定 --quantize 时沿用已有配置；"none" 删除已有量化索引。返回 None 表示不写量化索引。
+    """
+    existing = quantized_config()
+    if dtype == "none":
+        if existing is not None:
+            _remove_index_dir(QUANTIZED_DIR)
+            bump_index_version()
+            logger.info("已删除量化向量索引")
+        return None
+    if dtype is None:
+        if existing is None:
+            return None
+        return existing[0], existing[1] if pq_m is None else pq_m
+    return dtype, pq_m or 0
+
+
+def write_quantized_index(vectorstore, config):
+    """从 Chroma 读出全部向量，重建量化索引"""
+    rows = read_collection(vectorstore, ["embeddings"])
+    dtype, pq_m = config
+    QuantizedIndex.build(QUANTIZED_DIR, rows['ids'], rows['embeddings'], dtype=dtype, pq_m=pq_m)
+    logger.info(f"量化向量索引: {len(rows['ids'])} 个片段（{dtype}" + (f" + PQ{pq_m}" if pq_m else "") + "）")
+
+
+def numpy_store_config():
+    """已有 NumPy 向量库的 IVF 分区数（0 = 暴力检索），没有时返回 None"""
+    meta_path = os.path.join(NUMPY_STORE_DIR, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("ivf_lists", 0)
+
+
+def resolve_backend_config(backend, ivf_lists):
+    """
+    命令行参数 -> 本次要写的 NumPy 向量库 IVF 分区数
+
+    未指定 --backend 时沿用已有配置；"chroma" 删除已有 NumPy 库。返回 None 表示不写 NumPy 库。
     """
-    创建 Chroma 向量数据库并持久化
+    existing = numpy_store_config()
+    if backend == "chroma":
+        if existing is not None:
+            _remove_index_dir(NUMPY_STORE_DIR)
+            bump_index_version()
+            logger.info("已删除 NumPy 向量库，检索端改回 Chroma")
+        return None
+    if backend is None:
+        if existing is None:
+            return None
+        return existing if ivf_lists is None else ivf_lists
+    return ivf_lists or 0
+
+
+def write_numpy_store(vectorstore, ivf_lists):
+    """从 Chroma 读出全部片段，重建 NumPy 向量库"""
+    rows = read_collection(vectorstore, ["embeddings", "documents", "metadatas"])
+    NumpyStore.build(NUMPY_STORE_DIR, rows['ids'], rows['embeddings'], rows['documents'], rows['metadatas'],
+                     ivf_lists=ivf_lists)
+    logger.info(f"NumPy 向量库: {len(rows['ids'])} 个片段（" + (f"IVF {ivf_lists} 分区" if ivf_lists else "暴力检索") + "）")
+
+
+def count_aliases(file_chunk_ids, near_dup):
+    """file_chunk_ids 中只登记为别名（未写入向量库）的片段数"""
+    aliases = near_dup.alias_files()
+    return sum(1 for ids in file_chunk_ids.values() for chunk_id in ids if chunk_id in aliases)
+
+
+def log_near_dup_report(near_dup):
+    """按来源目录（分片粒度，见 kai_engine/shards.py）打印近重复比例"""
+    report = near_dup.folder_report(shard_of)
+    total = sum(n for n, _ in report.values())
+    logger.info(f"近重复片段: {near_dup.num_aliases()} / {total}（汉明距离 <= {near_dup.max_distance}）")
+    for folder, (n, dups) in sorted(report.items()):
+        if dups:
+            logger.info(f"  {folder}: {dups} / {n} 个片段近重复（{dups / n:.1%}）")
+
+
+def create_vector_store(md_files, embeddings, embedder, quantize=None, ivf_lists=None, workers=1,
+                        near_dup_distance=None, near_dup=None):
+    """
+    创建/更新 Chroma 向量数据库并持久化
+
+    按确定性 ID upsert：重复构建不会追加重复向量。
+    写入后清理库中不属于本次构建的旧片段（已删除的文件、旧版无 ID 构建遗留的向量），
+    保证集合大小与知识库一致。
+
+    Args:
+        quantize: 量化索引配置 (dtype, pq_m)，None 不生成
+        ivf_lists: NumPy 向量库 IVF 分区数（0 = 暴力检索），None 不生成
+        workers: 解析切分进程数
+        near_dup_distance: 近重复判定的 SimHash 汉明距离上限（0 = 不去重），None 用默认值
+        near_dup: 分片构建时各分片共用的近重复索引（已去掉本分片的旧登记），None 新建
+
+    Returns:
+        vectorstore, file_chunk_ids, 只登记为别名的片段数
     """
-    # 如果已存在数据库，先删除
     if os.path.exists(PERSIST_DIR):
-        logger.info(f"发现已存在的数据库，将覆盖更新...")
+        logger.info(f"发现已存在的数据库，将按 chunk ID 覆盖更新...")
 
     logger.info("正在创建向量数据库...")
 
-    # 创建 Chroma 向量库
-    vectorstore = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=PERSIST_DIR
-    )
+    vectorstore = Chroma(persist_directory=PERSIST_DIR, embedding_function=embeddings)
+    bm25 = BM25Index()
+    sections = SectionWriter(SECTIONS_DIR)
+    shared = near_dup is not None
+    if near_dup is None:
+        near_dup = NearDuplicateIndex(DEFAULT_MAX_DISTANCE if near_dup_distance is None else near_dup_distance)
+    try:
+        file_chunk_ids = run_index_pipeline(md_files, vectorstore, embedder, bm25, workers, sections, near_dup)
+    except BaseException:
+        sections.abort()
+        raise
+
+    # 清理孤儿片段（含上次写入、这次成为别名的片段）
+    aliases = near_dup.alias_files()
+    current_ids = {i for ids in file_chunk_ids.values() for i in ids if i not in aliases}
+    existing_ids = vectorstore._collection.get(include=[])['ids']
+    orphan_ids = [i for i in existing_ids if i not in current_ids]
+    if orphan_ids:
+        delete_ids(vectorstore, orphan_ids)
+        logger.info(f"已清理 {len(orphan_ids)} 个过期片段")
+
+    # Chroma 指定 persist_directory 时写入即落盘，不再调用已弃用的 persist()
+    bm25.save(BM25_DIR)
+    logger.info(f"BM25 索引: {len(bm25)} 个片段（分词器 {bm25.tokenizer}）")
+    sections.commit()
+    logger.info(f"小节索引: {len(sections)} 个多片段小节")
+    files = {relative_path(p) for p in md_files}
+    near_dup.save(NEAR_DUP_DIR, keep=files.__contains__)
+    if not shared:
+        log_near_dup_report(near_dup)
+    if quantize is not None:
+        write_quantized_index(vectorstore, quantize)
+    if ivf_lists is not None:
+        write_numpy_store(vectorstore, ivf_lists)
+    bump_index_version()
+
+    logger.info(f"✓ 向量数据库已保存到: {PERSIST_DIR}（共 {vectorstore._collection.count()} 个片段）")
+    return vectorstore, file_chunk_ids, count_aliases(file_chunk_ids, near_dup)
+
+
+def build_manifest(md_files, file_chunk_ids):
+    """根据本次处理的文件生成清单条目"""
+    manifest = {}
+    for file_path in md_files:
+        rel = relative_path(file_path)
+        manifest[rel] = {
+            "hash": file_content_hash(file_path),
+            "chunk_ids": file_chunk_ids.get(rel, [])
+        }
+    return manifest
+
+
+def load_bm25_index(vectorstore):
+    """
+    读取 BM25 索引；不存在或分词器不可用时按 Chroma 现有内容重建
+
+    Returns:
+        (bm25, 是否重建)
+    """
+    bm25 = BM25Index.load(BM25_DIR)
+    if bm25 is not None and bm25.tokenizer == BM25Index().tokenizer:
+        return bm25, False
+
+    logger.info("BM25 索引缺失或分词器变化，按向量库内容重建...")
+    bm25 = BM25Index()
+    for rows in iter_collection(vectorstore, ["documents"]):
+        bm25.add(rows['ids'], rows['documents'])
+    return bm25, True
+
+
+def incremental_update(embeddings, manifest, embedder, quantize=None, ivf_lists=None, md_files=None,
+                       workers=1, near_dup_distance=None, near_dup=None, force_files=()):
+    """
+    增量更新：对比内容哈希，只处理变化的部分
 
-    # 确保数据持久化
-    vectorstore.persist()
+    - 新增/修改的文件：删除旧 chunk，重新切分、向量化并写入
+    - 已删除的文件：删除其全部 chunk
+    - 未变化的文件：跳过（不加载、不切分、不向量化）
+    - 别名所在的未变化文件：代表片段被删除时一并重新处理（否则别名片段会从索引中消失）
 
-    logger.info(f"✓ 向量数据库已保存到: {PERSIST_DIR}")
-    return vectorstore
+    Args:
+        md_files: 当前索引目录负责的全部文件（分片时只含本分片），默认扫描整个知识库
+        workers: 解析切分进程数
+        near_dup_distance: 近重复判定的汉明距离上限，None 沿用已有配置
+        near_dup: 分片构建时各分片共用的近重复索引，None 读取本目录的索引
+        force_files: 内容未变也要重新处理的文件相对路径（别名的代表在其他分片被删除）
+
+    Returns:
+        vectorstore, 写入的片段数, 只登记为别名的片段数
+    """
+    if md_files is None:
+        md_files = find_markdown_files(KNOWLEDGE_BASE_DIR)
+    current = {relative_path(p): p for p in md_files}
+
+    changed_files = []
+    for rel, file_path in current.items():
+        entry = manifest.get(rel)
+        if rel in force_files or entry is None or entry.get('hash') != file_content_hash(file_path):
+            changed_files.append(file_path)
+    removed = [rel for rel in manifest if rel not in current]
+
+    shared = near_dup is not None
+    if near_dup is None:
+        near_dup = NearDuplicateIndex.load(NEAR_DUP_DIR, near_dup_distance)
+    if near_dup is None:
+        # 未变化文件的片段没有指纹：新片段只在本次变化的文件之间判重（全量重建一次可覆盖全部文件）
+        logger.info("未找到近重复指纹，只在本次变化的文件之间判重")
+        near_dup = NearDuplicateIndex(DEFAULT_MAX_DISTANCE if near_dup_distance is None else near_dup_distance)
+    # 代表片段将被删除的别名文件也要重新处理（直到不再牵连新文件）
+    pending = {relative_path(p) for p in changed_files} | set(removed)
+    while True:
+        stale = [i for rel in pending for i in manifest.get(rel, {}).get('chunk_ids', [])]
+        orphans = {rel for rel in near_dup.orphaned_files(stale) if rel in current} - pending
+        if not orphans:
+            break
+        pending |= orphans
+        changed_files.extend(current[rel] for rel in sorted(orphans))
+    changed_files.sort()
+
+    logger.info(f"增量检测: {len(changed_files)} 个新增/修改, {len(removed)} 个删除, "
+                f"{len(current) - len(changed_files)} 个未变化")
+
+    vectorstore = Chroma(persist_directory=PERSIST_DIR, embedding_function=embeddings)
+
+    # 1. 删除修改/删除文件的旧 chunk
+    stale_ids = []
+    for file_path in changed_files:
+        stale_ids.extend(manifest.get(relative_path(file_path), {}).get('chunk_ids', []))
+    for rel in removed:
+        stale_ids.extend(manifest[rel].get('chunk_ids', []))
+    deleted = delete_ids(vectorstore, stale_ids)
+    if stale_ids:
+        # 不在向量库里的是近重复别名（从未写入），单独计数
+        logger.info(f"已删除 {deleted} 个旧片段"
+                    + (f"（另有 {len(stale_ids) - deleted} 个近重复别名）" if len(stale_ids) > deleted else ""))
+    bm25, bm25_rebuilt = load_bm25_index(vectorstore)
+    bm25.remove(stale_ids)
+    changed = bool(changed_files or removed)
+    sections = None
+    base = SectionIndex.load(SECTIONS_DIR)
+    if changed or base is None:
+        if base is None:
+            # 小节正文无法从向量库还原：未变化文件的片段没有 section_id，检索时按片段本身注入
+            logger.info("未找到小节索引，只为本次变化的文件建立（全量重建一次可覆盖全部文件）")
+        # 未变化文件的小节逐条拷贝进新数据文件，变化文件的小节在流水线中重新写入
+        sections = SectionWriter(SECTIONS_DIR, base, drop_files=[relative_path(p) for p in changed_files] + removed)
+    near_dup.remove(stale_ids)
+
+    # 2. 加载 + 切分 + 向量化 + 写入变化的文件
+    try:
+        file_chunk_ids = run_index_pipeline(changed_files, vectorstore, embedder, bm25, workers, sections,
+                                            near_dup) if changed_files else {}
+    except BaseException:
+        if sections is not None:
+            sections.abort()
+        raise
+
+    # 3. 更新清单
+    for rel in removed:
+        manifest.pop(rel, None)
+    manifest.update(build_manifest(changed_files, file_chunk_ids))
+    save_manifest(manifest)
+    if changed or bm25_rebuilt:
+        bm25.save(BM25_DIR)
+    if sections is not None:
+        sections.commit()
+    if changed or not os.path.exists(NEAR_DUP_DIR):
+        near_dup.save(NEAR_DUP_DIR, keep=current.__contains__)
+    if changed and not shared:
+        log_near_dup_report(near_dup)
+    quantize_stale = quantize is not None and (changed or quantize != quantized_config())
+    if quantize_stale:
+        write_quantized_index(vectorstore, quantize)
+    numpy_stale = ivf_lists is not None and (changed or ivf_lists != numpy_store_config())
+    if numpy_stale:
+        write_numpy_store(vectorstore, ivf_lists)
+    if changed or bm25_rebuilt or quantize_stale or numpy_stale:
+        bump_index_version()
+
+    num_aliases = count_aliases(file_chunk_ids, near_dup)
+    return vectorstore, sum(len(ids) for ids in file_chunk_ids.values()) - num_aliases, num_aliases
+
+
+def build_index_dir(md_files, embeddings, embedder, args, near_dup=None, force_files=None):
+    """
+    构建/增量更新当前索引目录（PERSIST_DIR）
+
+    Args:
+        md_files: 该目录负责的全部文件
+        near_dup: 分片构建时各分片共用的近重复索引
+        force_files: 不为 None 时按增量处理，并强制重新处理其中的文件
+
+    Returns:
+        (是否增量, 写入的片段数, 只登记为别名的片段数)
+    """
+    incremental = args.incremental or force_files is not None
+    manifest = load_manifest() if incremental else None
+    if incremental and manifest is None:
+        logger.info("未找到索引清单，执行全量重建")
+    quantize = resolve_quantize_config(args.quantize, args.pq_subspaces)
+    ivf_lists = resolve_backend_config(args.backend, args.ivf_lists)
+
+    if manifest is not None:
+        _, num_chunks, num_aliases = incremental_update(embeddings, manifest, embedder, quantize, ivf_lists,
+                                                        md_files, args.workers, args.near_dup_distance,
+                                                        near_dup, force_files or ())
+        return True, num_chunks, num_aliases
+
+    if near_dup is not None:
+        # 分片全量重建：先去掉本分片在共用近重复索引里的旧登记
+        shard = shard_of(relative_path(md_files[0]))
+        near_dup.remove(near_dup.chunk_ids(lambda rel: shard_of(rel) == shard))
+    _, file_chunk_ids, num_aliases = create_vector_store(md_files, embeddings, embedder, quantize, ivf_lists,
+                                                         args.workers, args.near_dup_distance, near_dup)
+    save_manifest(build_manifest(md_files, file_chunk_ids))
+    return False, sum(len(ids) for ids in file_chunk_ids.values()) - num_aliases, num_aliases
+
+
+def resolve_shard_mode(mode, only):
+    """
+    命令行参数 -> 是否按分片构建
+
+    未指定 --shards 时沿用已有布局（SHARDS_DIR 下已有分片即分片），指定 --shard 视为 on；
+    "off" 删除全部分片，回到单一索引。
+    """
+    if mode == "off":
+        if os.path.exists(SHARDS_DIR):
+            shutil.rmtree(SHARDS_DIR)
+            bump_index_version()
+            logger.info("已删除分片索引，回到单一索引")
+        return False
+    return mode == "on" or bool(only) or bool(list_shards(SHARDS_DIR))
+
+
+def load_shards_near_dup(shards, max_distance=None):
+    """
+    合并读入各分片的近重复索引（分片构建时各分片共用一份，跨分片判重）
+
+    Args:
+        max_distance: 覆盖保存时的判重阈值，None 沿用已有配置（都没有时用默认值）
+    """
+    merged = None
+    for shard in shards:
+        index = NearDuplicateIndex.load(os.path.join(SHARDS_DIR, shard_dir_name(shard), "near_dup"), max_distance)
+        if index is None:
+            continue
+        if merged is None:
+            merged = index
+        else:
+            merged.merge(index)
+    if merged is None:
+        merged = NearDuplicateIndex(DEFAULT_MAX_DISTANCE if max_distance is None else max_distance)
+    return merged
+
+
+def build_shard(shard, files, embeddings, embedder, args, near_dup, force_files=None):
+    """
+    构建/增量更新一个分片；知识库里已没有文件的分片直接删除
+
+    Args:
+        near_dup: 各分片共用的近重复索引
+        force_files: 见 build_index_dir
+
+    Returns:
+        (写入的片段数, 只登记为别名的片段数, {被丢弃的别名 chunk ID: 别名所在文件})
+        ——别名的代表在本分片被删除，别名所在的其他分片文件需要重新处理
+    """
+    before = near_dup.alias_files()
+    num_chunks = num_aliases = 0
+    shard_dir = os.path.join(SHARDS_DIR, shard_dir_name(shard))
+    if not files:
+        near_dup.remove(near_dup.chunk_ids(lambda rel: shard_of(rel) == shard))
+        if os.path.exists(shard_dir):
+            shutil.rmtree(shard_dir)
+            logger.info(f"分片 {shard}: 知识库中已无文件，已删除")
+        else:
+            logger.warning(f"分片 {shard}: 知识库中没有对应文件，跳过")
+    else:
+        print(f"🧩 分片 {shard}（{len(files)} 个文件）")
+        set_index_dir(shard_dir)
+        _, num_chunks, num_aliases = build_index_dir(files, embeddings, embedder, args, near_dup, force_files)
+    after = near_dup.alias_files()
+    dropped = {alias: rel for alias, rel in before.items() if alias not in after and shard_of(rel) != shard}
+    return num_chunks, num_aliases, dropped
+
+
+def build_shards(md_files, embeddings, embedder, args):
+    """
+    按分片构建：每个分片是 SHARDS_DIR 下独立的索引目录，互不影响
+
+    args.shard 指定时只构建这些分片；否则构建全部分片，并删除知识库里已没有文件的分片。
+    近重复索引各分片共用：某分片删除的代表片段在其他分片有别名时，别名所在文件随后在其分片里
+    重新处理（该分片不在 args.shard 中也一样）。
+
+    Returns:
+        (写入的片段总数, 只登记为别名的片段总数)
+    """
+    groups = {}
+    for file_path in md_files:
+        groups.setdefault(shard_of(relative_path(file_path)), []).append(file_path)
+    current = {relative_path(p) for p in md_files}
+    targets = args.shard or sorted(set(groups) | set(list_shards(SHARDS_DIR)))
+    # 全量重建全部分片时从空索引开始，否则合并已有分片的索引
+    rebuild_all = not args.incremental and not args.shard
+    near_dup = load_shards_near_dup([] if rebuild_all else list_shards(SHARDS_DIR), args.near_dup_distance)
+
+    root_dir = PERSIST_DIR
+    total = total_aliases = 0
+    orphans = {}    # 分片 -> {需重新处理的别名所在文件}
+    pending = list(targets)
+    try:
+        while pending or orphans:
+            if pending:
+                shard = pending.pop(0)
+                # 全量重建的分片本身会重新处理全部文件
+                forced = orphans.pop(shard, None)
+                force_files = forced if args.incremental else None
+            else:
+                shard = min(orphans)
+                force_files = orphans.pop(shard)
+                logger.info(f"分片 {shard}: {len(force_files)} 个文件的近重复代表在其他分片被删除，重新处理")
+            num_chunks, num_aliases, dropped = build_shard(shard, groups.get(shard, []), embeddings, embedder,
+                                                           args, near_dup, force_files)
+            total += num_chunks
+            total_aliases += num_aliases
+            for rel in dropped.values():
+                if rel in current:
+                    orphans.setdefault(shard_of(rel), set()).add(rel)
+    finally:
+        set_index_dir(root_dir)
+    log_near_dup_report(near_dup)
+    return total, total_aliases
+
+
+def log_cache_stats(embedder):
+    """打印 embedding 缓存命中情况"""
+    if embedder.cache is None:
+        return
+    total = embedder.cache_hits + embedder.cache_misses
+    if total:
+        logger.info(f"Embedding 缓存命中 {embedder.cache_hits}/{total} "
+                    f"({embedder.cache_hits / total:.0%})，新编码 {embedder.cache_misses} 个片段")
 
 
 def main():
     """
     主流程：加载 -> 切分 -> 向量化 -> 存储
     """
+    parser = argparse.ArgumentParser(description="KAI 知识库向量化脚本")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量模式：只处理新增/修改/删除的文件（无清单时自动全量重建）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_PARSE_WORKERS,
+                        help=f"Markdown 解析/切分进程数（默认 {DEFAULT_PARSE_WORKERS}；1 = 不开进程池）")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"每个 embedding batch 的片段数（默认 {DEFAULT_BATCH_SIZE}）")
+    parser.add_argument("--embed-workers", type=int, default=None,
+                        help="embedding 进程数（默认 CPU 核数 / 每进程线程数；1 = 单进程）")
+    parser.add_argument("--threads-per-worker", type=int, default=DEFAULT_THREADS_PER_WORKER,
+                        help=f"每个 embedding 进程的 torch 线程数（默认 {DEFAULT_THREADS_PER_WORKER}）")
+    parser.add_argument("--quantize", choices=[*QUANTIZE_TYPES, "none"], default=None,
+                        help="额外生成 fp16/int8 量化向量索引（默认沿用已有配置；none = 删除）")
+    parser.add_argument("--pq-subspaces", type=int, default=None,
+                        help="量化索引的 PQ 子空间数（须整除 768，如 96；0 = 不用 PQ）")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=None,
+                        help="检索端向量库：numpy = 额外导出 NumPy 向量库；chroma = 删除 NumPy 库（默认沿用已有配置）")
+    parser.add_argument("--ivf-lists", type=int, default=None,
+                        help="NumPy 向量库的 IVF 分区数（如 64；0 = 暴力检索）")
+    parser.add_argument("--shards", choices=["on", "off"], default=None,
+                        help="按目录分片构建（on）或删除分片回到单一索引（off）；默认沿用已有布局")
+    parser.add_argument("--shard", action="append", default=None, metavar="NAME",
+                        help="只构建指定分片，如 00-Inbox/library（可重复；隐含 --shards on）")
+    parser.add_argument("--near-dup-distance", type=int, default=None,
+                        help=f"近重复片段判定的 SimHash 汉明距离上限（默认 {DEFAULT_MAX_DISTANCE}，增量时沿用已有配置；0 = 不去重）")
+    parser.add_argument("--no-embed-cache", action="store_true",
+                        help="不使用 embedding 缓存（强制重新编码所有片段）")
+    args = parser.parse_args()
+    if args.shard and args.shards == "off":
+        parser.error("--shard 不能与 --shards off 同时使用")
+
     print("=" * 60)
     print("KAI 知识库向量化脚本")
     print("=" * 60)
@@ -213,21 +1164,9 @@ def main():
         logger.error(f"知识库目录不存在: {KNOWLEDGE_BASE_DIR}")
         return
 
-    # 2. 加载文档
-    print(f"📂 加载文档: {KNOWLEDGE_BASE_DIR}")
-    documents = load_markdown_files(KNOWLEDGE_BASE_DIR)
-    print()
-
-    if not documents:
-        logger.warning("没有加载到任何文档")
-        return
-
-    # 3. 切分文档
-    print("🔪 切分文档...")
-    chunks = split_documents(documents)
-    print()
+    sharded = resolve_shard_mode(args.shards, args.shard)
 
-    # 4. 初始化 embedding 模型
+    # 2. 初始化 embedding 模型
     print("🤖 初始化 embedding 模型...")
     try:
         embeddings = get_embedding_model()
@@ -239,15 +1178,48 @@ def main():
         logger.error(f"初始化 embedding 失败: {e}")
         return
 
-    # 5. 创建向量库
-    print("💾 创建向量数据库...")
-    vectorstore = create_vector_store(chunks, embeddings)
+    embedder = ParallelEmbedder(
+        batch_size=args.batch_size,
+        workers=args.embed_workers,
+        threads_per_worker=args.threads_per_worker,
+        fallback=embeddings,
+        cache=None if args.no_embed_cache else EmbeddingCache(EMBEDDING_MODEL_NAME),
+    )
+    logger.info(f"Embedding 流水线: {embedder.workers} 进程 × {embedder.threads_per_worker} 线程, "
+                f"batch={embedder.batch_size}")
+    if embedder.cache is not None:
+        logger.info(f"Embedding 缓存: {len(embedder.cache)} 条 ({embedder.cache.dir})")
+
+    # 3. 扫描文档
+    print(f"📂 扫描文档: {KNOWLEDGE_BASE_DIR}")
+    md_files = find_markdown_files(KNOWLEDGE_BASE_DIR)
+    logger.info(f"找到 {len(md_files)} 个 .md 文件")
     print()
 
-    # 6. 统计信息
+    if not md_files and not args.incremental:
+        logger.warning("没有找到任何文档")
+        return
+
+    # 4. 加载 -> 切分 -> 向量化 -> 写入（流水线；增量模式只处理变化的文件）
+    with embedder:
+        if sharded:
+            print("🧩 按分片" + ("增量更新" if args.incremental else "创建") + "向量数据库...")
+            num_chunks, num_aliases = build_shards(md_files, embeddings, embedder, args)
+            incremental = args.incremental
+            location = SHARDS_DIR
+        else:
+            print("🔁 增量更新向量数据库..." if args.incremental else "💾 创建向量数据库...")
+            incremental, num_chunks, num_aliases = build_index_dir(md_files, embeddings, embedder, args)
+            location = PERSIST_DIR
+        log_cache_stats(embedder)
+        print()
+
+    # 5. 统计信息
     print("=" * 60)
-    print("✅ 成功索引了 {} 个片段".format(len(chunks)))
-    print(f"📁 向量库位置: {os.path.abspath(PERSIST_DIR)}")
+    print(("✅ 增量更新了 {} 个片段" if incremental else "✅ 成功索引了 {} 个片段").format(num_chunks))
+    if num_aliases:
+        print(f"🔗 另有 {num_aliases} 个近重复片段只登记为别名（未写入向量库）")
+    print(f"📁 向量库位置: {os.path.abspath(location)}")
     print("=" * 60)
 
 
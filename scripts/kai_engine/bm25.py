@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+BM25 - 中文关键词倒排索引
+KAI Brain 字面召回层：补足向量检索对精确术语（如 "GVM 公式"）不敏感的问题
+
+分词：
+    - jieba（已安装时）：lcut_for_search，长词同时产出子词
+    - ngram（默认回退）：中文连续片段切单字 + 相邻双字，英文/数字按词，统一小写
+    分词器写入索引元数据，检索端必须使用同一分词器
+
+存储格式（chroma_db_data/bm25/，由 build_index.py 与 Chroma 同步写入）：
+    meta.json   分词器、k1、b、文档数
+    index.npz   chunk ID 与词表（换行拼接的 UTF-8 字节）、文档长度、
+                倒排表（offsets + 文档下标 int32 + 词频 uint16）
+"""
+
+import os
+import re
+import json
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+
+_CJK_OR_WORD = re.compile(r"[一-鿿]+|[a-z0-9]+(?:\.[0-9]+)?")
+_TOKEN = re.compile(r"[一-鿿a-z0-9]")
+
+
+def jieba_available():
+    try:
+        import jieba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def default_tokenizer():
+    """已安装 jieba 时用 jieba，否则用 ngram"""
+    return "jieba" if jieba_available() else "ngram"
+
+
+def _normalize(text):
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text, tokenizer="ngram"):
+    """把文本切成检索词"""
+    text = _normalize(text)
+    if tokenizer == "jieba":
+        import jieba
+        return [t for t in (w.strip() for w in jieba.lcut_for_search(text)) if t and _TOKEN.search(t)]
+
+    tokens = []
+    for piece in _CJK_OR_WORD.findall(text):
+        if not "一" <= piece[0] <= "鿿":
+            tokens.append(piece)
+            continue
+        tokens.extend(piece)
+        tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return tokens
+
+
+def _pack_strings(strings):
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_strings(array):
+    data = array.tobytes().decode("utf-8")
+    return data.split("\n") if data else []
+
+
+class BM25Index:
+    """
+    BM25 倒排索引
+
+    - 构建端：add() / remove() 维护每个 chunk 的词频，save() 打包成紧凑的倒排数组
+    - 检索端：load() 只读取倒排数组，search() 用 numpy 累加得分
+    """
+
+    def __init__(self, tokenizer=None, k1=DEFAULT_K1, b=DEFAULT_B):
+        self.tokenizer = tokenizer or default_tokenizer()
+        self.k1 = k1
+        self.b = b
+        self._doc_terms = {}    # chunk_id -> Counter（构建端）
+        self._packed = None     # 检索端的倒排数组
+        self._term_rows = {}
+        self._doc_rows = {}
+        self._norm = None
+
+    def __len__(self):
+        if self._packed is not None:
+            return len(self._packed["chunk_ids"])
+        return len(self._doc_terms)
+
+    # ---------- 构建 ----------
+
+    def _ensure_doc_terms(self):
+        """从已打包的倒排表还原每个 chunk 的词频（增量更新时使用）"""
+        if self._packed is None:
+            return
+        p = self._packed
+        self._doc_terms = {chunk_id: Counter() for chunk_id in p["chunk_ids"]}
+        for row, term in enumerate(p["vocab"]):
+            start, end = p["offsets"][row], p["offsets"][row + 1]
+            for doc, tf in zip(p["postings_doc"][start:end], p["postings_tf"][start:end]):
+                self._doc_terms[p["chunk_ids"][doc]][term] = int(tf)
+        self._packed = None
+
+    def add(self, ids, texts):
+        """加入/覆盖 chunk"""
+        if not ids:
+            return
+        self._ensure_doc_terms()
+        for chunk_id, text in zip(ids, texts):
+            self._doc_terms[chunk_id] = Counter(tokenize(text, self.tokenizer))
+
+    def remove(self, ids):
+        if not ids:
+            return
+        self._ensure_doc_terms()
+        for chunk_id in ids:
+            self._doc_terms.pop(chunk_id, None)
+
+    def _pack(self):
+        if self._packed is not None:
+            return self._packed
+        chunk_ids = list(self._doc_terms)
+        postings = {}
+        for doc, chunk_id in enumerate(chunk_ids):
+            for term, tf in self._doc_terms[chunk_id].items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        vocab = sorted(postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for row, term in enumerate(vocab):
+            offsets[row + 1] = offsets[row] + len(postings[term])
+        flat = [entry for term in vocab for entry in postings[term]]
+        return {
+            "chunk_ids": chunk_ids,
+            "vocab": vocab,
+            "doc_len": np.array([sum(self._doc_terms[c].values()) for c in chunk_ids], dtype=np.int32),
+            "offsets": offsets,
+            "postings_doc": np.array([doc for doc, _ in flat], dtype=np.int32),
+            "postings_tf": np.array([min(tf, 65535) for _, tf in flat], dtype=np.uint16),
+        }
+
+    def save(self, index_dir):
+        """原子写入（先写临时文件再替换）"""
+        p = self._pack()
+        os.makedirs(index_dir, exist_ok=True)
+        npz_path = os.path.join(index_dir, "index.npz")
+        meta_path = os.path.join(index_dir, "meta.json")
+
+        tmp_npz = npz_path + ".tmp.npz"
+        np.savez(
+            tmp_npz,
+            chunk_ids=_pack_strings(p["chunk_ids"]),
+            vocab=_pack_strings(p["vocab"]),
+            doc_len=p["doc_len"],
+            offsets=p["offsets"],
+            postings_doc=p["postings_doc"],
+            postings_tf=p["postings_tf"],
+        )
+        os.replace(tmp_npz, npz_path)
+        tmp_meta = meta_path + ".tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({"tokenizer": self.tokenizer, "k1": self.k1, "b": self.b,
+                       "num_docs": len(p["chunk_ids"])}, f)
+        os.replace(tmp_meta, meta_path)
+
+    # ---------- 检索 ----------
+
+    @classmethod
+    def load(cls, index_dir):
+        """读取索引；不存在时返回 None"""
+        meta_path = os.path.join(index_dir, "meta.json")
+        npz_path = os.path.join(index_dir, "index.npz")
+        if not (os.path.exists(meta_path) and os.path.exists(npz_path)):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(tokenizer=meta["tokenizer"], k1=meta["k1"], b=meta["b"])
+        with np.load(npz_path, allow_pickle=False) as data:
+            vocab = _unpack_strings(data["vocab"])
+            index._packed = {
+                "chunk_ids": _unpack_strings(data["chunk_ids"]),
+                "vocab": vocab,
+                "doc_len": data["doc_len"],
+                "offsets": data["offsets"],
+                "postings_doc": data["postings_doc"],
+                "postings_tf": data["postings_tf"],
+            }
+        index._freeze()
+        return index
+
+    def _freeze(self):
+        """切换到检索态：打包倒排数组，预计算词表下标与长度归一项"""
+        self._packed = self._pack()
+        self._doc_terms = {}
+        p = self._packed
+        self._term_rows = {term: row for row, term in enumerate(p["vocab"])}
+        self._doc_rows = {chunk_id: row for row, chunk_id in enumerate(p["chunk_ids"])}
+        doc_len = p["doc_len"].astype(np.float32)
+        avg_len = max(float(doc_len.mean()), 1.0) if len(doc_len) else 1.0
+        self._norm = self.k1 * (1 - self.b + self.b * doc_len / avg_len)
+
+    def search(self, query, k=20, allowed=None):
+        """
+        Args:
+            allowed: 可选 chunk_id 集合，只在其中检索（元数据过滤）
+
+        Returns:
+            [(chunk_id, BM25 分), ...]，按分数降序，只含至少命中一个词的 chunk
+        """
+        if self._packed is None:
+            self._freeze()
+        p = self._packed
+        num_docs = len(p["chunk_ids"])
+        if num_docs == 0:
+            return []
+
+        scores = np.zeros(num_docs, dtype=np.float32)
+        for term in set(tokenize(query, self.tokenizer)):
+            row = self._term_rows.get(term)
+            if row is None:
+                continue
+            start, end = p["offsets"][row], p["offsets"][row + 1]
+            docs = p["postings_doc"][start:end]
+            tf = p["postings_tf"][start:end].astype(np.float32)
+            idf = np.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._norm[docs])
+
+        if allowed is not None:
+            mask = np.zeros(num_docs, dtype=bool)
+            mask[[self._doc_rows[c] for c in allowed if c in self._doc_rows]] = True
+            scores[~mask] = 0
+
+        hit = np.flatnonzero(scores)
+        if len(hit) == 0:
+            return []
+        top = hit[np.argsort(-scores[hit], kind="stable")[:k]]
+        return [(p["chunk_ids"][i], float(scores[i])) for i in top]
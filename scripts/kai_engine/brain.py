@@ -3,15 +3,32 @@
 KAI Brain V3.5 - RAG + Dynamic Persona + External Prompt Loading
 修复核心：
 让代码直接读取 'prompts/00_Basic_Chat.md'，确保 PREP 流程和语气约束生效。
+
+调用方式：
+    kai.think(query)                 # 命令行：边生成边打印，返回结构化结果
+    for item in kai.think_stream(q)  # 流式：先逐个产出 token(str)，最后产出结构化结果(dict)
+    await kai.athink(query)          # 异步：RAG 检索在线程池执行，与 Prompt 组装并行；归档写文件不阻塞事件循环
+
+结构化结果：
+    {"query", "response", "retrieved": [{"text", "score", "rerank_score", ...}],
+     "timings": {"retrieval_ms", "first_token_ms", "generation_ms", "total_ms"},
+     "tokens": {"prompt_estimate", "prompt", "completion", "context": {"budget", "tokens", "estimated", "packed", "trimmed", "dropped"}},
+     "archive_path"}
+
+Prompt 预算（见 context_packer.py）：
+    检索结果按精排分装入 CONTEXT_TOKEN_BUDGET（单条不超过 CHUNK_TOKEN_LIMIT，放不下的截断或丢弃），
+    风格样本装入 STYLE_TOKEN_BUDGET。预算按 context_packer 计数（没有本地分词器时为含余量的估算，
+    context.estimated=True）；tokens.prompt / completion 为 API 返回的实际用量（不支持时为 None）
 """
 import os
 import sys
 import json
 import random
+import time
+import asyncio
 import datetime
 import re
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # 路径适配
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -24,18 +41,42 @@ PERSONA_PATH = os.path.join(PROJECT_ROOT, "data/persona/kai_work_v0.jsonl")
 SYSTEM_PROMPT_PATH = os.path.join(PROJECT_ROOT, "prompts/00_Basic_Chat.md")
 
 try:
-    from retrieval import search_knowledge_base
+    from retrieval import retrieve, warmup
+    from context_packer import estimate_tokens, estimate_messages_tokens, is_estimated, pack_contexts
 except ImportError:
-    from .retrieval import search_knowledge_base
+    from .retrieval import retrieve, warmup
+    from .context_packer import estimate_tokens, estimate_messages_tokens, is_estimated, pack_contexts
 
 load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
 
+# LLM 配置
+CHAT_MODEL = "deepseek-chat"
+CHAT_BASE_URL = "https://api.deepseek.com"
+CHAT_TEMPERATURE = 0.4
+RAG_TOP_K = 5
+STYLE_SAMPLE_K = 3
+
+# Prompt token 预算
+CONTEXT_TOKEN_BUDGET = int(os.getenv("KAI_CONTEXT_TOKENS", "3000"))   # 参考背景总预算
+CHUNK_TOKEN_LIMIT = int(os.getenv("KAI_CHUNK_TOKENS", "1000"))        # 单条检索结果上限
+MIN_TRIM_TOKENS = 100      # 剩余预算不足时不再截断装入
+STYLE_TOKEN_BUDGET = 400   # 风格样本预算
+
 class KAIBrain:
-    def __init__(self):
+    def __init__(self, preload=False):
+        """
+        Args:
+            preload: 启动时并行预热 Embedding/Chroma 与 Rerank 模型（Web 服务建议开启）
+        """
         api_key = os.getenv("DEEPSEEK_API_KEY")
         if not api_key: raise ValueError("❌ 缺少 DEEPSEEK_API_KEY")
 
-        self.client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
+        # openai 依赖 pydantic/httpx，导入较慢，只在真正创建大脑时加载
+        from openai import OpenAI, AsyncOpenAI
+
+        self.client = OpenAI(api_key=api_key, base_url=CHAT_BASE_URL)
+        # 异步客户端（athink 使用）
+        self.aclient = AsyncOpenAI(api_key=api_key, base_url=CHAT_BASE_URL)
 
         # 1. 加载 Few-Shot 语料
         self.gold_examples = self._load_gold_core()
@@ -43,6 +84,11 @@ class KAIBrain:
         # 2. ✅ 加载外部 System Prompt (你的 00_Basic_Chat.md)
         self.system_prompt = self._load_system_prompt()
 
+        # 3. 预热检索模型（各组件耗时见 self.warmup_timings）
+        self.warmup_timings = warmup() if preload else None
+        if preload:
+            is_estimated()     # 顺带加载 token 分词器（有的话），不占首个问题的耗时
+
     def _load_gold_core(self):
         """加载 JSONL 语料"""
         examples = []
@@ -76,10 +122,19 @@ class KAIBrain:
         风格：专业、冷峻、直接。
         """
 
-    def get_dynamic_examples(self, k=3):
-        """随机抽取风格样本"""
+    def get_dynamic_examples(self, k=3, token_budget=None):
+        """随机抽取风格样本（token_budget：样本总 token 上限，超出的样本跳过）"""
         if not self.gold_examples: return ""
         selected = random.sample(self.gold_examples, min(k, len(self.gold_examples)))
+        if token_budget is not None:
+            kept, used = [], 0
+            for text in selected:
+                tokens = estimate_tokens(text)
+                if used + tokens <= token_budget:
+                    kept.append(text)
+                    used += tokens
+            selected = kept
+            if not selected: return ""
         formatted = "\n".join([f"KAI语录{i+1}: {text}" for i, text in enumerate(selected)])
         return f"\n### 风格样本 (模仿这种语气)\n{formatted}\n"
 
@@ -118,25 +173,25 @@ tags: #KAI_Output #Brain_Dump
             print(f"⚠️ 文件写入失败: {e}")
             return None
 
-    def think(self, user_query):
-        # 1. RAG 检索
-        print(f"\n🧠 KAI 正在调取 RAG 记忆库...")
-        contexts = search_knowledge_base(user_query, top_k=5, rerank=True)
-
+    def _format_context(self, contexts):
+        """拼接 RAG 命中片段"""
         if contexts:
-            print(f"✅ 命中 {len(contexts)} 条高价值记忆")
-            context_str = "\n\n---\n\n".join(contexts)
-        else:
-            print(f"⚠️ 未命中知识库，启动 PREP 通用逻辑...")
-            context_str = "（知识库无直接记录）"
-
-        # 2. 动态注入
-        style_injection = self.get_dynamic_examples(k=3)
-
-        # 3. 组装最终 Prompt
-        # System: 来自 00_Basic_Chat.md
-        # User: 风格样本 + RAG资料 + 用户问题
-        messages = [
+            return "\n\n---\n\n".join(contexts)
+        return "（知识库无直接记录）"
+
+    def _pack_context(self, hits):
+        """按 token 预算装填命中片段并拼接，返回 (参考背景, 装填报告)"""
+        contexts, report = pack_contexts(hits, CONTEXT_TOKEN_BUDGET, chunk_limit=CHUNK_TOKEN_LIMIT,
+                                         min_tokens=MIN_TRIM_TOKENS)
+        return self._format_context(contexts), report
+
+    def _build_messages(self, user_query, context_str, style_injection):
+        """
+        组装最终 Prompt
+        System: 来自 00_Basic_Chat.md
+        User: 风格样本 + RAG资料 + 用户问题
+        """
+        return [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": f"""
             {style_injection}
@@ -153,25 +208,177 @@ tags: #KAI_Output #Brain_Dump
             """}
         ]
 
-        # 4. 生成
-        print("🗣️ KAI: ", end="", flush=True)
+    def _build_record(self, user_query, full_ans, hits, timings, tokens, archive_path):
+        """组装结构化结果"""
+        return {
+            "query": user_query,
+            "response": full_ans,
+            "retrieved": hits,
+            "timings": timings,
+            "tokens": tokens,
+            "archive_path": archive_path,
+        }
+
+    def think_stream(self, user_query, on_retrieved=None, filters=None):
+        """
+        流式思考：先逐个产出 token（str），最后产出一条结构化结果（dict）
+
+        Args:
+            on_retrieved: 检索完成后的回调，参数为命中列表（用于在首字之前提示进度）
+            filters: 检索元数据过滤（见 retrieval.retrieve）
+        """
+        t_start = time.perf_counter()
+
+        # 1. RAG 检索
+        hits = _retrieve_or_empty(user_query, filters)
+        t_retrieved = time.perf_counter()
+        if on_retrieved is not None:
+            on_retrieved(hits)
+
+        # 2. 动态注入 + 组装 Prompt
+        style_injection = self.get_dynamic_examples(k=STYLE_SAMPLE_K, token_budget=STYLE_TOKEN_BUDGET)
+        context_str, context_report = self._pack_context(hits)
+        messages = self._build_messages(user_query, context_str, style_injection)
+
+        # 3. 流式生成
+        t_request = time.perf_counter()
         response = self.client.chat.completions.create(
-            model="deepseek-chat",
+            model=CHAT_MODEL,
             messages=messages,
             stream=True,
-            temperature=0.4
+            stream_options={"include_usage": True},
+            temperature=CHAT_TEMPERATURE
         )
 
-        full_ans = ""
+        parts = []
+        t_first_token = None
+        usage = None
         for chunk in response:
-            if chunk.choices[0].delta.content:
+            usage = chunk.usage or usage
+            if chunk.choices and chunk.choices[0].delta.content:
                 c = chunk.choices[0].delta.content
-                print(c, end="", flush=True)
-                full_ans += c
-        print("\n")
+                if t_first_token is None:
+                    t_first_token = time.perf_counter()
+                parts.append(c)
+                yield c
+        t_done = time.perf_counter()
+        full_ans = "".join(parts)
 
         # ✅ 保存到文件
-        self._save_to_file(user_query, full_ans)
+        archive_path = self._save_to_file(user_query, full_ans)
+
+        timings = _timings_ms(t_start, t_retrieved, t_request, t_first_token, t_done)
+        tokens = _token_report(messages, context_report, usage)
+        yield self._build_record(user_query, full_ans, hits, timings, tokens, archive_path)
+
+    def think(self, user_query, filters=None):
+        """命令行思考：边生成边打印，返回结构化结果"""
+        print(f"\n🧠 KAI 正在调取 RAG 记忆库...")
+
+        def report_hits(hits):
+            if hits:
+                print(f"✅ 命中 {len(hits)} 条高价值记忆")
+            else:
+                print(f"⚠️ 未命中知识库，启动 PREP 通用逻辑...")
+            print("🗣️ KAI: ", end="", flush=True)
+
+        record = None
+        for item in self.think_stream(user_query, on_retrieved=report_hits, filters=filters):
+            if isinstance(item, dict):
+                record = item
+            else:
+                print(item, end="", flush=True)
+        print("\n")
+        if record is not None:
+            tokens = record["tokens"]
+            approx = "≈" if tokens['context']['estimated'] else ""
+            print(f"📦 Prompt {tokens['prompt'] or approx + str(tokens['prompt_estimate'])} tokens"
+                  f"（参考背景 {approx}{tokens['context']['tokens']}/{tokens['context']['budget']}，"
+                  f"截断 {tokens['context']['trimmed']} 条，丢弃 {tokens['context']['dropped']} 条）")
+        return record
+
+    async def athink(self, user_query, on_token=None, filters=None):
+        """
+        异步版 think：同一进程可并发处理多个问题
+
+        - RAG 检索（CPU/模型推理）放到默认线程池，同时在事件循环里准备风格样本
+        - 使用 AsyncOpenAI 流式生成，每个 token 回调 on_token（可选）
+        - 归档写文件放到线程里执行
+
+        Returns:
+            结构化结果（同 think）
+        """
+        loop = asyncio.get_running_loop()
+        t_start = time.perf_counter()
+
+        # 1. RAG 检索与风格样本准备并行
+        retrieval_future = loop.run_in_executor(None, _retrieve_or_empty, user_query, filters)
+        style_injection = self.get_dynamic_examples(k=STYLE_SAMPLE_K, token_budget=STYLE_TOKEN_BUDGET)
+        hits = await retrieval_future
+        t_retrieved = time.perf_counter()
+
+        # 2. 按 token 预算装填，组装 Prompt
+        context_str, context_report = self._pack_context(hits)
+        messages = self._build_messages(user_query, context_str, style_injection)
+
+        # 3. 异步流式生成
+        t_request = time.perf_counter()
+        response = await self.aclient.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            temperature=CHAT_TEMPERATURE
+        )
+
+        parts = []
+        t_first_token = None
+        usage = None
+        async for chunk in response:
+            usage = chunk.usage or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                c = chunk.choices[0].delta.content
+                if t_first_token is None:
+                    t_first_token = time.perf_counter()
+                parts.append(c)
+                if on_token is not None:
+                    on_token(c)
+        t_done = time.perf_counter()
+        full_ans = "".join(parts)
+
+        # 4. 归档（不阻塞事件循环）
+        archive_path = await asyncio.to_thread(self._save_to_file, user_query, full_ans)
+
+        timings = _timings_ms(t_start, t_retrieved, t_request, t_first_token, t_done)
+        tokens = _token_report(messages, context_report, usage)
+        return self._build_record(user_query, full_ans, hits, timings, tokens, archive_path)
+
+def _retrieve_or_empty(user_query, filters):
+    """RAG 检索；失败时提示并返回空列表（照常回答，只是没有知识库上下文）"""
+    try:
+        return retrieve(user_query, top_k=RAG_TOP_K, rerank=True, filters=filters)
+    except Exception as e:
+        print(f"⚠️ [Brain] 检索出错，本次不注入知识库内容: {e}")
+        return []
+
+def _timings_ms(t_start, t_retrieved, t_request, t_first_token, t_done):
+    """各阶段耗时（毫秒）；没有产出 token 时 first_token_ms 为 None"""
+    ms = lambda a, b: round((b - a) * 1000, 1)
+    return {
+        "retrieval_ms": ms(t_start, t_retrieved),
+        "first_token_ms": ms(t_start, t_first_token) if t_first_token is not None else None,
+        "generation_ms": ms(t_request, t_done),
+        "total_ms": ms(t_start, t_done),
+    }
+
+def _token_report(messages, context_report, usage):
+    """Prompt token 报告：估算值 + API 实际用量（流式响应末尾的 usage，缺失时为 None）"""
+    return {
+        "prompt_estimate": estimate_messages_tokens(messages),
+        "prompt": getattr(usage, "prompt_tokens", None),
+        "completion": getattr(usage, "completion_tokens", None),
+        "context": context_report,
+    }
 
 if __name__ == "__main__":
     # 确保 prompts 目录存在且有文件
@@ -180,7 +387,16 @@ if __name__ == "__main__":
         os.makedirs(prompt_dir)
         print(f"⚠️ 请将 00_Basic_Chat.md 放入 {prompt_dir}")
 
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2:
+        # 多个问题：异步并发处理
+        async def _think_all(queries):
+            kai = KAIBrain()
+            records = await asyncio.gather(*(kai.athink(q) for q in queries))
+            for record in records:
+                print(f"\n🧠 {record['query']}\n🗣️ KAI: {record['response']}\n")
+
+        asyncio.run(_think_all(sys.argv[1:]))
+    elif len(sys.argv) > 1:
         query = sys.argv[1]
         kai = KAIBrain()
         kai.think(query)
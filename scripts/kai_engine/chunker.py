@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Chunker - 单遍 Markdown 标题感知切分
+KAI Brain 构建端切分器：替代 MarkdownHeaderTextSplitter + RecursiveCharacterTextSplitter 两遍切分
+
+切分规则（与 LangChain 两层切分器的输出逐字一致，见 scripts/bench_chunker.py）：
+    - 按 # / ## / ### 标题切成小节，标题行本身不进正文，元数据为 Header 1~3；
+      代码块（``` / ~~~）内的 # 不算标题；空行分隔的段落以 "  \\n" 拼接；
+      相邻且标题路径相同的小节合并
+    - 小节不足 chunk_size 时整节一个片段；否则依次按 "\\n\\n"、"\\n"、"。"、"！"、"？"、" "
+      递归细切（分隔符保留在下一段开头），再合并成不超过 chunk_size、相邻重叠约 chunk_overlap 的片段
+    - start_index 为片段在小节正文中的字符偏移
+
+产出紧凑片段记录 (小节序号, 标题元数据, start_index, 正文)：不构造 Document，
+同一小节的片段共享同一个标题字典（只读）
+"""
+
+HEADER_NAMES = ("Header 1", "Header 2", "Header 3")
+SEPARATORS = ("\n\n", "\n", "。", "！", "？", " ")
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CHUNK_OVERLAP = 50
+
+
+def split_sections(text):
+    """
+    第一层：按标题切分
+
+    Returns:
+        [(标题元数据, 小节正文), ...]
+    """
+    sections = []       # [[标题元数据, [段落, ...]], ...]
+    headers = {}
+    lines = []
+    in_code_block = False
+    fence = ""
+
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line.isprintable():
+            line = "".join(filter(str.isprintable, line))
+
+        if not in_code_block:
+            if line.startswith("```") and line.count("```") == 1:
+                in_code_block, fence = True, "```"
+            elif line.startswith("~~~"):
+                in_code_block, fence = True, "~~~"
+        elif line.startswith(fence):
+            in_code_block, fence = False, ""
+        if in_code_block:
+            lines.append(line)
+            continue
+
+        level = 0
+        if line.startswith("#"):
+            n = len(line) - len(line.lstrip("#"))
+            if n <= len(HEADER_NAMES) and (len(line) == n or line[n] == " "):
+                level = n
+
+        if level or not line:
+            # 标题行或空行：结束当前段落
+            if lines:
+                if sections and sections[-1][0] == headers:
+                    sections[-1][1].append("\n".join(lines))
+                else:
+                    sections.append([headers, ["\n".join(lines)]])
+                lines = []
+            if level:
+                # 同级及更低级标题出栈，再压入当前标题（新字典，已产出的小节不受影响）
+                headers = {name: value for name, value in headers.items()
+                           if HEADER_NAMES.index(name) < level - 1}
+                headers[HEADER_NAMES[level - 1]] = line[level:].strip()
+        else:
+            lines.append(line)
+
+    if lines:
+        if sections and sections[-1][0] == headers:
+            sections[-1][1].append("\n".join(lines))
+        else:
+            sections.append([headers, ["\n".join(lines)]])
+
+    return [(section_headers, "  \n".join(paragraphs)) for section_headers, paragraphs in sections]
+
+
+def _split_by(text, separator):
+    """按分隔符切开，分隔符保留在下一段开头，丢弃空段"""
+    parts = text.split(separator)
+    pieces = [parts[0]] if parts[0] else []
+    pieces.extend(separator + part for part in parts[1:])
+    return pieces
+
+
+def _merge(pieces, chunk_size, chunk_overlap, out):
+    """把小段合并成不超过 chunk_size 的片段，相邻片段保留不超过 chunk_overlap 的重叠"""
+    current = []
+    head = 0
+    total = 0
+    for piece in pieces:
+        n = len(piece)
+        if total + n > chunk_size and head < len(current):
+            chunk = "".join(current[head:]).strip()
+            if chunk:
+                out.append(chunk)
+            while total > chunk_overlap or (total + n > chunk_size and total > 0):
+                total -= len(current[head])
+                head += 1
+        current.append(piece)
+        total += n
+    chunk = "".join(current[head:]).strip()
+    if chunk:
+        out.append(chunk)
+
+
+def _split_recursive(text, separators, chunk_size, chunk_overlap, out):
+    separator = separators[-1]
+    rest = ()
+    for i, candidate in enumerate(separators):
+        if candidate in text:
+            separator, rest = candidate, separators[i + 1:]
+            break
+
+    good = []
+    for piece in _split_by(text, separator):
+        if len(piece) < chunk_size:
+            good.append(piece)
+            continue
+        if good:
+            _merge(good, chunk_size, chunk_overlap, out)
+            good = []
+        if rest:
+            _split_recursive(piece, rest, chunk_size, chunk_overlap, out)
+        else:
+            out.append(piece)
+    if good:
+        _merge(good, chunk_size, chunk_overlap, out)
+
+
+def split_text(text, chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP, separators=SEPARATORS):
+    """
+    第二层：递归细切一个小节
+
+    Returns:
+        [(start_index, 片段正文), ...]
+    """
+    if len(text) < chunk_size:
+        # 短小节：整节一个片段（占绝大多数，跳过切分合并）
+        chunk = text.strip()
+        return [(text.find(chunk), chunk)] if chunk else []
+
+    chunks = []
+    _split_recursive(text, tuple(separators), chunk_size, chunk_overlap, chunks)
+
+    result = []
+    index = 0
+    previous_len = 0
+    for chunk in chunks:
+        # 与 LangChain add_start_index 相同：从上一片段末尾减去重叠处开始查找
+        index = text.find(chunk, max(0, index + previous_len - chunk_overlap))
+        previous_len = len(chunk)
+        result.append((index, chunk))
+    return result
+
+
+def chunk_markdown(text, chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP):
+    """
+    标题切分 + 递归细切
+
+    Returns:
+        [(小节序号, 标题元数据, start_index, 正文), ...]
+    """
+    records = []
+    for section_no, (headers, content) in enumerate(split_sections(text)):
+        for start_index, chunk in split_text(content, chunk_size, chunk_overlap):
+            records.append((section_no, headers, start_index, chunk))
+    return records
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Context Packer - Prompt 上下文按 token 预算装填
+KAI Brain 生成端：检索结果（small-to-big 小节最长约 2000 字）不再全部原样拼进 Prompt，
+按精排分从高到低装入固定 token 预算，控制首字延迟与单次调用成本
+
+长度计数：
+    - 精确：KAI_TOKENIZER 为 tokenizer.json 路径，或 HuggingFace 模型名（默认 deepseek-ai/DeepSeek-V3，
+      与 deepseek-chat 同一分词器）且其 tokenizer.json 已在本地 HF 缓存中时，用 tokenizers 计数（不联网下载）
+    - 估算：没有分词器时按 DeepSeek 官方换算（1 个中文字符约 0.6 token，1 个英文字符约 0.3 token），
+      英文标点/符号按 0.5 token（代码里符号多，单按字符数会偏低），再乘 ESTIMATE_MARGIN 留出余量，
+      宁多勿少，避免超出预算；pack_contexts 的报告里 estimated=True 表示是估算值
+
+装填规则（pack_contexts）：
+    - 按精排分降序（无精排分时按原排名）依次装入；单条超过 chunk_limit 先截断到 chunk_limit
+    - 放不下的片段在剩余预算 >= min_tokens 时截断到剩余预算（尽量在句末断开，结尾加省略标记），否则丢弃
+    - 装入的片段按原排名顺序输出
+"""
+
+import os
+import re
+import math
+import threading
+
+TOKENIZER_PATH = os.getenv("KAI_TOKENIZER", "deepseek-ai/DeepSeek-V3")   # 空串 = 始终估算
+CJK_TOKENS_PER_CHAR = 0.6
+SYMBOL_TOKENS_PER_CHAR = 0.5
+OTHER_TOKENS_PER_CHAR = 0.3
+ESTIMATE_MARGIN = float(os.getenv("KAI_TOKEN_ESTIMATE_MARGIN", "1.15"))   # 估算值放大倍数
+MESSAGE_OVERHEAD_TOKENS = 4                        # 每条 chat 消息的角色/分隔符开销
+TRUNCATION_MARK = "……（已截断）"
+_SENTENCE_END = re.compile(r"[。！？!?\n]")
+_CJK = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+_SYMBOL = re.compile(r"[!-/:-@\[-`{-~]")
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _tokenizer_file(name):
+    """KAI_TOKENIZER -> 本地 tokenizer.json 路径：文件路径原样返回，模型名只查本地 HF 缓存；找不到返回 None"""
+    if os.path.isfile(name):
+        return name
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return None
+    path = try_to_load_from_cache(name, "tokenizer.json")
+    return path if isinstance(path, str) else None
+
+
+def _get_tokenizer():
+    """按需加载分词器；未配置、本地没有或加载失败时返回 None（退回估算）"""
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded:
+        return _tokenizer
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            if TOKENIZER_PATH:
+                try:
+                    path = _tokenizer_file(TOKENIZER_PATH)
+                    if path is not None:
+                        from tokenizers import Tokenizer
+                        _tokenizer = Tokenizer.from_file(path)
+                except Exception as e:
+                    print(f"⚠️ 分词器加载失败，按字符估算 token: {e}")
+            _tokenizer_loaded = True
+    return _tokenizer
+
+
+def is_estimated():
+    """token 数是否为估算值（没有可用的分词器）"""
+    return _get_tokenizer() is None
+
+
+def estimate_tokens(text):
+    """文本的 token 数（有分词器时精确，否则为含余量的估算，见 is_estimated）"""
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    cjk = len(_CJK.findall(text))
+    symbols = len(_SYMBOL.findall(text))
+    other = len(text) - cjk - symbols
+    raw = cjk * CJK_TOKENS_PER_CHAR + symbols * SYMBOL_TOKENS_PER_CHAR + other * OTHER_TOKENS_PER_CHAR
+    return math.ceil(raw * ESTIMATE_MARGIN)
+
+
+def estimate_messages_tokens(messages):
+    """chat 消息列表的 Prompt token 数"""
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    截断到不超过 max_tokens（含省略标记）
+
+    Returns:
+        原文（未超出时）或截断后的文本；预算连省略标记都放不下时返回空串
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARK)
+    if budget <= 0:
+        return ""
+    # 二分最长的前缀长度
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    # 尽量在句末断开（只在前缀的后 30% 里找，避免丢太多）
+    cut = lo
+    for match in _SENTENCE_END.finditer(text, int(lo * 0.7), lo):
+        cut = match.end()
+    return text[:cut].rstrip() + TRUNCATION_MARK
+
+
+def pack_contexts(hits, budget, chunk_limit=None, min_tokens=0):
+    """
+    按 token 预算装填检索结果
+
+    Args:
+        hits: retrieval.retrieve 的结果（用 "text" 与 "rerank_score"），按排名顺序
+        budget: 上下文总 token 预算
+        chunk_limit: 单条结果的 token 上限，None = 不限
+        min_tokens: 剩余预算小于它时不再截断装入
+
+    Returns:
+        (装入的文本列表（原排名顺序）, 报告 {"budget", "tokens", "estimated", "packed", "trimmed", "dropped"}，
+        estimated=True 时 tokens 为估算值)
+    """
+    scores = [hit.get("rerank_score") for hit in hits]
+    if any(score is None for score in scores):
+        order = list(range(len(hits)))
+    else:
+        order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)
+
+    packed = {}
+    used = 0
+    trimmed = 0
+    for i in order:
+        text = hits[i]["text"]
+        tokens = estimate_tokens(text)
+        limit = budget - used if chunk_limit is None else min(chunk_limit, budget - used)
+        if tokens > limit:
+            if limit < min_tokens:
+                continue
+            text = truncate_to_tokens(text, limit)
+            if not text:
+                continue
+            tokens = estimate_tokens(text)
+            trimmed += 1
+        packed[i] = text
+        used += tokens
+
+    report = {
+        "budget": budget,
+        "tokens": used,
+        "estimated": is_estimated(),
+        "packed": len(packed),
+        "trimmed": trimmed,
+        "dropped": len(hits) - len(packed),
+    }
+    return [packed[i] for i in sorted(packed)], report
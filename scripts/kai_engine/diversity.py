@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Diversity - 结果多样性选择（MMR）
+KAI Brain 结果层：精排后的候选常出现同一文件、同一标题路径的多个片段，挤占 Prompt 预算
+
+MMR（maximal marginal relevance）贪心选取：
+    每一步选 λ·相关度 − (1 − λ)·max(与已选结果的余弦相似度) 最大的候选
+    - λ = 1 只看相关度（等价于原排序），λ 越小越偏向与已选结果不同的候选
+    - 相关度为精排分（或名次）归一化到 [0, 1]
+    - 可选同一来源（文件）条数上限：超出上限的候选只是排到其余候选之后，不会被丢弃
+      （其他来源的候选用完后仍按 MMR 继续入选）
+"""
+
+import numpy as np
+
+
+def rank_relevance(scores):
+    """
+    相关度归一化到 [0, 1]
+
+    Args:
+        scores: 按排名顺序的精排分；任一为 None（跳过精排/未精排）时按名次线性递减
+    """
+    n = len(scores)
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    if any(score is None for score in scores):
+        return 1 - np.arange(n, dtype=np.float32) / n
+    scores = np.asarray(scores, dtype=np.float32)
+    span = scores.max() - scores.min()
+    if span <= 0:
+        return np.ones(n, dtype=np.float32)
+    return (scores - scores.min()) / span
+
+
+def mmr_order(relevance, vectors, lambda_=0.7, groups=None, max_per_group=0, k=None):
+    """
+    MMR 贪心排序
+
+    Args:
+        relevance: (n,) 相关度，越大越相关
+        vectors: (n, dim) 候选向量（不要求已归一化）
+        groups: 可选，与候选对应的来源标识（如文件路径）
+        max_per_group: 同一来源在其他来源的候选用完之前最多入选几条，0 = 不限
+        k: 最多选几条，None = 全部候选
+
+    Returns:
+        入选候选的下标，按入选顺序
+    """
+    n = len(relevance)
+    k = n if k is None else min(k, n)
+    if n == 0 or k == 0:
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(n, -1)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    max_sim = np.zeros(n, dtype=np.float32)     # 与已选结果的最大相似度
+    available = np.ones(n, dtype=bool)
+    capped = np.zeros(n, dtype=bool)            # 来源已达上限（延后，不丢弃）
+    counts = {}
+    order = []
+    while len(order) < k and available.any():
+        pool = available & ~capped
+        if not pool.any():
+            pool = available
+        scores = lambda_ * relevance - (1 - lambda_) * max_sim
+        scores[~pool] = -np.inf
+        i = int(scores.argmax())
+        order.append(i)
+        available[i] = False
+        max_sim = np.maximum(max_sim, similarity[i])
+        if groups is not None and max_per_group:
+            counts[groups[i]] = counts.get(groups[i], 0) + 1
+            if counts[groups[i]] >= max_per_group:
+                capped |= np.array([g == groups[i] for g in groups])
+    return order
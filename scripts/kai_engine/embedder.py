@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Embedder - 批量 + 多进程向量化
+KAI Brain 索引构建的 embedding 阶段
+
+- 每个 worker 进程各自加载一份 text2vec 模型，按 batch 编码
+- worker 数 × 每进程线程数 ≈ CPU 核数，构建时吃满所有核
+- 提交的 batch 数有上限（背压），结果按提交顺序返回
+- 可选 EmbeddingCache：已编码过的文本直接复用，只把未命中的文本送进进程池
+"""
+
+import os
+from collections import deque
+from concurrent.futures import Future
+
+EMBEDDING_MODEL_NAME = "shibing624/text2vec-base-chinese"
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_THREADS_PER_WORKER = 2
+
+# worker 进程内的模型（每个进程加载一次）
+_worker_model = None
+
+
+def default_workers(threads_per_worker=DEFAULT_THREADS_PER_WORKER):
+    """默认 worker 数：CPU 核数 / 每进程线程数"""
+    return max(1, (os.cpu_count() or 1) // max(1, threads_per_worker))
+
+
+def _init_worker(model_name, threads):
+    """worker 进程初始化：限制 torch 线程数并加载模型"""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device='cpu')
+
+
+def _encode_batch(texts, batch_size):
+    """在 worker 进程中编码一个 batch（与 HuggingFaceEmbeddings 默认参数一致，不归一化）"""
+    vectors = _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    return vectors.tolist()
+
+
+class ParallelEmbedder:
+    """
+    多进程 embedding 执行器
+
+    Args:
+        model_name: SentenceTransformer 模型名
+        batch_size: 每个 batch 的文本数
+        workers: 进程数，<= 1 时在当前进程内用 fallback 模型编码
+        threads_per_worker: 每个进程的 torch 线程数
+        fallback: 单进程模式使用的 LangChain Embeddings 对象
+        cache: 可选 EmbeddingCache（须与 model_name 一致）
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, batch_size=DEFAULT_BATCH_SIZE,
+                 workers=None, threads_per_worker=DEFAULT_THREADS_PER_WORKER, fallback=None,
+                 cache=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.threads_per_worker = threads_per_worker
+        self.workers = default_workers(threads_per_worker) if workers is None else workers
+        self.fallback = fallback
+        self.cache = cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get_pool(self):
+        if self._pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn：避免 fork 已初始化 torch 线程池的父进程
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.threads_per_worker),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _encode_async(self, texts):
+        """提交一批文本编码，返回 Future"""
+        if self.workers <= 1:
+            future = Future()
+            future.set_result(self.fallback.embed_documents(texts))
+            return future
+        return self._get_pool().submit(_encode_batch, texts, self.batch_size)
+
+    def _submit(self, texts):
+        """查缓存后只提交未命中的文本，返回 (已有向量, 未命中下标, Future)"""
+        cached = self.cache.lookup(texts) if self.cache is not None else [None] * len(texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        self.cache_hits += len(texts) - len(missing)
+        self.cache_misses += len(missing)
+        future = self._encode_async([texts[i] for i in missing]) if missing else None
+        return cached, missing, future
+
+    def _collect(self, texts, cached, missing, future):
+        """合并缓存命中与新编码结果，并写回缓存"""
+        if future is None:
+            return [v.tolist() for v in cached]
+        new_vectors = future.result()
+        if self.cache is not None:
+            self.cache.add([texts[i] for i in missing], new_vectors)
+            self.cache.flush()
+        vectors = [v.tolist() if v is not None else None for v in cached]
+        for i, vector in zip(missing, new_vectors):
+            vectors[i] = vector
+        return vectors
+
+    def map_batches(self, batches):
+        """
+        编码 (payload, texts) 序列，按输入顺序产出 (payload, vectors)
+
+        同时在途的 batch 不超过 workers * 2，避免上游一次性把语料全部塞进进程池。
+        """
+        max_in_flight = max(1, self.workers * 2)
+        in_flight = deque()
+        for payload, texts in batches:
+            in_flight.append((payload, texts) + self._submit(texts))
+            if len(in_flight) >= max_in_flight:
+                done_payload, done_texts, *job = in_flight.popleft()
+                yield done_payload, self._collect(done_texts, *job)
+        while in_flight:
+            done_payload, done_texts, *job = in_flight.popleft()
+            yield done_payload, self._collect(done_texts, *job)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Embedding Cache - 持久化向量缓存
+KAI Brain 向量复用层：同一模型 + 同一段文本只编码一次
+
+存储格式（每个模型一个目录）：
+    embedding_cache/<model>/meta.json     模型名 + 向量维度
+    embedding_cache/<model>/vectors.f32   float32 行矩阵（追加写，读时 memmap）
+    embedding_cache/<model>/keys.txt      每行一个文本 sha1，行号即矩阵行号
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "../../"))
+EMBEDDING_CACHE_DIR = os.path.join(PROJECT_ROOT, "embedding_cache")
+KEY_LENGTH = 40          # sha1 十六进制
+
+
+def text_key(text):
+    """文本内容哈希，作为缓存 key"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    按 (模型名, 文本哈希) 缓存 embedding
+
+    - lookup() 命中返回 float32 向量，未命中返回 None
+    - add() 先暂存，flush() 时按已落盘行数定位写入（先写向量再写 key）；
+      打开时把两个文件截到对齐的行数，中断写入留下的多余/残缺行被丢弃，key 与向量行不会错位
+    - 单写者：只在构建进程的一个线程里使用
+    """
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.keys_path = os.path.join(self.dir, "keys.txt")
+
+        self.dim = None
+        self._rows = {}          # text_key -> 行号
+        self._matrix = None      # np.memmap (rows, dim)
+        self._pending = {}       # text_key -> 向量（未落盘）
+        self._keys_bytes = 0     # keys.txt 中已对齐部分的字节数（flush 从这里写）
+        self._load()
+
+    def __len__(self):
+        return len(self._rows) + len(self._pending)
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            self.dim = json.load(f)['dim']
+
+        # 只认完整的 key 行（中断写入只会在文件末尾留下残缺行）
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'rb') as f:
+                for line in f:
+                    key = line.rstrip(b"\n").decode('ascii', errors='replace')
+                    if not line.endswith(b"\n") or len(key) != KEY_LENGTH:
+                        break
+                    keys.append(key)
+
+        # 两个文件取较短的完整行数，并截掉多余部分：之后的写入从对齐处开始
+        row_bytes = 4 * self.dim
+        num_vectors = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        num_rows = min(len(keys), num_vectors)
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != num_rows * row_bytes:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(num_rows * row_bytes)
+        self._keys_bytes = num_rows * (KEY_LENGTH + 1)
+        if os.path.exists(self.keys_path) and os.path.getsize(self.keys_path) != self._keys_bytes:
+            with open(self.keys_path, 'r+b') as f:
+                f.truncate(self._keys_bytes)
+        self._rows = {key: i for i, key in enumerate(keys[:num_rows])}
+        self._open_matrix(num_rows)
+
+    def _open_matrix(self, num_rows):
+        if num_rows == 0:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(num_rows, self.dim))
+
+    def lookup(self, texts):
+        """批量查询，返回与 texts 对应的向量列表（未命中为 None）"""
+        results = []
+        for text in texts:
+            key = text_key(text)
+            row = self._rows.get(key)
+            if row is not None:
+                results.append(np.asarray(self._matrix[row]))
+            else:
+                results.append(self._pending.get(key))
+        return results
+
+    def add(self, texts, vectors):
+        """暂存新向量（已存在的 key 跳过）"""
+        for text, vector in zip(texts, vectors):
+            key = text_key(text)
+            if key in self._rows or key in self._pending:
+                continue
+            vector = np.asarray(vector, dtype=np.float32)
+            if self.dim is None:
+                self.dim = int(vector.shape[0])
+            elif vector.shape[0] != self.dim:
+                raise ValueError(f"向量维度不一致: {vector.shape[0]} != {self.dim}")
+            self._pending[key] = vector
+
+    def flush(self):
+        """把暂存向量追加写盘"""
+        if not self._pending:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        if not os.path.exists(self.meta_path):
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"model": self.model_name, "dim": self.dim}, f)
+
+        keys = list(self._pending)
+        matrix = np.stack([self._pending[k] for k in keys]).astype(np.float32, copy=False)
+        start = len(self._rows)
+        # 写在已对齐行数之后（而不是文件末尾），上次中断留下的半截数据被覆盖
+        for path, offset, data in (
+            (self.vectors_path, start * 4 * self.dim, matrix.tobytes()),
+            (self.keys_path, self._keys_bytes, "".join(k + "\n" for k in keys).encode('ascii')),
+        ):
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                f.seek(offset)
+                f.write(data)
+                f.truncate()
+        self._keys_bytes += len(keys) * (KEY_LENGTH + 1)
+
+        for i, key in enumerate(keys):
+            self._rows[key] = start + i
+        self._pending = {}
+        self._open_matrix(len(self._rows))
+
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Filters - 元数据过滤（Frontmatter 四大金刚 + 日期 + 路径）
+KAI Brain 检索范围收窄：过滤条件下推到 Chroma where 与 BM25 候选，精排前就缩小候选池
+
+构建时（build_index.py）在每个 chunk 上额外写入：
+    created_date   created_at 解析出的 YYYYMMDD 整数（无法解析时不写，日期过滤不会命中）
+    relpath        相对知识库根目录的路径（统一用 /）
+    path_l1..l3    路径前 1~3 级目录前缀，如 "00-Inbox"、"00-Inbox/wechat"
+
+过滤参数（dict，全部可选）：
+    source / content_type / author   字符串或字符串列表（列表为任一匹配）
+    date_from / date_to              "2025-01-01" / "2025" / 20250101，闭区间
+    path_prefix                      目录前缀 "00-Inbox/wechat"；前 3 级下推到 where，更深的部分在结果上补过滤
+"""
+
+import re
+import json
+import datetime
+
+PATH_LEVELS = 3
+EQUALITY_FIELDS = ("source", "content_type", "author")
+
+
+def date_to_int(value, end=False):
+    """
+    把日期转成 YYYYMMDD 整数
+
+    支持 date/datetime、"2025-03-01"、"2025/3/1"、"2025-03"、"2025"、20250301；
+    只有年或年月时，end=True 取区间末尾（用于 date_to）。无法解析返回 None。
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.year * 10000 + value.month * 100 + value.day
+    if isinstance(value, int) and value > 10000000:
+        return value
+    match = re.match(r"^\s*(\d{4})(?:[-/.年](\d{1,2}))?(?:[-/.月](\d{1,2}))?", str(value))
+    if not match:
+        return None
+    year = int(match.group(1))
+    month = int(match.group(2)) if match.group(2) else (12 if end else 1)
+    day = int(match.group(3)) if match.group(3) else (31 if end else 1)
+    return year * 10000 + month * 100 + day
+
+
+def path_levels(relpath):
+    """{"relpath": ..., "path_l1": ..., "path_l2": ..., "path_l3": ...}（只写存在的层级）"""
+    parts = [p for p in relpath.replace("\\", "/").split("/") if p]
+    dirs = parts[:-1]
+    levels = {"relpath": "/".join(parts)}
+    for level in range(1, min(len(dirs), PATH_LEVELS) + 1):
+        levels[f"path_l{level}"] = "/".join(dirs[:level])
+    return levels
+
+
+def normalize_filters(filters):
+    """
+    去掉空值、统一格式；无有效条件时返回 None
+
+    Raises:
+        ValueError: 条件类型不对（如 {"source": 1}），检索服务据此返回 400
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError(f"过滤条件应为 dict: {filters!r}")
+    normalized = {}
+    for field in EQUALITY_FIELDS:
+        value = filters.get(field)
+        if value in (None, "", []):
+            continue
+        if isinstance(value, str):
+            values = [value]
+        elif isinstance(value, (list, tuple, set)) and all(isinstance(v, str) for v in value):
+            values = sorted(set(value))
+        else:
+            raise ValueError(f"过滤条件 {field} 应为字符串或字符串列表: {value!r}")
+        normalized[field] = values
+    date_from = date_to_int(filters.get("date_from"))
+    date_to = date_to_int(filters.get("date_to"), end=True)
+    if date_from is not None:
+        normalized["date_from"] = date_from
+    if date_to is not None:
+        normalized["date_to"] = date_to
+    prefix = filters.get("path_prefix") or ""
+    if not isinstance(prefix, str):
+        raise ValueError(f"过滤条件 path_prefix 应为字符串: {prefix!r}")
+    prefix = prefix.replace("\\", "/").strip("/")
+    if prefix:
+        normalized["path_prefix"] = prefix
+    return normalized or None
+
+
+def filters_key(filters):
+    """规范化过滤条件的缓存 key"""
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else ""
+
+
+def build_where(filters):
+    """
+    规范化过滤条件 -> Chroma where 子句（无条件时返回 None）
+
+    path_prefix 超过 3 级时只下推前 3 级，其余由 needs_post_filter / matches 补过滤。
+    """
+    if not filters:
+        return None
+    clauses = []
+    for field in EQUALITY_FIELDS:
+        values = filters.get(field)
+        if values:
+            clauses.append({field: values[0]} if len(values) == 1 else {field: {"$in": values}})
+    if "date_from" in filters:
+        clauses.append({"created_date": {"$gte": filters["date_from"]}})
+    if "date_to" in filters:
+        clauses.append({"created_date": {"$lte": filters["date_to"]}})
+    prefix = filters.get("path_prefix")
+    if prefix:
+        parts = prefix.split("/")
+        level = min(len(parts), PATH_LEVELS)
+        clauses.append({f"path_l{level}": "/".join(parts[:level])})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def needs_post_filter(filters):
+    """where 不能完全表达的条件（超过 3 级的路径前缀）"""
+    return bool(filters) and len(filters.get("path_prefix", "").split("/")) > PATH_LEVELS
+
+
+def matches(metadata, filters):
+    """在 Python 侧判断一个 chunk 是否满足过滤条件"""
+    if not filters:
+        return True
+    meta = metadata or {}
+    for field in EQUALITY_FIELDS:
+        if field in filters and meta.get(field) not in filters[field]:
+            return False
+    created = meta.get("created_date")
+    if "date_from" in filters and (created is None or created < filters["date_from"]):
+        return False
+    if "date_to" in filters and (created is None or created > filters["date_to"]):
+        return False
+    prefix = filters.get("path_prefix")
+    if prefix:
+        relpath = meta.get("relpath", "")
+        if relpath != prefix and not relpath.startswith(prefix + "/"):
+            return False
+    return True
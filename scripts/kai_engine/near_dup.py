@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Near Dup - 近重复片段检测（SimHash）
+KAI Brain 构建端去重：同一篇文章经 sync_feishu_final.py（00-Inbox/wechat）与 sync_all.py
+（05-Workbench/Feishu_Sync）各同步一份时，近乎相同的片段只索引一份，不再挤占粗排候选与精排次数
+
+算法：
+    - 片段正文 NFKC + 小写，只保留文字/数字，取字符 3-gram 集合，每个 3-gram 用 blake2b 取 64 位哈希，
+      按位投票得到 64 位 SimHash（build_index.py 在解析 worker 进程里计算）
+    - 汉明距离 <= max_distance（默认 3）视为近重复。SimHash 切成 4 段 16 位做分桶：
+      距离 <= 3 的两个指纹至少有一段完全相同，只需比较同桶候选
+    - 按构建顺序（文件路径升序）先出现的片段为代表，后出现的近重复片段不写入向量库 / BM25，
+      记为代表的别名（alias）
+    - 分片构建时所有分片共用一个索引（各分片的 near_dup/ 合并读入），跨分片的副本同样折叠；
+      保存时每个分片只写自己文件的代表与别名（别名的代表可以在其他分片）
+
+存储格式（chroma_db_data/near_dup/，由 build_index.py 与 Chroma 同步写入）：
+    meta.json        max_distance
+    fingerprints.npz 已索引（代表）片段的 chunk ID、相对路径（换行拼接的 UTF-8 字节）与 SimHash (uint64)
+    aliases.json     {代表 chunk ID: [[别名 chunk ID, 别名文件相对路径], ...]}
+"""
+
+import os
+import re
+import json
+import hashlib
+import unicodedata
+
+import numpy as np
+
+DEFAULT_MAX_DISTANCE = 3
+SHINGLE_SIZE = 3
+_BANDS = 4
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_NON_WORD = re.compile(r"[\W_]+")
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def simhash(text):
+    """64 位 SimHash（Python int）；没有文字/数字的片段返回 None"""
+    text = _NON_WORD.sub("", unicodedata.normalize("NFKC", text or "").lower())
+    if not text:
+        return None
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    hashes = np.frombuffer(digests, dtype=np.uint64)
+    votes = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).sum(axis=0)
+    bits = votes * 2 > len(hashes)
+    return int((bits.astype(np.uint64) << _BIT_SHIFTS).sum())
+
+
+def _bands(fingerprint):
+    return [(band, (fingerprint >> (band * _BAND_BITS)) & _BAND_MASK) for band in range(_BANDS)]
+
+
+def _pack_strings(strings):
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_strings(array):
+    data = array.tobytes().decode("utf-8")
+    return data.split("\n") if data else []
+
+
+class NearDuplicateIndex:
+    """
+    近重复片段索引（构建端）
+
+    add() 判断新片段是否与已索引片段近重复；remove() 删除过期片段；save() / load() 持久化，
+    供增量构建继续判重
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._entries = {}    # 代表 chunk ID -> (SimHash, 相对路径)
+        self._buckets = {}    # (段号, 段值) -> {代表 chunk ID}
+        self._aliases = {}    # 代表 chunk ID -> {别名 chunk ID: 别名相对路径}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def num_aliases(self):
+        return sum(len(aliases) for aliases in self._aliases.values())
+
+    def chunk_ids(self, keep):
+        """相对路径满足 keep(relpath) 的代表与别名 chunk ID"""
+        ids = [chunk_id for chunk_id, (_, relpath) in self._entries.items() if keep(relpath)]
+        ids.extend(alias for aliases in self._aliases.values()
+                   for alias, relpath in aliases.items() if keep(relpath))
+        return ids
+
+    def alias_files(self):
+        """{别名 chunk ID: 别名相对路径}"""
+        return {alias: relpath for aliases in self._aliases.values() for alias, relpath in aliases.items()}
+
+    def merge(self, other):
+        """并入另一个索引（分片构建时合并各分片的索引）"""
+        for chunk_id, (fingerprint, relpath) in other._entries.items():
+            self._entries[chunk_id] = (fingerprint, relpath)
+            if fingerprint is not None:
+                for key in _bands(fingerprint):
+                    self._buckets.setdefault(key, set()).add(chunk_id)
+        for rep, aliases in other._aliases.items():
+            self._aliases.setdefault(rep, {}).update(aliases)
+
+    def _match(self, fingerprint):
+        """距离最近且不超过 max_distance 的代表；没有时返回 None"""
+        best, best_distance = None, self.max_distance + 1
+        seen = set()
+        for key in _bands(fingerprint):
+            for chunk_id in self._buckets.get(key, ()):
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                distance = bin(fingerprint ^ self._entries[chunk_id][0]).count("1")
+                if distance < best_distance or (best is not None and distance == best_distance and chunk_id < best):
+                    best, best_distance = chunk_id, distance
+        return best
+
+    def add(self, chunk_id, fingerprint, relpath):
+        """
+        登记一个片段
+
+        Returns:
+            近重复时返回代表的 chunk ID（该片段记为别名，不应写入向量库）；否则登记为代表并返回 None
+        """
+        if fingerprint is not None and self.max_distance > 0:
+            rep = self._match(fingerprint)
+            if rep is not None and rep != chunk_id:
+                self._aliases.setdefault(rep, {})[chunk_id] = relpath
+                return rep
+        self._entries[chunk_id] = (fingerprint, relpath)
+        if fingerprint is not None:
+            for key in _bands(fingerprint):
+                self._buckets.setdefault(key, set()).add(chunk_id)
+        return None
+
+    def orphaned_files(self, stale_ids):
+        """代表将被删除、而别名所在文件不在删除范围内的文件（需重新解析，让别名重新参与判重）"""
+        stale_ids = set(stale_ids)
+        return {relpath for rep in stale_ids & self._aliases.keys()
+                for alias, relpath in self._aliases[rep].items() if alias not in stale_ids}
+
+    def remove(self, ids):
+        """删除代表与别名（代表被删时它的别名一并丢弃，见 orphaned_files）"""
+        ids = set(ids)
+        if not ids:
+            return
+        for chunk_id in ids & self._entries.keys():
+            fingerprint, _ = self._entries.pop(chunk_id)
+            if fingerprint is not None:
+                for key in _bands(fingerprint):
+                    bucket = self._buckets.get(key)
+                    bucket.discard(chunk_id)
+                    if not bucket:
+                        del self._buckets[key]
+            self._aliases.pop(chunk_id, None)
+        for rep in list(self._aliases):
+            aliases = self._aliases[rep]
+            for alias in ids & aliases.keys():
+                del aliases[alias]
+            if not aliases:
+                del self._aliases[rep]
+
+    def folder_report(self, folder_of):
+        """
+        各目录的重复比例
+
+        Args:
+            folder_of: 相对路径 -> 目录名（如 shards.shard_of）
+
+        Returns:
+            {目录: (片段数, 近重复片段数)}，片段数含别名
+        """
+        report = {}
+        for _, relpath in self._entries.values():
+            total, dups = report.get(folder_of(relpath), (0, 0))
+            report[folder_of(relpath)] = (total + 1, dups)
+        for aliases in self._aliases.values():
+            for relpath in aliases.values():
+                total, dups = report.get(folder_of(relpath), (0, 0))
+                report[folder_of(relpath)] = (total + 1, dups + 1)
+        return report
+
+    def save(self, index_dir, keep=None):
+        """
+        原子写入（先写临时文件再替换）
+
+        Args:
+            keep: 只写相对路径满足 keep(relpath) 的代表与别名（分片构建时写单个分片），None = 全部
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        ids = [chunk_id for chunk_id, (_, relpath) in self._entries.items() if keep is None or keep(relpath)]
+        alias_map = {}
+        for rep, aliases in self._aliases.items():
+            kept = [[alias, relpath] for alias, relpath in aliases.items() if keep is None or keep(relpath)]
+            if kept:
+                alias_map[rep] = kept
+        # 没有指纹的片段（无文字）存为 0 并在 has_fp 中标记
+        fingerprints = np.array([self._entries[c][0] or 0 for c in ids], dtype=np.uint64)
+        has_fp = np.array([self._entries[c][0] is not None for c in ids], dtype=bool)
+
+        npz_path = os.path.join(index_dir, "fingerprints.npz")
+        tmp_npz = npz_path + ".tmp.npz"
+        np.savez(tmp_npz, chunk_ids=_pack_strings(ids),
+                 relpaths=_pack_strings([self._entries[c][1] for c in ids]),
+                 fingerprints=fingerprints, has_fp=has_fp)
+        os.replace(tmp_npz, npz_path)
+
+        for name, payload in (
+            ("aliases.json", alias_map),
+            ("meta.json", {"max_distance": self.max_distance, "num_entries": len(ids),
+                           "num_aliases": sum(len(aliases) for aliases in alias_map.values())}),
+        ):
+            path = os.path.join(index_dir, name)
+            with open(path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_dir, max_distance=None):
+        """
+        读取索引；不存在时返回 None
+
+        Args:
+            max_distance: 覆盖保存时的判重阈值（只影响之后新加入的片段）
+        """
+        meta_path = os.path.join(index_dir, "meta.json")
+        npz_path = os.path.join(index_dir, "fingerprints.npz")
+        if not (os.path.exists(meta_path) and os.path.exists(npz_path)):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(meta["max_distance"] if max_distance is None else max_distance)
+        with np.load(npz_path, allow_pickle=False) as data:
+            ids = _unpack_strings(data["chunk_ids"])
+            relpaths = _unpack_strings(data["relpaths"])
+            fingerprints = data["fingerprints"].tolist()
+            has_fp = data["has_fp"].tolist()
+        for chunk_id, relpath, fingerprint, ok in zip(ids, relpaths, fingerprints, has_fp):
+            index._entries[chunk_id] = (fingerprint if ok else None, relpath)
+            if ok:
+                for key in _bands(fingerprint):
+                    index._buckets.setdefault(key, set()).add(chunk_id)
+        index._aliases = {rep: {alias: relpath for alias, relpath in aliases}
+                          for rep, aliases in load_aliases(index_dir).items()}
+        return index
+
+
+def load_aliases(index_dir):
+    """读取别名表 {代表 chunk ID: [[别名 chunk ID, 别名相对路径], ...]}；不存在时返回 {}（检索端使用）"""
+    path = os.path.join(index_dir, "aliases.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Quantized Index - 量化向量索引（fp16 / int8 + 可选 PQ）
+KAI Brain 低内存粗排：常驻内存只放量化向量，float32 原向量留在磁盘上按需读取
+
+检索三段式：
+    1. PQ 非对称距离（ADC）扫全库，取 pq_shortlist 个（未训练 PQ 时跳过）
+    2. fp16 / int8 向量算近似距离，取 rescore_k 个
+    3. 从 float32 memmap 只读这 rescore_k 行做精确距离，返回前 k 个
+    距离与 Chroma 默认的 l2 空间一致（平方欧氏距离）
+
+存储格式（chroma_db_data/quantized/，由 build_index.py --quantize 写入）：
+    meta.json       量化类型、维度、条数、PQ 参数
+    ids.txt         每行一个 chunk_id，行号即矩阵行号
+    vectors.q       fp16 矩阵，或 int8 矩阵（配 scales.f32 每行缩放系数）
+    norms.f32       原向量平方范数（近似距离用）
+    vectors.f32     float32 原向量（只在第 3 步按行读取）
+    pq_codebooks.f32 / pq_codes.u8   PQ 码本 (m, 256, dim/m) 与编码 (n, m)
+"""
+
+import os
+import json
+
+import numpy as np
+
+QUANTIZE_TYPES = ("fp16", "int8")
+PQ_CENTROIDS = 256
+PQ_TRAIN_ITERS = 12
+PQ_TRAIN_SAMPLE = 50000
+SCAN_BLOCK = 65536        # 分块扫描，限制临时数组大小
+
+
+def kmeans(data, k, iters=PQ_TRAIN_ITERS, seed=0):
+    """朴素 k-means（PQ 子空间 / IVF 分区训练用）"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iters):
+        dists = (data ** 2).sum(1)[:, None] - 2 * data @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        assign = dists.argmin(1)
+        for c in range(k):
+            members = data[assign == c]
+            if len(members):
+                centroids[c] = members.mean(0)
+    return centroids
+
+
+def _top_k(dists, k):
+    """返回距离最小的 k 个下标（升序）"""
+    if len(dists) <= k:
+        return np.argsort(dists, kind="stable")
+    part = np.argpartition(dists, k)[:k]
+    return part[np.argsort(dists[part], kind="stable")]
+
+
+class QuantizedIndex:
+    """
+    量化向量索引
+
+    - build() 由 float32 向量构建并写盘
+    - load() 以 memmap 打开（量化矩阵 / PQ 编码首次扫描后常驻，float32 只按行读取）
+    """
+
+    def __init__(self, index_dir, meta, ids):
+        self.dir = index_dir
+        self.meta = meta
+        self.ids = ids
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self.dtype = meta["dtype"]
+        self.dim = meta["dim"]
+        n = len(ids)
+
+        def open_array(name, dtype, shape):
+            path = os.path.join(index_dir, name)
+            if n == 0 or not os.path.exists(path):
+                return None
+            return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+        self.vectors = open_array("vectors.q", np.float16 if self.dtype == "fp16" else np.int8, (n, self.dim))
+        self.scales = open_array("scales.f32", np.float32, (n,)) if self.dtype == "int8" else None
+        self.norms = open_array("norms.f32", np.float32, (n,))
+        self.full = open_array("vectors.f32", np.float32, (n, self.dim))
+        self.pq_m = meta.get("pq_m", 0)
+        self.pq_codes = None
+        self.pq_codebooks = None
+        if self.pq_m:
+            dsub = self.dim // self.pq_m
+            self.pq_codebooks = np.fromfile(os.path.join(index_dir, "pq_codebooks.f32"), dtype=np.float32)
+            self.pq_codebooks = self.pq_codebooks.reshape(self.pq_m, -1, dsub)
+            self.pq_codes = open_array("pq_codes.u8", np.uint8, (n, self.pq_m))
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---------- 构建 ----------
+
+    @staticmethod
+    def build(index_dir, ids, vectors, dtype="int8", pq_m=0):
+        """
+        量化并写盘（先写临时目录再整体替换）
+
+        Args:
+            vectors: (n, dim) float32
+            dtype: "fp16" 或 "int8"（每行对称缩放到 [-127, 127]）
+            pq_m: PQ 子空间数（须整除维度），0 表示不训练 PQ
+        """
+        if dtype not in QUANTIZE_TYPES:
+            raise ValueError(f"未知量化类型: {dtype}")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        dim = vectors.shape[1]
+        if pq_m and dim % pq_m:
+            raise ValueError(f"PQ 子空间数 {pq_m} 不能整除维度 {dim}")
+
+        tmp_dir = index_dir + ".tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+
+        with open(os.path.join(tmp_dir, "ids.txt"), 'w', encoding='utf-8') as f:
+            f.write("".join(i + "\n" for i in ids))
+        vectors.tofile(os.path.join(tmp_dir, "vectors.f32"))
+        (vectors ** 2).sum(1).astype(np.float32).tofile(os.path.join(tmp_dir, "norms.f32"))
+
+        if dtype == "fp16":
+            vectors.astype(np.float16).tofile(os.path.join(tmp_dir, "vectors.q"))
+        else:
+            scales = np.abs(vectors).max(1) / 127
+            scales[scales == 0] = 1
+            codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            codes.tofile(os.path.join(tmp_dir, "vectors.q"))
+            scales.astype(np.float32).tofile(os.path.join(tmp_dir, "scales.f32"))
+
+        if pq_m and len(vectors):
+            dsub = dim // pq_m
+            rng = np.random.default_rng(0)
+            sample = vectors if len(vectors) <= PQ_TRAIN_SAMPLE else \
+                vectors[rng.choice(len(vectors), PQ_TRAIN_SAMPLE, replace=False)]
+            codebooks = np.zeros((pq_m, min(PQ_CENTROIDS, len(sample)), dsub), dtype=np.float32)
+            codes = np.zeros((len(vectors), pq_m), dtype=np.uint8)
+            for m in range(pq_m):
+                sub = slice(m * dsub, (m + 1) * dsub)
+                codebooks[m] = kmeans(sample[:, sub], PQ_CENTROIDS)
+                for start in range(0, len(vectors), SCAN_BLOCK):
+                    block = vectors[start:start + SCAN_BLOCK, sub]
+                    dists = (block ** 2).sum(1)[:, None] - 2 * block @ codebooks[m].T \
+                        + (codebooks[m] ** 2).sum(1)[None, :]
+                    codes[start:start + SCAN_BLOCK, m] = dists.argmin(1)
+            codebooks.tofile(os.path.join(tmp_dir, "pq_codebooks.f32"))
+            codes.tofile(os.path.join(tmp_dir, "pq_codes.u8"))
+        else:
+            pq_m = 0
+
+        with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({"dtype": dtype, "dim": dim, "count": len(ids), "pq_m": pq_m}, f)
+
+        # 整体替换：旧目录先挪开再删除，读端最多看到完整的旧索引或新索引
+        old_dir = index_dir + ".old"
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        if os.path.exists(old_dir):
+            for name in os.listdir(old_dir):
+                os.remove(os.path.join(old_dir, name))
+            os.rmdir(old_dir)
+
+    @classmethod
+    def load(cls, index_dir):
+        """打开索引；不存在时返回 None"""
+        meta_path = os.path.join(index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, "ids.txt"), 'r', encoding='utf-8') as f:
+            ids = [line.rstrip("\n") for line in f if line.strip()]
+        return cls(index_dir, meta, ids)
+
+    # ---------- 检索 ----------
+
+    def resident_bytes(self):
+        """检索时常驻内存的字节数（量化矩阵 + 范数 + PQ；float32 只按行读取，不计入）"""
+        total = self.norms.nbytes if self.norms is not None else 0
+        if self.pq_codes is not None:
+            return total + self.pq_codes.nbytes + self.pq_codebooks.nbytes
+        total += self.vectors.nbytes if self.vectors is not None else 0
+        total += self.scales.nbytes if self.scales is not None else 0
+        return total
+
+    def _pq_distances(self, query, rows=None):
+        dsub = self.dim // self.pq_m
+        q = query.reshape(self.pq_m, 1, dsub)
+        table = ((self.pq_codebooks - q) ** 2).sum(2)          # (m, 256)
+        codes = self.pq_codes if rows is None else self.pq_codes[rows]
+        out = np.empty(len(codes), dtype=np.float32)
+        m_idx = np.arange(self.pq_m)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = np.asarray(codes[start:start + SCAN_BLOCK])
+            out[start:start + SCAN_BLOCK] = table[m_idx, block].sum(1)
+        return out
+
+    def _approx_distances(self, query, rows):
+        """量化向量上的近似平方距离：||x||² - 2·x·q + ||q||²"""
+        out = np.empty(len(rows), dtype=np.float32)
+        q_norm = float(query @ query)
+        for start in range(0, len(rows), SCAN_BLOCK):
+            block_rows = rows[start:start + SCAN_BLOCK]
+            dots = np.asarray(self.vectors[block_rows], dtype=np.float32) @ query
+            if self.scales is not None:
+                dots *= self.scales[block_rows]
+            out[start:start + SCAN_BLOCK] = self.norms[block_rows] - 2 * dots + q_norm
+        return out
+
+    def search(self, query, k=20, allowed=None, rescore_k=100, pq_shortlist=400):
+        """
+        Args:
+            query: float 向量
+            allowed: 可选 chunk_id 集合（元数据过滤）
+            rescore_k: 进入 float32 精确重排的候选数
+            pq_shortlist: PQ 阶段保留的候选数
+
+        Returns:
+            [(chunk_id, 平方欧氏距离), ...]，升序
+        """
+        if not self.ids:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        if allowed is None:
+            rows = np.arange(len(self.ids))
+        else:
+            rows = np.array(sorted(self.rows[c] for c in allowed if c in self.rows), dtype=np.int64)
+            if len(rows) == 0:
+                return []
+
+        # 1. PQ 粗筛
+        if self.pq_codes is not None and len(rows) > pq_shortlist:
+            dists = self._pq_distances(query, None if allowed is None else rows)
+            rows = rows[_top_k(dists, pq_shortlist)]
+            rows.sort()
+
+        # 2. 量化向量近似距离
+        if len(rows) > rescore_k:
+            rows = rows[_top_k(self._approx_distances(query, rows), rescore_k)]
+            rows.sort()
+
+        # 3. float32 精确距离（memmap 按行读取）
+        exact = ((np.asarray(self.full[rows]) - query) ** 2).sum(1)
+        order = _top_k(exact, k)
+        return [(self.ids[rows[i]], float(exact[i])) for i in order]
+
+    def get_vectors(self, ids):
+        """按 chunk_id 从 float32 memmap 读取原向量（只读这几行）"""
+        found = [(chunk_id, self.rows[chunk_id]) for chunk_id in ids if chunk_id in self.rows]
+        if not found:
+            return {}
+        rows = np.array(sorted(row for _, row in found))
+        vectors = np.asarray(self.full[rows])
+        by_row = {row: vectors[i] for i, row in enumerate(rows)}
+        return {chunk_id: by_row[row] for chunk_id, row in found}
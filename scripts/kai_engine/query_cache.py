@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Query Cache - 检索侧内存缓存
+KAI Brain 同一问题不重复编码、不重复检索
+"""
+
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """规范化查询：全角转半角、去首尾空白、合并连续空白、英文小写"""
+    query = unicodedata.normalize("NFKC", query or "")
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class TTLCache:
+    """
+    线程安全的 LRU + TTL 缓存
+
+    - 超过 maxsize 时淘汰最久未使用的条目
+    - 条目写入超过 ttl 秒后视为过期（ttl=None 不过期）
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=256, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()   # key -> (写入时间, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is self._MISSING:
+                self.misses += 1
+                return default
+            stored_at, value = item
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Rerank - 精排打分 + (查询, chunk) 分数缓存 + 自适应级联
+KAI Brain 精排层：同一会话的追问往往共享大部分候选，只有没打过分的配对才进 Cross-Encoder
+
+自适应级联（cascade_rerank）：
+    1. 跳过：向量距离显示明显胜出者时不精排，直接按向量顺序返回
+    2. 定深：只精排距离接近第 1 名的候选（深度夹在 [min_depth, 候选数] 之间）
+    3. 初筛（可选）：轻量 Cross-Encoder 先打分，只把前 first_stage_keep 个交给重模型
+    4. 早停：重模型按块打分，top_k 集合连续两块不变即停止
+参数默认全部关闭（等价于精排全部候选），取值由 retrieval 的配置传入；
+各阶段深度、跳过率、耗时累计在 rerank_metrics()
+"""
+
+import math
+import time
+import hashlib
+import threading
+
+try:
+    from query_cache import TTLCache, normalize_query
+except ImportError:
+    from .query_cache import TTLCache, normalize_query
+
+SCORE_CACHE_SIZE = 20000   # (查询, chunk) 配对数上限，超出按 LRU 淘汰
+RERANK_BATCH_SIZE = 256    # 单次过模型的配对数
+
+# 缓存原始 logit；normalize=True 时在取出后再做 sigmoid，两种调用方共用一份缓存
+_score_cache = TTLCache(maxsize=SCORE_CACHE_SIZE, ttl=None)
+
+
+def query_hash(query):
+    """规范化查询的哈希"""
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+
+
+def doc_cache_id(doc):
+    """
+    chunk 的缓存 ID：优先用构建时写入的 chunk_id，旧库退回内容哈希
+
+    chunk_id 只由位置决定，索引重建后须调用 clear_score_cache()（retrieval 按 index_version 自动处理）。
+    """
+    chunk_id = doc.metadata.get('chunk_id') if doc.metadata else None
+    if chunk_id:
+        return chunk_id
+    return hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()
+
+
+def _sigmoid(x):
+    return 1 / (1 + math.exp(-x))
+
+
+def compute_rerank_scores(reranker, query, docs, normalize=False, model_tag=""):
+    """
+    对 (query, doc) 配对打分，命中缓存的配对不再过模型
+
+    Returns:
+        与 docs 一一对应的分数列表
+    """
+    return compute_rerank_scores_many(reranker, [query], [docs], normalize=normalize, model_tag=model_tag)[0]
+
+
+def compute_rerank_scores_many(reranker, queries, docs_lists, normalize=False,
+                               batch_size=RERANK_BATCH_SIZE, model_tag=""):
+    """
+    多个查询一起打分：所有未命中缓存的配对拼成一次 compute_score 调用，按 batch_size 分批过模型
+
+    Args:
+        queries: 查询列表
+        docs_lists: 与 queries 对应的候选文档列表
+        model_tag: 缓存命名空间，不同精排模型的分数互不覆盖
+
+    Returns:
+        与 docs_lists 形状一致的分数列表
+    """
+    keys_lists = []
+    scores_lists = []
+    missing = {}   # key -> [(查询下标, 文档下标), ...]，同一配对只算一次
+    for qi, (query, docs) in enumerate(zip(queries, docs_lists)):
+        q_hash = query_hash(query)
+        keys = [(model_tag, q_hash, doc_cache_id(doc)) for doc in docs]
+        scores = [_score_cache.get(key) for key in keys]
+        for di, score in enumerate(scores):
+            if score is None:
+                missing.setdefault(keys[di], []).append((qi, di))
+        keys_lists.append(keys)
+        scores_lists.append(scores)
+
+    if missing:
+        positions = list(missing.values())
+        pairs = [[queries[qi], docs_lists[qi][di].page_content] for (qi, di), *_ in positions]
+        new_scores = reranker.compute_score(pairs, batch_size=batch_size)
+        # 只有一个配对时 FlagReranker 返回标量
+        if not hasattr(new_scores, '__len__'):
+            new_scores = [new_scores]
+        for key, locations, score in zip(missing, positions, new_scores):
+            score = float(score)
+            _score_cache.put(key, score)
+            for qi, di in locations:
+                scores_lists[qi][di] = score
+
+    if normalize:
+        return [[_sigmoid(score) for score in scores] for scores in scores_lists]
+    return scores_lists
+
+
+class RerankMetrics:
+    """线程安全的级联精排计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.queries = 0
+            self.skipped = 0
+            self.early_exits = 0
+            self.first_stage_queries = 0
+            self.candidates = 0        # 粗排候选数之和
+            self.depth = 0             # 定深后的精排深度之和
+            self.heavy_pairs = 0       # 实际交给重模型的配对数之和
+            self.first_stage_ms = 0.0
+            self.rerank_ms = 0.0
+
+    def record(self, candidates, depth=0, heavy_pairs=0, skipped=False, early_exit=False,
+               first_stage_ms=None, rerank_ms=0.0):
+        with self._lock:
+            self.queries += 1
+            self.skipped += skipped
+            self.early_exits += early_exit
+            self.candidates += candidates
+            self.depth += depth
+            self.heavy_pairs += heavy_pairs
+            self.rerank_ms += rerank_ms
+            if first_stage_ms is not None:
+                self.first_stage_queries += 1
+                self.first_stage_ms += first_stage_ms
+
+    def snapshot(self):
+        """汇总为比率与均值（按查询数平均）"""
+        with self._lock:
+            n = max(1, self.queries)
+            return {
+                "queries": self.queries,
+                "skip_rate": round(self.skipped / n, 4),
+                "early_exit_rate": round(self.early_exits / n, 4),
+                "first_stage_rate": round(self.first_stage_queries / n, 4),
+                "avg_candidates": round(self.candidates / n, 2),
+                "avg_depth": round(self.depth / n, 2),
+                "avg_heavy_pairs": round(self.heavy_pairs / n, 2),
+                "avg_first_stage_ms": round(self.first_stage_ms / max(1, self.first_stage_queries), 2),
+                "avg_rerank_ms": round(self.rerank_ms / n, 2),
+            }
+
+
+_metrics = RerankMetrics()
+
+
+def rerank_metrics():
+    """级联精排累计指标"""
+    return _metrics.snapshot()
+
+
+def reset_rerank_metrics():
+    _metrics.reset()
+
+
+def plan_rerank_depth(distances, top_k, skip_ratio=None, depth_ratio=None, min_depth=0):
+    """
+    根据粗排距离（升序，越小越相关）决定精排深度
+
+    Args:
+        skip_ratio: 第 2 名距离 >= 第 1 名 × (1 + skip_ratio) 视为明显胜出，跳过精排；None 不跳过
+        depth_ratio: 只精排距离 <= 第 1 名 × (1 + depth_ratio) 的候选；None 精排全部
+        min_depth: 精排深度下限（且不小于 top_k）
+
+    Returns:
+        精排深度；0 表示跳过精排
+    """
+    if not distances:
+        return 0
+    best = max(distances[0], 1e-9)
+    if skip_ratio is not None and (len(distances) == 1 or distances[1] >= best * (1 + skip_ratio)):
+        return 0
+    if depth_ratio is None:
+        return len(distances)
+    depth = sum(1 for d in distances if d <= best * (1 + depth_ratio))
+    return min(len(distances), max(depth, min_depth, top_k))
+
+
+def cascade_rerank(reranker, query, docs, distances, top_k, first_stage=None, first_stage_keep=10,
+                   early_exit_step=None, **depth_options):
+    """
+    自适应级联精排
+
+    Args:
+        reranker: 重模型（bge-reranker-v2-m3）
+        docs: 粗排候选（按粗排顺序）
+        distances: 定深用的粗排距离（升序）。混合检索时为融合前的向量距离，与 docs 不一定一一对应，
+            只用来决定跳过与否和精排深度（深度作用于 docs 的前缀）
+        first_stage: 可选轻量精排模型（如 bge-reranker-base），None 不初筛
+        first_stage_keep: 初筛后交给重模型的候选数
+        early_exit_step: 早停块大小（每块追加打分的候选数），None 表示一次打完
+        depth_options: 透传给 plan_rerank_depth（skip_ratio / depth_ratio / min_depth）
+
+    Returns:
+        [(docs 下标, 精排分), ...]，按精排分降序，最多 top_k 个；跳过精排时分数为 None
+    """
+    depth = min(len(docs), plan_rerank_depth(distances, top_k, **depth_options))
+    if depth == 0:
+        _metrics.record(len(docs), skipped=True)
+        return [(i, None) for i in range(min(top_k, len(docs)))]
+
+    candidates = list(range(depth))
+
+    # 1. 轻量模型初筛
+    first_stage_ms = None
+    if first_stage is not None and depth > first_stage_keep:
+        t = time.perf_counter()
+        light = compute_rerank_scores(first_stage, query, [docs[i] for i in candidates], model_tag="first_stage")
+        first_stage_ms = (time.perf_counter() - t) * 1000
+        ranked = sorted(zip(candidates, light), key=lambda x: x[1], reverse=True)
+        candidates = [i for i, _ in ranked[:max(first_stage_keep, top_k)]]
+
+    # 2. 重模型按块打分，top_k 集合稳定即早停
+    t = time.perf_counter()
+    scores = {}
+    step = early_exit_step or len(candidates)
+    block_end = min(len(candidates), top_k + step)
+    previous_top = None
+    early_exit = False
+    while True:
+        block = [i for i in candidates[:block_end] if i not in scores]
+        for i, score in zip(block, compute_rerank_scores(reranker, query, [docs[i] for i in block])):
+            scores[i] = score
+        current_top = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        if block_end >= len(candidates):
+            break
+        if previous_top is not None and set(current_top) == set(previous_top):
+            early_exit = True
+            break
+        previous_top = current_top
+        block_end = min(len(candidates), block_end + step)
+    rerank_ms = (time.perf_counter() - t) * 1000
+
+    _metrics.record(len(docs), depth=depth, heavy_pairs=len(scores), early_exit=early_exit,
+                    first_stage_ms=first_stage_ms, rerank_ms=rerank_ms)
+    return [(i, scores[i]) for i in sorted(scores, key=scores.get, reverse=True)[:top_k]]
+
+
+def cascade_rerank_many(reranker, queries, docs_lists, distances_lists, top_k, depth_options_list=None,
+                        **depth_options):
+    """
+    批量版 cascade_rerank：只做跳过 + 定深，所有查询的配对仍合并成一次重模型调用
+    （初筛与早停需要逐轮往返，会打散批量，批量路径不启用）
+
+    Args:
+        depth_options_list: 可选，与 queries 对应的 plan_rerank_depth 参数（逐条覆盖 depth_options）
+
+    Returns:
+        与 queries 对应的 [(docs 下标, 精排分), ...] 列表
+    """
+    if depth_options_list is None:
+        depth_options_list = [depth_options] * len(queries)
+    depths = [min(len(docs), plan_rerank_depth(distances, top_k, **options))
+              for docs, distances, options in zip(docs_lists, distances_lists, depth_options_list)]
+    t = time.perf_counter()
+    scores_lists = compute_rerank_scores_many(
+        reranker, queries, [docs[:depth] for docs, depth in zip(docs_lists, depths)]
+    )
+    rerank_ms = (time.perf_counter() - t) * 1000 / max(1, len(queries))
+
+    ranked_lists = []
+    for docs, depth, scores in zip(docs_lists, depths, scores_lists):
+        if depth == 0:
+            _metrics.record(len(docs), skipped=True)
+            ranked_lists.append([(i, None) for i in range(min(top_k, len(docs)))])
+            continue
+        _metrics.record(len(docs), depth=depth, heavy_pairs=depth, rerank_ms=rerank_ms)
+        order = sorted(range(depth), key=lambda i: scores[i], reverse=True)[:top_k]
+        ranked_lists.append([(i, scores[i]) for i in order])
+    return ranked_lists
+
+
+def clear_score_cache():
+    _score_cache.clear()
+
+
+def score_cache_stats():
+    """返回 (命中数, 未命中数, 当前条数)"""
+    return _score_cache.hits, _score_cache.misses, len(_score_cache)
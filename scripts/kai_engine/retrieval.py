@@ -1,76 +1,875 @@
 #!/usr/bin/env python3
 """
-Retrieval Module - 连接 Chroma 向量库与 Rerank 精排模型
+Retrieval Module - 连接向量库与 Rerank 精排模型
 KAI Brain V3.3 记忆桥梁
+
+向量库后端（见 vector_store.py）：
+    get_db() 返回 VectorStore。build_index.py --backend numpy 写过 NumPy 库（chroma_db_data/numpy/）时
+    默认用它（memmap 点积检索，可选 IVF），否则用 Chroma；KAI_VECTOR_BACKEND=chroma/numpy 强制指定
+
+分片索引（见 shards.py）：
+    build_index.py --shards on 按顶层目录（00-Inbox 再细分一级）写入 chroma_db_data/shards/<分片>/，
+    每个分片有自己的向量库 / BM25 / 量化索引 / index_version。存在分片时查询并发发往各分片
+    （KAI_SHARD_WORKERS 线程），向量候选按距离、BM25 候选按分数合并 top-k 后再融合精排；
+    path_prefix 过滤会跳过无关分片。某个分片重建只让它自己重新加载
+
+缓存：
+    - 查询向量 LRU（key: 规范化查询）
+    - 最终结果 LRU（key: 规范化查询 + top_k + rerank + 索引版本）
+    - build_index.py 每次写库都会更新 index_version，旧结果随之失效
+
+预热：
+    warmup() 并行加载 Embedding/向量库与 Rerank 模型并各跑一次空推理，
+    避免第一个问题承担数秒的模型加载时间
+
+量化粗排：
+    build_index.py --quantize 生成 chroma_db_data/quantized/ 后，向量粗排改走量化索引
+    （PQ / int8 / fp16 近似距离 + float32 精确重排），不再加载向量库的 float32 向量；
+    KAI_QUANTIZED_SEARCH=0 关闭
+
+小节扩展（small-to-big）：
+    build_index.py 把多片段标题小节写入 sections/，片段元数据带 section_id。检索端只常驻偏移索引，
+    按 section_id 从数据文件读取小节。结果里的片段换成所在小节全文
+    （超过 SECTION_MAX_CHARS 时取命中片段附近的窗口），同一小节的多个命中只保留排名最高的一条；
+    hit["content"] 仍是命中片段，hit["section"] 为扩展后的正文。KAI_SMALL_TO_BIG=0 关闭
+
+结果多样性（MMR，见 diversity.py）：
+    精排保留 MMR_POOL_K（= RERANK_MIN_DEPTH，不额外加深精排）条候选，按 λ·相关度 − (1 − λ)·与已选结果的最大余弦相似度 贪心重排
+    （向量取自向量库已存的 embedding，不重新编码），再交给小节扩展截断到 top_k。
+    KAI_MMR_LAMBDA=1 只看相关度（关闭）；KAI_MAX_PER_SOURCE=N（默认 0 = 不限）把同一文件第 N 条之后的候选
+    排到其他文件的候选之后（只调整顺序，不丢弃）
+
+近重复别名：
+    build_index.py 构建时把近重复片段折叠到先出现的代表片段（near_dup.py），结果的 hit["aliases"]
+    列出被折叠片段所在的文件（如同一篇文章在 05-Workbench/Feishu_Sync 的副本）
+
+元数据过滤：
+    retrieve(query, filters={"source": "wechat", "date_from": "2025", "path_prefix": "00-Inbox/wechat"})
+    过滤条件（见 filters.py）下推到向量库（Chroma where / NumPy 行过滤）与 BM25 候选集合，精排前就缩小候选池
+
+混合检索：
+    向量召回与 BM25 关键词召回（build_index.py 写入的 chroma_db_data/bm25/）按 RRF 融合，
+    "GVM 公式" 这类精确术语不必依赖精排也能排到前面；KAI_HYBRID_SEARCH=0 关闭
+
+自适应精排：
+    ADAPTIVE_RERANK 开启时按粗排距离决定是否精排、精排多深，重模型按块打分并在 top_k 稳定时早停；
+    混合检索时按融合前的向量距离定深（RRF 伪距离与阈值不可比），两路第 1 名不一致时不跳过精排；
+    KAI_RERANK_FIRST_STAGE 指定轻量初筛模型（如 BAAI/bge-reranker-base）。
+    各阶段深度、跳过率、耗时见 rerank_metrics()（常驻服务 GET /metrics）
+
+批量检索：
+    retrieve_many() / search_many() 一次处理多条查询：查询向量一次批量编码、
+    向量库一次批量查询、所有 (查询, 候选) 配对合并进大 batch 精排（见 scripts/bench_search_many.py）
+
+常驻服务：
+    scripts/kai_engine/server.py 运行时，retrieve() 自动把请求转发给它（模型常驻，免加载）；
+    服务不可达时退回进程内加载。KAI_RETRIEVAL_URL 指定地址，KAI_RETRIEVAL_REMOTE=0 关闭转发
+
+导入约定：
+    torch / transformers / langchain / chromadb / FlagEmbedding / numpy 只在 get_db()、
+    get_reranker()、_diversify() 与 _IndexDir 的 store() / bm25() 里按需导入，import retrieval 本身保持轻量（见 scripts/bench_import_time.py）
 """
 
 import os
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from FlagEmbedding import FlagReranker
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+
+try:
+    from embedder import EMBEDDING_MODEL_NAME
+    from query_cache import TTLCache, normalize_query
+    from rerank import cascade_rerank, cascade_rerank_many, clear_score_cache, rerank_metrics
+    from filters import normalize_filters, filters_key
+    from shards import list_shards, shard_dir_name
+    from sections import SectionIndex, section_window
+except ImportError:
+    from .embedder import EMBEDDING_MODEL_NAME
+    from .query_cache import TTLCache, normalize_query
+    from .rerank import cascade_rerank, cascade_rerank_many, clear_score_cache, rerank_metrics
+    from .filters import normalize_filters, filters_key
+    from .shards import list_shards, shard_dir_name
+    from .sections import SectionIndex, section_window
 
 # 路径配置
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "../../"))
 CHROMA_PATH = os.path.join(PROJECT_ROOT, "chroma_db_data")  # V3.3 标准路径
+SHARDS_PATH = os.path.join(CHROMA_PATH, "shards")  # build_index.py --shards on 写入，存在时只用分片
+# 索引目录（CHROMA_PATH 或单个分片）内的布局，均由 build_index.py 写入
+INDEX_VERSION_FILE = "index_version"   # 每次写库后更新
+BM25_DIR = "bm25"                      # 与向量库同步写入
+SECTIONS_DIR = "sections"              # 与向量库同步写入（多片段标题小节全文）
+NEAR_DUP_DIR = "near_dup"              # 与向量库同步写入（近重复片段别名表）
+QUANTIZED_DIR = "quantized"            # --quantize 写入
+NUMPY_STORE_DIR = "numpy"              # --backend numpy 写入
+
+# 检索参数
+CANDIDATE_K = 20   # 粗排候选数（分片时为合并后的候选数）
+SHARD_WORKERS = int(os.getenv("KAI_SHARD_WORKERS", "8"))   # 分片并发查询线程数
+
+# 向量库后端：auto（有 NumPy 库就用，否则 Chroma）/ chroma / numpy
+VECTOR_BACKEND = os.getenv("KAI_VECTOR_BACKEND", "auto")
+IVF_NPROBE = int(os.getenv("KAI_IVF_NPROBE", "8"))   # NumPy 库启用 IVF 时每次扫描的分区数
+
+# small-to-big：命中片段换成所在标题小节全文，同一小节只注入一次（KAI_SMALL_TO_BIG=0 关闭）
+SMALL_TO_BIG = os.getenv("KAI_SMALL_TO_BIG", "1") != "0"
+SECTION_MAX_CHARS = int(os.getenv("KAI_SECTION_MAX_CHARS", "2000"))   # 超长小节只取命中片段附近的窗口
+
+# 结果多样性（MMR）：λ 越小越偏向与已选结果不同的片段
+MMR_LAMBDA = float(os.getenv("KAI_MMR_LAMBDA", "0.7"))          # 1 = 只看相关度
+MAX_PER_SOURCE = int(os.getenv("KAI_MAX_PER_SOURCE", "0"))       # 同一文件超过几条后延后，0 = 不限
+
+# 量化粗排（仅在量化索引存在时生效）
+QUANTIZED_SEARCH = os.getenv("KAI_QUANTIZED_SEARCH", "1") != "0"
+RESCORE_K = 100      # 进入 float32 精确重排的候选数
+PQ_SHORTLIST = 400   # PQ 阶段保留的候选数
+
+# 混合检索（KAI_HYBRID_SEARCH=0 时只用向量召回）
+HYBRID_SEARCH = os.getenv("KAI_HYBRID_SEARCH", "1") != "0"
+BM25_K = 20        # BM25 召回数
+RRF_K = 60         # RRF 平滑常数：融合分 = Σ 1 / (RRF_K + 名次)
+
+# 自适应精排（KAI_ADAPTIVE_RERANK=0 时始终精排全部候选）
+ADAPTIVE_RERANK = os.getenv("KAI_ADAPTIVE_RERANK", "1") != "0"
+RERANK_SKIP_RATIO = 0.5        # 第 2 名距离 >= 第 1 名 × 1.5：明显胜出，跳过精排
+RERANK_DEPTH_RATIO = 0.3       # 只精排距离 <= 第 1 名 × 1.3 的候选
+RERANK_MIN_DEPTH = 8           # 精排深度下限（且不小于 top_k 与 MMR_POOL_K）
+# 开启结果多样性时精排保留、参与 MMR 重排的候选数（不小于 top_k）。它作为 top_k 传给 cascade_rerank，
+# 也就抬高了精排深度下限，所以与 RERANK_MIN_DEPTH 取同一个值，不额外加深精排
+MMR_POOL_K = RERANK_MIN_DEPTH
+RERANK_EARLY_EXIT_STEP = 4     # 重模型每块追加打分的候选数
+RERANK_MODEL = 'BAAI/bge-reranker-v2-m3'
+FIRST_STAGE_MODEL = os.getenv("KAI_RERANK_FIRST_STAGE", "")   # 空串 = 不初筛
+FIRST_STAGE_KEEP = 10          # 初筛后交给重模型的候选数
+
+# 常驻检索服务（server.py）
+RETRIEVAL_URL = os.getenv("KAI_RETRIEVAL_URL", "http://127.0.0.1:8765")
+USE_REMOTE = os.getenv("KAI_RETRIEVAL_REMOTE", "1") != "0"
+REMOTE_TIMEOUT = 60          # 单次请求超时（秒）
+HEALTH_TIMEOUT = 2           # 预热前探测服务的超时（秒）
+REMOTE_RETRY_SECONDS = 30    # 服务不可达后，多久内不再尝试
+
+# 缓存配置
+QUERY_CACHE_SIZE = 512      # 查询向量条数
+RESULT_CACHE_SIZE = 256     # 最终结果条数
+FILTER_CACHE_SIZE = 64      # 过滤条件 -> 命中 chunk ID 集合（BM25 候选过滤）
+CACHE_TTL_SECONDS = 600     # 10 分钟
 
 _embedding_model = None
 _reranker_model = None
-_vector_db = None
+_first_stage_model = None
+# 模型懒加载锁（athink 等并发调用时避免重复加载；两个模型各一把，互不阻塞）
+_db_lock = threading.Lock()
+_reranker_lock = threading.Lock()
+_first_stage_lock = threading.Lock()
+# 索引目录（未分片时只有 CHROMA_PATH 本身）：{路径: _IndexDir}
+_index_lock = threading.Lock()
+_index_dirs = {}
+_shard_pool = None
 
-def get_db():
-    global _embedding_model, _vector_db
-    if _vector_db is None:
+_query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=CACHE_TTL_SECONDS)
+_result_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=CACHE_TTL_SECONDS)
+_filter_cache = TTLCache(maxsize=FILTER_CACHE_SIZE, ttl=CACHE_TTL_SECONDS)
+_cached_index_version = None
+_remote_down_until = 0.0
+
+def get_index_version():
+    """
+    当前索引版本
+
+    读 build_index.py 写入的 index_version（旧库没有该文件时为空串；分片时拼接各分片版本），
+    版本变化时清空结果缓存与精排分数缓存。
+    """
+    global _cached_index_version
+    index_dirs = get_index_dirs()
+    if index_dirs[0].name:
+        version = "|".join(f"{d.name}:{d.version()}" for d in index_dirs)
+    else:
+        version = index_dirs[0].version()
+
+    if version != _cached_index_version:
+        _result_cache.clear()
+        _filter_cache.clear()
+        clear_score_cache()
+        _cached_index_version = version
+    return version
+
+def clear_caches():
+    """清空查询向量与结果缓存"""
+    _query_cache.clear()
+    _result_cache.clear()
+
+def embed_query(query):
+    """编码查询（LRU + TTL 缓存）"""
+    key = normalize_query(query)
+    vector = _query_cache.get(key)
+    if vector is None:
+        vector = get_embedding_model().embed_query(query)
+        _query_cache.put(key, vector)
+    return vector
+
+def embed_queries(queries):
+    """批量编码查询：缓存未命中的查询一次过模型"""
+    keys = [normalize_query(q) for q in queries]
+    vectors = [_query_cache.get(key) for key in keys]
+    missing = {}   # 规范化查询 -> 原始查询（去重）
+    for query, key, vector in zip(queries, keys, vectors):
+        if vector is None:
+            missing.setdefault(key, query)
+    if missing:
+        new_vectors = get_embedding_model().embed_documents(list(missing.values()))
+        fresh = dict(zip(missing, new_vectors))
+        for key, vector in fresh.items():
+            _query_cache.put(key, vector)
+        vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+    return vectors
+
+def get_embedding_model():
+    global _embedding_model
+    if _embedding_model is not None:
+        return _embedding_model
+    with _db_lock:
+        if _embedding_model is not None:
+            return _embedding_model
         print("⚙️ [Retrieval] 加载 Embedding 模型...")
-        _embedding_model = HuggingFaceEmbeddings(model_name="shibing624/text2vec-base-chinese")
-        _vector_db = Chroma(persist_directory=CHROMA_PATH, embedding_function=_embedding_model)
-    return _vector_db
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        # 检索端只编码查询（embed_query 自带 TTL 缓存），不读写构建端的磁盘 embedding 缓存：
+        # 它只允许 build_index.py 单进程写入
+        _embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
+class _IndexDir:
+    """
+    一个索引目录（未分片时是 CHROMA_PATH，分片时是 SHARDS_PATH 下的一个分片）
+
+    向量库 / BM25 按该目录自己的 index_version 懒加载：某个分片重建只让它自己重新加载
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self._chroma = None
+        self._lock = threading.RLock()
+        self._loaded = {}   # {名称: (版本, 索引)}
+
+    def version(self):
+        try:
+            with open(os.path.join(self.path, INDEX_VERSION_FILE), 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    def _versioned(self, name, loader):
+        """按 index_version 缓存磁盘索引，版本变化时重新 loader()"""
+        version = self.version()
+        cached = self._loaded.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._lock:
+            cached = self._loaded.get(name)
+            if cached is None or cached[0] != version:
+                cached = (version, loader())
+                self._loaded[name] = cached
+        return cached[1]
+
+    def chroma(self):
+        if self._chroma is None:
+            with self._lock:
+                if self._chroma is None:
+                    from langchain_community.vectorstores import Chroma
+                    try:
+                        from vector_store import ChromaStore
+                    except ImportError:
+                        from .vector_store import ChromaStore
+                    self._chroma = ChromaStore(Chroma(persist_directory=self.path,
+                                                      embedding_function=get_embedding_model()))
+        return self._chroma
+
+    def store(self):
+        """
+        该目录的向量库（VectorStore，见 vector_store.py）
+
+        VECTOR_BACKEND 为 auto / numpy 时优先用 NumPy 库，不存在则退回 Chroma；
+        有量化索引且 QUANTIZED_SEARCH 开启时外面再包一层量化粗排
+        """
+        def load():
+            try:
+                from vector_store import NumpyStore, QuantizedStore
+                from quantized_index import QuantizedIndex
+            except ImportError:
+                from .vector_store import NumpyStore, QuantizedStore
+                from .quantized_index import QuantizedIndex
+            store = None
+            if VECTOR_BACKEND != "chroma":
+                store = NumpyStore.load(os.path.join(self.path, NUMPY_STORE_DIR), nprobe=IVF_NPROBE)
+            if store is None:
+                store = self.chroma()
+            qindex = QuantizedIndex.load(os.path.join(self.path, QUANTIZED_DIR)) if QUANTIZED_SEARCH else None
+            if qindex is None:
+                return store
+            return QuantizedStore(qindex, store, rescore_k=RESCORE_K, pq_shortlist=PQ_SHORTLIST)
+        return self._versioned("store", load)
+
+    def bm25(self):
+        """BM25 索引；未构建或分词器不可用时返回 None"""
+        def load():
+            try:
+                from bm25 import BM25Index, jieba_available
+            except ImportError:
+                from .bm25 import BM25Index, jieba_available
+            index = BM25Index.load(os.path.join(self.path, BM25_DIR))
+            if index is not None and index.tokenizer == "jieba" and not jieba_available():
+                print("⚠️ [Retrieval] BM25 索引使用 jieba 分词，但当前环境未安装 jieba，跳过关键词召回")
+                return None
+            return index
+        return self._versioned("bm25", load)
+
+    def sections(self):
+        """小节索引；未构建时返回 None"""
+        return self._versioned("sections", lambda: SectionIndex.load(os.path.join(self.path, SECTIONS_DIR)))
+
+    def aliases(self):
+        """近重复别名 {代表 chunk ID: [别名文件相对路径, ...]}；未构建时为空"""
+        def load():
+            try:
+                from near_dup import load_aliases
+            except ImportError:
+                from .near_dup import load_aliases
+            return {rep: [relpath for _, relpath in aliases]
+                    for rep, aliases in load_aliases(os.path.join(self.path, NEAR_DUP_DIR)).items()}
+        return self._versioned("aliases", load)
+
+def _index_dir(name, path):
+    index_dir = _index_dirs.get(path)
+    if index_dir is None:
+        with _index_lock:
+            index_dir = _index_dirs.setdefault(path, _IndexDir(name, path))
+    return index_dir
+
+def get_index_dirs():
+    """当前生效的索引目录：有分片时为全部分片，否则为 CHROMA_PATH"""
+    shards = list_shards(SHARDS_PATH)
+    if not shards:
+        return [_index_dir("", CHROMA_PATH)]
+    return [_index_dir(name, os.path.join(SHARDS_PATH, shard_dir_name(name))) for name in shards]
+
+def _get_shard_pool():
+    global _shard_pool
+    if _shard_pool is None:
+        with _index_lock:
+            if _shard_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _shard_pool = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="kai-shard")
+    return _shard_pool
+
+def _fan_out(fn, items):
+    """对每个分片并发执行 fn（单个分片时直接调用）"""
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    return list(_get_shard_pool().map(fn, items))
+
+def get_db():
+    """
+    向量库（VectorStore，见 vector_store.py）
+
+    未分片时为 CHROMA_PATH 的向量库；分片时为 ShardedStore，查询并发发往各分片再合并
+    """
+    get_embedding_model()
+    index_dirs = get_index_dirs()
+    if not index_dirs[0].name:
+        return index_dirs[0].store()
+    try:
+        from vector_store import ShardedStore
+    except ImportError:
+        from .vector_store import ShardedStore
+    stores = dict(zip([d.name for d in index_dirs], _fan_out(lambda d: d.store(), index_dirs)))
+    return ShardedStore(stores, executor=_get_shard_pool())
 
 def get_reranker():
     global _reranker_model
-    if _reranker_model is None:
+    if _reranker_model is not None:
+        return _reranker_model
+    with _reranker_lock:
+        if _reranker_model is not None:
+            return _reranker_model
         print("⚙️ [Retrieval] 加载 Rerank 模型...")
         try:
-            _reranker_model = FlagReranker('BAAI/bge-reranker-v2-m3', use_fp16=True)
+            from FlagEmbedding import FlagReranker
+            _reranker_model = FlagReranker(RERANK_MODEL, use_fp16=True)
         except Exception as e:
             print(f"⚠️ Rerank 模型加载失败: {e}")
             _reranker_model = None
     return _reranker_model
 
-def search_knowledge_base(query, top_k=5, rerank=True):
-    """搜索知识库"""
+def get_first_stage_reranker():
+    """轻量初筛模型（未配置或加载失败时返回 None，级联退化为单模型）"""
+    global _first_stage_model, FIRST_STAGE_MODEL
+    if not FIRST_STAGE_MODEL or _first_stage_model is not None:
+        return _first_stage_model
+    with _first_stage_lock:
+        if _first_stage_model is not None:
+            return _first_stage_model
+        print(f"⚙️ [Retrieval] 加载初筛模型 {FIRST_STAGE_MODEL}...")
+        try:
+            from FlagEmbedding import FlagReranker
+            _first_stage_model = FlagReranker(FIRST_STAGE_MODEL, use_fp16=True)
+        except Exception as e:
+            print(f"⚠️ 初筛模型加载失败，关闭初筛: {e}")
+            FIRST_STAGE_MODEL = ""
+    return _first_stage_model
+
+def _depth_options():
+    """plan_rerank_depth 参数；关闭自适应时为空（精排全部候选）"""
+    if not ADAPTIVE_RERANK:
+        return {}
+    return {"skip_ratio": RERANK_SKIP_RATIO, "depth_ratio": RERANK_DEPTH_RATIO, "min_depth": RERANK_MIN_DEPTH}
+
+def _rerank_plan(vector_results, results):
+    """
+    精排定深用的 (距离, plan_rerank_depth 参数)
+
+    跳过/定深阈值按向量距离调校，RRF 融合后的 1 / 融合分不可比（两路都召回约 30，只有一路召回 >= 61），
+    混合检索时改用融合前的向量距离；两路召回的第 1 名不一致时不跳过精排。没有向量候选时精排全部候选
+    """
+    options = _depth_options()
+    if results is vector_results or not options:
+        return [distance for _, distance in results], options
+    if not vector_results:
+        return [distance for _, distance in results], {}
+    if _candidate_key(vector_results[0][0]) != _candidate_key(results[0][0]):
+        options = dict(options, skip_ratio=None)
+    return [distance for _, distance in vector_results], options
+
+def warmup():
+    """
+    并行预加载检索组件，并各跑一次空推理（分配缓冲区/触发惰性初始化）
+
+    常驻检索服务可达时检索请求都会转发过去，不在本进程加载任何模型（"remote" 为 True）
+
+    Returns:
+        各组件耗时（毫秒），如 {"embedding_load_ms": ..., "reranker_warmup_ms": ...}；
+        失败的组件记录在 "errors"
+    """
+    t_start = time.perf_counter()
+    if remote_available():
+        timings = {"remote": True, "total_ms": round((time.perf_counter() - t_start) * 1000, 1)}
+        print(f"🛰️ [Retrieval] 检测到常驻检索服务 {RETRIEVAL_URL}，跳过本地预热")
+        return timings
+
+    timings = {}
+    errors = {}
+
+    def timed(name, fn):
+        t = time.perf_counter()
+        result = fn()
+        timings[name] = round((time.perf_counter() - t) * 1000, 1)
+        return result
+
+    def warm_db():
+        try:
+            model = timed("embedding_load_ms", get_embedding_model)
+            db = timed("vector_store_load_ms", get_db)
+            # 直接调模型，不写入查询缓存
+            vector = timed("embedding_warmup_ms", lambda: model.embed_query("预热"))
+            timed("vector_warmup_ms", lambda: _vector_candidates(db, [vector]))
+            if HYBRID_SEARCH:
+                timed("bm25_load_ms", lambda: _fan_out(lambda d: d.bm25(), get_index_dirs()))
+            if SMALL_TO_BIG:
+                timed("sections_load_ms", lambda: _fan_out(lambda d: d.sections(), get_index_dirs()))
+        except Exception as e:
+            errors["embedding"] = str(e)
+
+    def warm_reranker():
+        try:
+            reranker = timed("reranker_load_ms", get_reranker)
+            if reranker is not None:
+                timed("reranker_warmup_ms", lambda: reranker.compute_score([["预热", "预热"]]))
+            if ADAPTIVE_RERANK and FIRST_STAGE_MODEL:
+                timed("first_stage_load_ms", get_first_stage_reranker)
+        except Exception as e:
+            errors["reranker"] = str(e)
+
+    threads = [threading.Thread(target=warm_db), threading.Thread(target=warm_reranker)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    timings["total_ms"] = round((time.perf_counter() - t_start) * 1000, 1)
+    if errors:
+        timings["errors"] = errors
+
+    report = " | ".join(f"{k[:-3]} {v / 1000:.2f}s" for k, v in timings.items() if k.endswith("_ms"))
+    print(f"🔥 [Retrieval] 预热完成: {report}")
+    for name, err in errors.items():
+        print(f"⚠️ [Retrieval] {name} 预热失败: {err}")
+    return timings
+
+def remote_available():
+    """常驻检索服务是否可达（GET /health）；未启用转发时为 False"""
+    global _remote_down_until
+    if not USE_REMOTE or time.monotonic() < _remote_down_until:
+        return False
+    try:
+        with urllib.request.urlopen(f"{RETRIEVAL_URL}/health", timeout=HEALTH_TIMEOUT) as resp:
+            return json.loads(resp.read()).get("status") == "ok"
+    except (OSError, ValueError):
+        _remote_down_until = time.monotonic() + REMOTE_RETRY_SECONDS
+        return False
+
+def _post_remote(path, payload, field):
+    """POST 到常驻检索服务，返回响应中的 field；服务未启用/不可达时返回 None"""
+    global _remote_down_until
+    if not USE_REMOTE or time.monotonic() < _remote_down_until:
+        return None
+    request = urllib.request.Request(
+        f"{RETRIEVAL_URL}{path}", data=json.dumps(payload).encode('utf-8'),
+        headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=REMOTE_TIMEOUT) as resp:
+            return json.loads(resp.read())[field]
+    except urllib.error.HTTPError as e:
+        # 服务在线但请求失败：把服务端的错误抛给调用方（本地重试只会同样失败）
+        try:
+            message = json.loads(e.read()).get("error", e.reason)
+        except (OSError, ValueError, AttributeError):
+            message = e.reason
+        raise (ValueError if e.code < 500 else RuntimeError)(f"检索服务返回 {e.code}: {message}") from None
+    except (OSError, ValueError, KeyError):
+        _remote_down_until = time.monotonic() + REMOTE_RETRY_SECONDS
+        return None
+
+def remote_retrieve(query, top_k=5, rerank=True, filters=None):
+    """
+    请求常驻检索服务
+
+    Returns:
+        结构化结果列表；服务未启用/不可达时返回 None（调用方退回本地检索）
+
+    Raises:
+        ValueError: 服务判定请求参数非法（400）
+        RuntimeError: 服务端检索出错（500）
+    """
+    payload = {"query": query, "top_k": top_k, "rerank": rerank, "filters": filters}
+    return _post_remote("/retrieve", payload, "hits")
+
+def remote_retrieve_many(queries, top_k=5, rerank=True, filters=None):
+    """批量版 remote_retrieve，返回与 queries 对应的结果列表，或 None"""
+    payload = {"queries": queries, "top_k": top_k, "rerank": rerank, "filters": filters}
+    return _post_remote("/retrieve_many", payload, "results")
+
+def search_knowledge_base(query, top_k=5, rerank=True, filters=None):
+    """搜索知识库（返回可直接注入 Prompt 的文本列表）"""
+    return [hit["text"] for hit in retrieve(query, top_k=top_k, rerank=rerank, filters=filters)]
+
+def search_many(queries, top_k=5, rerank=True, filters=None):
+    """批量搜索知识库，返回与 queries 对应的文本列表"""
+    return [[hit["text"] for hit in hits]
+            for hits in retrieve_many(queries, top_k=top_k, rerank=rerank, filters=filters)]
+
+def retrieve(query, top_k=5, rerank=True, filters=None):
+    """
+    搜索知识库，返回结构化结果
+
+    Args:
+        filters: 可选元数据过滤，如 {"source": "wechat", "date_from": "2025-01-01",
+                 "date_to": "2025-12-31", "content_type": ["article", "post"], "path_prefix": "00-Inbox"}
+
+    Returns:
+        [{"text": 注入 Prompt 的文本, "content": 原始片段, "score": 排序分,
+          "rerank_score": 精排分（未精排为 None）, "distance": 向量距离,
+          "section": 扩展后的小节正文（small-to-big，无小节时同 content）,
+          "source": 来源, "chunk_id": 片段 ID, "chunk_ids": 并入本条的同小节命中片段,
+          "aliases": 构建时被折叠的近重复片段所在文件, "metadata": 元数据}, ...]
+        score 精排时为 rerank_score（越大越相关），否则为 distance（越小越相关）；
+        混合检索时 distance 为 1 / RRF 融合分
+
+    Raises:
+        ValueError: 过滤条件非法；向量库 / 模型 / 检索服务的错误原样抛出，
+        不再吞成空结果（"知识库里没有" 与 "检索失败" 要能区分，由调用方决定如何降级）
+    """
+    filters = normalize_filters(filters)
+    cache_key = (normalize_query(query), top_k, rerank, filters_key(filters), get_index_version())
+    cached = _result_cache.get(cache_key)
+    if cached is not None:
+        return [dict(hit) for hit in cached]
+
+    hits = remote_retrieve(query, top_k, rerank, filters)
+    if hits is None:
+        hits = _search(query, top_k, rerank, filters)
+    _result_cache.put(cache_key, tuple(hits))
+    return [dict(hit) for hit in hits]
+
+def retrieve_many(queries, top_k=5, rerank=True, filters=None):
+    """
+    批量检索：编码 / 粗排 / 精排各只走一次批量调用，filters 对所有查询生效
+    （精排只做跳过 + 定深，不做初筛与早停，结果可能与逐条 retrieve() 略有差异）
+
+    Returns:
+        与 queries 一一对应的结构化结果列表
+
+    Raises:
+        同 retrieve()
+    """
+    queries = list(queries)
+    filters = normalize_filters(filters)
+    version = get_index_version()
+    keys = [(normalize_query(q), top_k, rerank, filters_key(filters), version) for q in queries]
+    results = [_result_cache.get(key) for key in keys]
+
+    # 未命中的查询去重后一起检索
+    pending = {}
+    for query, key, hits in zip(queries, keys, results):
+        if hits is None:
+            pending.setdefault(key, query)
+    if pending:
+        todo = list(pending.values())
+        fresh = remote_retrieve_many(todo, top_k, rerank, filters)
+        if fresh is None:
+            fresh = _search_many(todo, top_k, rerank, filters)
+        fresh = dict(zip(pending, fresh))
+        for key, hits in fresh.items():
+            _result_cache.put(key, tuple(hits))
+        results = [fresh[key] if hits is None else hits for key, hits in zip(keys, results)]
+    return [[dict(hit) for hit in hits] for hits in results]
+
+def _hit_text(meta, body, annotate):
+    """注入 Prompt 的文本；annotate 时加来源/路径头"""
+    if not annotate:
+        return body
+    path = meta.get('header_path', '') or meta.get('Header 1', '')
+    return f"【来源: {meta.get('source', 'unknown')} | 路径: {path}】\n{body}"
+
+def _make_hit(doc, distance, rerank_score=None, annotate=None):
+    """组装单条结构化结果；精排结果（含自适应跳过精排的结果）带来源/路径头"""
+    meta = doc.metadata or {}
+    source = meta.get('source', 'unknown')
+    if annotate is None:
+        annotate = rerank_score is not None
+    return {
+        "text": _hit_text(meta, doc.page_content, annotate),
+        "content": doc.page_content,
+        "section": doc.page_content,
+        "score": rerank_score if rerank_score is not None else distance,
+        "rerank_score": rerank_score,
+        "distance": distance,
+        "source": source,
+        "chunk_id": meta.get('chunk_id', ''),
+        "chunk_ids": [meta.get('chunk_id', '')],
+        "metadata": meta,
+    }
+
+def _get_sections(section_ids):
+    """按 section_id 取小节全文（分片时逐个分片查找）"""
+    found = {}
+    for index in _fan_out(lambda d: d.sections(), get_index_dirs()):
+        if index is None:
+            continue
+        for section_id in section_ids:
+            if section_id not in found:
+                text = index.get(section_id)
+                if text is not None:
+                    found[section_id] = text
+        if len(found) == len(section_ids):
+            break
+    return found
+
+def _diversity_enabled():
+    return MMR_LAMBDA < 1 or MAX_PER_SOURCE > 0
+
+def _rerank_keep(top_k):
+    """精排保留的候选数：开启多样性时多留一些给 MMR 挑选"""
+    return max(top_k, MMR_POOL_K) if _diversity_enabled() else top_k
+
+def _diversify(hits):
+    """
+    MMR 重排 + 同文件条数上限（向量取自向量库；有片段取不到向量时保持原顺序）
+
+    Returns:
+        重排后的全部结果（超出同文件上限的排在后面，不丢弃）
+    """
+    if len(hits) <= 1 or not _diversity_enabled():
+        return hits
     try:
-        db = get_db()
-        # 1. 粗排
-        results = db.similarity_search_with_score(query, k=20)
-        if not results:
-            return []
-
-        if not rerank:
-            return [doc.page_content for doc, _ in results[:top_k]]
-
-        # 2. 精排
-        reranker = get_reranker()
-        if not reranker:
-            return [doc.page_content for doc, _ in results[:top_k]]
-
-        pass_1_docs = [doc for doc, _ in results]
-        pairs = [[query, doc.page_content] for doc in pass_1_docs]
-        scores = reranker.compute_score(pairs)
-
-        combined = list(zip(pass_1_docs, scores))
-        combined.sort(key=lambda x: x[1], reverse=True)
-
-        # 3. 格式化输出 (带 Metadata)
-        final_docs = []
-        for doc, score in combined[:top_k]:
-            meta = doc.metadata
-            source = meta.get('source', 'unknown')
-            path = meta.get('header_path', '') or meta.get('Header 1', '')
-            content = f"【来源: {source} | 路径: {path}】\n{doc.page_content}"
-            final_docs.append(content)
-
-        return final_docs
-    except Exception as e:
-        print(f"⚠️ 检索出错: {e}")
+        from diversity import rank_relevance, mmr_order
+    except ImportError:
+        from .diversity import rank_relevance, mmr_order
+    vectors = get_db().get_vectors({hit["chunk_id"] for hit in hits})
+    if any(hit["chunk_id"] not in vectors for hit in hits):
+        return hits
+    order = mmr_order(
+        rank_relevance([hit["rerank_score"] for hit in hits]),
+        [vectors[hit["chunk_id"]] for hit in hits],
+        lambda_=MMR_LAMBDA,
+        groups=[hit["metadata"].get('filepath') or hit["chunk_id"] for hit in hits],
+        max_per_group=MAX_PER_SOURCE,
+    )
+    return [hits[i] for i in order]
+
+def _finalize_hits(hits, top_k, annotate):
+    """排好序的结果 -> 最终结果：MMR 重排，小节扩展 + 去重截断到 top_k，再附上近重复别名"""
+    hits = _expand_sections(_diversify(hits), top_k, annotate)
+    if hits:
+        alias_maps = [aliases for aliases in _fan_out(lambda d: d.aliases(), get_index_dirs()) if aliases]
+        for hit in hits:
+            hit["aliases"] = list(dict.fromkeys(relpath for aliases in alias_maps for chunk_id in hit["chunk_ids"]
+                                                for relpath in aliases.get(chunk_id, ())))
+    return hits
+
+def _expand_sections(hits, top_k, annotate):
+    """
+    small-to-big：按排名顺序把命中片段换成所在小节，同一小节只保留排名最高的一条
+
+    后面命中同一小节的片段并入该条（chunk_ids），用于确定超长小节的窗口
+
+    Returns:
+        最多 top_k 条结果（多个命中落在同一小节时少于 top_k）
+    """
+    if not SMALL_TO_BIG:
+        return hits[:top_k]
+    section_ids = {hit["metadata"].get('section_id') for hit in hits} - {None, ""}
+    sections = _get_sections(section_ids) if section_ids else {}
+
+    groups = {}    # section_id -> (hit, [(start, end), ...])
+    expanded = []
+    for hit in hits:
+        meta = hit["metadata"]
+        section_id = meta.get('section_id')
+        span = (meta.get('start_index', 0), meta.get('start_index', 0) + len(hit["content"]))
+        if section_id in groups:
+            first, spans = groups[section_id]
+            first["chunk_ids"].append(hit["chunk_id"])
+            spans.append(span)
+            continue
+        if len(expanded) >= top_k:
+            continue
+        expanded.append(hit)
+        if section_id in sections:
+            groups[section_id] = (hit, [span])
+
+    for section_id, (hit, spans) in groups.items():
+        hit["section"] = section_window(sections[section_id], spans, SECTION_MAX_CHARS)
+        hit["text"] = _hit_text(hit["metadata"], hit["section"], annotate)
+    return expanded
+
+def _search(query, top_k, rerank, filters=None):
+    """粗排 + 精排（不经过结果缓存）"""
+    db = get_db()
+    # 1. 粗排（过滤条件下推到候选生成；向量 + BM25 融合）
+    vector_results = _vector_candidates(db, [embed_query(query)], filters)[0]
+    results = _hybrid_candidates(db, [query], [vector_results], filters)[0]
+    if not results:
         return []
+
+    if not rerank:
+        return _finalize_hits([_make_hit(doc, distance) for doc, distance in results], top_k, False)
+
+    # 2. 精排
+    reranker = get_reranker()
+    if not reranker:
+        return _finalize_hits([_make_hit(doc, distance) for doc, distance in results], top_k, False)
+
+    distances, depth_options = _rerank_plan(vector_results, results)
+    ranked = cascade_rerank(
+        reranker, query, [doc for doc, _ in results], distances, _rerank_keep(top_k),
+        first_stage=get_first_stage_reranker() if ADAPTIVE_RERANK else None,
+        first_stage_keep=FIRST_STAGE_KEEP,
+        early_exit_step=RERANK_EARLY_EXIT_STEP if ADAPTIVE_RERANK else None,
+        **depth_options
+    )
+
+    # 3. 格式化输出 (带 Metadata)
+    return _rank_hits(results, ranked, top_k)
+
+def _rank_hits(results, ranked, top_k):
+    """按 cascade_rerank 给出的 [(下标, 精排分), ...] 组装结果"""
+    hits = [_make_hit(results[i][0], results[i][1], score, annotate=True) for i, score in ranked]
+    return _finalize_hits(hits, top_k, True)
+
+def _search_many(queries, top_k, rerank, filters=None):
+    """批量粗排 + 精排（不经过结果缓存）"""
+    db = get_db()
+    # 1. 粗排：一次批量向量查询
+    vector_lists = _vector_candidates(db, embed_queries(queries), filters)
+    results_lists = _hybrid_candidates(db, queries, vector_lists, filters)
+
+    reranker = get_reranker() if rerank else None
+    if not reranker:
+        return [_finalize_hits([_make_hit(doc, distance) for doc, distance in results], top_k, False)
+                for results in results_lists]
+
+    # 2. 精排：所有查询的候选配对合并打分（批量路径只做跳过 + 定深）
+    plans = [_rerank_plan(vector_results, results) for vector_results, results in zip(vector_lists, results_lists)]
+    ranked_lists = cascade_rerank_many(
+        reranker, queries,
+        [[doc for doc, _ in results] for results in results_lists],
+        [distances for distances, _ in plans],
+        _rerank_keep(top_k), depth_options_list=[options for _, options in plans]
+    )
+    return [_rank_hits(results, ranked, top_k) for results, ranked in zip(results_lists, ranked_lists)]
+
+def _vector_candidates(db, vectors, filters=None):
+    """
+    向量粗排：一次向量库批量查询（量化索引 / 分片合并都在 VectorStore 内完成，过滤条件下推到向量库）
+
+    Returns:
+        与 vectors 对应的 [(doc, 距离), ...]，升序，最多 CANDIDATE_K 个
+    """
+    return db.query(vectors, CANDIDATE_K, filters)
+
+def _allowed_chunk_ids(db, filters):
+    """满足过滤条件的 chunk ID 集合（用于 BM25 候选过滤，按过滤条件缓存）"""
+    key = filters_key(filters)
+    allowed = _filter_cache.get(key)
+    if allowed is None:
+        allowed = db.filter_ids(filters)
+        _filter_cache.put(key, allowed)
+    return allowed
+
+def _candidate_key(doc):
+    return doc.metadata.get('chunk_id') or doc.page_content
+
+def _hybrid_candidates(db, queries, results_lists, filters=None):
+    """
+    向量候选与 BM25 候选按 RRF 融合
+
+    Returns:
+        与 queries 对应的 [(doc, 1 / 融合分), ...]，按融合分降序，最多 CANDIDATE_K 个；
+        未启用混合检索或无 BM25 索引时原样返回向量候选
+    """
+    indexes = [index for index in _fan_out(lambda d: d.bm25(), get_index_dirs()) if index is not None] \
+        if HYBRID_SEARCH else []
+    if not indexes:
+        return results_lists
+    allowed = _allowed_chunk_ids(db, filters) if filters else None
+    per_shard = _fan_out(lambda index: [index.search(query, k=BM25_K, allowed=allowed) for query in queries],
+                         indexes)
+    # 分片各自召回后按 BM25 分合并（各分片 idf 独立统计，分数只是近似可比）
+    keyword_lists = [sorted((hit for hits_lists in per_shard for hit in hits_lists[j]),
+                            key=lambda hit: hit[1], reverse=True)[:BM25_K]
+                     for j in range(len(queries))]
+
+    # 只被 BM25 召回的片段一次性从向量库取回
+    known = {doc.metadata.get('chunk_id') for results in results_lists for doc, _ in results}
+    fetched = db.get({chunk_id for hits in keyword_lists for chunk_id, _ in hits if chunk_id not in known})
+
+    fused_lists = []
+    for results, hits in zip(results_lists, keyword_lists):
+        docs = {}
+        scores = {}
+        for rank, (doc, _) in enumerate(results):
+            key = _candidate_key(doc)
+            docs[key] = doc
+            scores[key] = scores.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+        for rank, (chunk_id, _) in enumerate(hits):
+            if chunk_id not in docs:
+                if chunk_id not in fetched:
+                    continue
+                docs[chunk_id] = fetched[chunk_id]
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (RRF_K + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:CANDIDATE_K]
+        fused_lists.append([(docs[key], 1 / scores[key]) for key in ranked])
+    return fused_lists
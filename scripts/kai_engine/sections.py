@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Sections - 片段 -> 所在标题小节（父文档）索引
+KAI Brain small-to-big 检索：在 500 字小片段上匹配，注入 Prompt 时换成完整小节，同一小节只注入一次
+
+小节：文件内同一标题路径（Header 1~3）下的正文，即 chunker.split_sections 的一节。
+只切出一个片段的小节不入库（片段本身就是整节）；多片段小节的每个片段元数据带 section_id
+
+小节全文不常驻内存：
+    - 构建端 SectionWriter 边解析边把小节追加写入数据文件，内存里只有 {section_id: (相对路径, 偏移, 长度)}
+    - 检索端 SectionIndex 只读入偏移索引，get() 按偏移从数据文件读取单个小节
+
+存储格式（chroma_db_data/sections/，由 build_index.py 与 Chroma 同步写入）：
+    sections.<生成号>.jsonl  每行 {"id": section_id, "relpath": 文件相对路径, "text": 小节全文}
+    sections_index.json      {"data": 数据文件名, "sections": {section_id: [相对路径, 字节偏移, 字节长度]}}
+    （旧版只有 sections.jsonl、没有偏移索引，读取时扫描一遍建立偏移）
+"""
+
+import os
+import json
+import time
+import hashlib
+
+SECTIONS_FILE = "sections.jsonl"          # 旧版数据文件（无偏移索引）
+INDEX_FILE = "sections_index.json"
+
+
+def make_section_id(relpath, metadata):
+    """由 (文件相对路径, 标题路径) 派生稳定的小节 ID"""
+    key = "\x1f".join([relpath, metadata.get('Header 1', ''), metadata.get('Header 2', ''),
+                       metadata.get('Header 3', '')])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def section_window(text, spans, max_chars):
+    """
+    小节正文超过 max_chars 时只取命中片段附近的窗口
+
+    Args:
+        spans: 命中片段在小节中的 [(start, end), ...]，第一个为得分最高的片段
+
+    Returns:
+        窗口正文（截断处加省略号）
+    """
+    if len(text) <= max_chars:
+        return text
+    lo = min(start for start, _ in spans)
+    hi = max(end for _, end in spans)
+    if hi - lo > max_chars:
+        # 命中片段跨度太大：只围绕得分最高的片段取窗口
+        lo, hi = spans[0]
+    pad = max(0, max_chars - (hi - lo)) // 2
+    lo = max(0, min(lo - pad, len(text) - max_chars))
+    hi = min(len(text), lo + max_chars)
+    return ("……" if lo > 0 else "") + text[lo:hi] + ("……" if hi < len(text) else "")
+
+
+class SectionIndex:
+    """
+    小节索引（检索端，只读）
+
+    load() 读入偏移索引，get() 按 section_id 从数据文件读取正文（每次打开文件读取一行，
+    构建端替换数据文件不影响已打开的读取）
+    """
+
+    def __init__(self, data_path, entries):
+        self.data_path = data_path
+        self._entries = entries    # section_id -> (相对路径, 字节偏移, 字节长度)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, section_id):
+        entry = self._entries.get(section_id)
+        if entry is None:
+            return None
+        return json.loads(self.read_raw(entry[1], entry[2]))["text"]
+
+    def read_raw(self, offset, length):
+        with open(self.data_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def entries(self):
+        """[(section_id, 相对路径, 字节偏移, 字节长度), ...]，按偏移升序"""
+        return sorted(((section_id, *entry) for section_id, entry in self._entries.items()),
+                      key=lambda entry: entry[2])
+
+    @classmethod
+    def load(cls, index_dir):
+        """读取偏移索引；不存在时返回 None"""
+        index_path = os.path.join(index_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            return cls(os.path.join(index_dir, index["data"]),
+                       {section_id: tuple(entry) for section_id, entry in index["sections"].items()})
+
+        # 旧版：只有数据文件，扫描一遍建立偏移（正文不保留）
+        data_path = os.path.join(index_dir, SECTIONS_FILE)
+        if not os.path.exists(data_path):
+            return None
+        entries = {}
+        offset = 0
+        with open(data_path, 'rb') as f:
+            for line in f:
+                row = json.loads(line)
+                entries[row["id"]] = (row["relpath"], offset, len(line))
+                offset += len(line)
+        return cls(data_path, entries)
+
+
+class SectionWriter:
+    """
+    小节索引（构建端）：add() 把小节直接追加写入新的数据文件，commit() 写偏移索引并替换旧版本
+
+    Args:
+        index_dir: 小节索引目录
+        base: 已有的 SectionIndex（增量构建时），其中不属于 drop_files 的小节逐条拷贝到新数据文件
+        drop_files: 需要丢弃的文件相对路径（修改/删除的文件）
+    """
+
+    def __init__(self, index_dir, base=None, drop_files=()):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.data_name = f"sections.{time.time_ns()}.jsonl"
+        self._tmp_path = os.path.join(index_dir, self.data_name + ".tmp")
+        self._file = open(self._tmp_path, 'wb')
+        self._offset = 0
+        self._entries = {}
+        if base is not None:
+            drop_files = set(drop_files)
+            for section_id, relpath, offset, length in base.entries():
+                if relpath not in drop_files:
+                    self._write(section_id, relpath, base.read_raw(offset, length))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _write(self, section_id, relpath, line):
+        self._file.write(line)
+        self._entries[section_id] = (relpath, self._offset, len(line))
+        self._offset += len(line)
+
+    def add(self, sections):
+        """追加小节：[(section_id, 相对路径, 正文), ...]（同一 section_id 再次加入时以后写入的为准）"""
+        for section_id, relpath, text in sections:
+            line = json.dumps({"id": section_id, "relpath": relpath, "text": text}, ensure_ascii=False)
+            self._write(section_id, relpath, line.encode('utf-8') + b"\n")
+
+    def commit(self):
+        """落盘：数据文件就位后原子替换偏移索引，再删除不再引用的旧数据文件"""
+        self._file.close()
+        os.replace(self._tmp_path, os.path.join(self.index_dir, self.data_name))
+        index_path = os.path.join(self.index_dir, INDEX_FILE)
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"data": self.data_name,
+                       "sections": {section_id: list(entry) for section_id, entry in self._entries.items()}},
+                      f, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+        for name in os.listdir(self.index_dir):
+            if name != self.data_name and name.startswith("sections.") and name.endswith(".jsonl"):
+                os.remove(os.path.join(self.index_dir, name))
+
+    def abort(self):
+        """放弃本次写入（保留旧版本）"""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Retrieval Server - 常驻检索进程
+KAI Brain 共享记忆：Embedding 模型、Chroma、Rerank 模型只加载一次，
+CLI（ask_kai.py / brain.py）与 Web UI 通过 localhost HTTP 复用
+
+使用方法：
+    python3 scripts/kai_engine/server.py              # 默认 127.0.0.1:8765
+    python3 scripts/kai_engine/server.py --port 9000  # 客户端需设置 KAI_RETRIEVAL_URL=http://127.0.0.1:9000
+
+接口：
+    GET  /health         -> {"status": "ok", "index_version": ..., "backend": 向量库后端, "count": 片段数}
+    GET  /metrics        -> 自适应精排指标（深度、跳过率、早停率、各阶段平均耗时）
+    POST /retrieve       {"query": str, "top_k": 5, "rerank": true, "filters": {...}} -> {"hits": [...]}
+    POST /retrieve_many  {"queries": [str, ...], "top_k": 5, "rerank": true, "filters": {...}} -> {"results": [[...], ...]}
+    filters 可省略，格式见 filters.py
+    参数非法（含过滤条件类型不对）-> 400；检索出错 -> 500，均为 {"error": 信息}
+
+未启动时，retrieval.retrieve() 自动退回进程内加载。
+"""
+
+import os
+import sys
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, CURRENT_DIR)
+
+import retrieval  # noqa: E402
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class RetrievalHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(200, retrieval.rerank_metrics())
+            return
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+            return
+        db = retrieval.get_db()
+        self._send_json(200, {
+            "status": "ok",
+            "index_version": retrieval.get_index_version(),
+            "backend": db.backend,
+            "count": db.count(),
+        })
+
+    def do_POST(self):
+        # 路径 -> (请求字段, 检索函数, 响应字段)
+        routes = {
+            "/retrieve": ("query", retrieval.retrieve, "hits"),
+            "/retrieve_many": ("queries", retrieval.retrieve_many, "results"),
+        }
+        if self.path not in routes:
+            self._send_json(404, {"error": "not found"})
+            return
+        field, handler, result_field = routes[self.path]
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            query = request[field]
+            if field == "queries":
+                if not isinstance(query, list) or not all(isinstance(q, str) for q in query):
+                    raise ValueError("queries must be a list of strings")
+            elif not isinstance(query, str):
+                raise ValueError("query must be a string")
+            top_k = int(request.get("top_k", 5))
+            if top_k < 1:
+                raise ValueError("top_k must be >= 1")
+            rerank = request.get("rerank", True)
+            if not isinstance(rerank, bool):
+                raise ValueError("rerank must be a boolean")
+            filters = request.get("filters")
+            if filters is not None and not isinstance(filters, dict):
+                raise ValueError("filters must be an object")
+            retrieval.normalize_filters(filters)     # 字段类型不对时抛 ValueError
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            self._send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        try:
+            result = handler(query, top_k=top_k, rerank=rerank, filters=filters)
+        except Exception as e:
+            # 检索失败不能伪装成 "没有命中"
+            self.log_error("retrieval failed: %r", e)
+            self._send_json(500, {"error": f"retrieval failed: {e}"})
+            return
+        self._send_json(200, {result_field: result})
+
+    def log_request(self, code='-', size='-'):
+        # 不逐条打印访问日志（错误仍经 log_error 输出）
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KAI 常驻检索服务")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    # 服务进程自身必须走本地检索
+    retrieval.USE_REMOTE = False
+    retrieval.warmup()
+
+    server = ThreadingHTTPServer((args.host, args.port), RetrievalHandler)
+    print(f"🛰️ [Server] KAI 检索服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 [Server] 已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Shards - 按知识库目录分片
+KAI Brain 分片索引：每个顶层目录一个独立索引，大分片重建不阻塞、不失效小分片
+
+分片规则：
+    - 文件按相对路径的顶层目录归入分片，如 10-Frameworks/x/y.md -> "10-Frameworks"
+    - SPLIT_FOLDERS 中的目录再细分一级：00-Inbox/wechat/a.md -> "00-Inbox/wechat"
+    - 知识库根目录下的散文件归入 ROOT_SHARD
+
+存储：chroma_db_data/shards/<分片目录名>/，每个分片是完整的索引目录
+（Chroma + bm25/ + quantized/ + numpy/ + index_manifest.json + index_version），
+由 build_index.py --shards on / --shard NAME 写入；分片目录名把 "/" 换成 "__"
+"""
+
+import os
+
+SPLIT_FOLDERS = ("00-Inbox",)
+ROOT_SHARD = "_root"
+_DIR_SEP = "__"
+
+
+def shard_of(relpath):
+    """文件相对路径 -> 分片名"""
+    parts = [p for p in relpath.replace("\\", "/").split("/") if p][:-1]
+    if not parts:
+        return ROOT_SHARD
+    if parts[0] in SPLIT_FOLDERS and len(parts) > 1:
+        return "/".join(parts[:2])
+    return parts[0]
+
+
+def shard_dir_name(shard):
+    return shard.replace("/", _DIR_SEP)
+
+
+def shard_from_dir_name(dir_name):
+    return dir_name.replace(_DIR_SEP, "/")
+
+
+def list_shards(shards_dir):
+    """已构建完成（写过 index_version）的分片名，升序"""
+    if not os.path.isdir(shards_dir):
+        return []
+    return sorted(
+        shard_from_dir_name(name) for name in os.listdir(shards_dir)
+        if os.path.exists(os.path.join(shards_dir, name, "index_version"))
+    )
+
+
+def shard_may_match(shard, path_prefix):
+    """分片是否可能包含 path_prefix 下的文件（用于按目录过滤时跳过无关分片）"""
+    if not path_prefix:
+        return True
+    if shard == ROOT_SHARD:
+        return False
+    return shard == path_prefix or shard.startswith(path_prefix + "/") or path_prefix.startswith(shard + "/")
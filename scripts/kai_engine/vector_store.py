@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Vector Store - 检索端向量库接口（Chroma / NumPy 两种后端）
+KAI Brain 向量召回层：retrieval.get_db() 返回 VectorStore，检索代码不直接碰 Chroma 集合
+
+接口：
+    count()                      片段数
+    query(vectors, k, filters)   批量向量检索 -> 每个查询 [(Document, 距离), ...]，升序
+    get(ids)                     按 chunk_id 取回 {chunk_id: Document}
+    get_vectors(ids)             按 chunk_id 取回已存的向量 {chunk_id: float32 向量}（结果多样性 MMR 用，不重新编码）
+    filter_ids(filters)          满足过滤条件（见 filters.py）的 chunk_id 集合
+
+后端：
+    ChromaStore   包装 LangChain Chroma，过滤条件下推到 where；距离为平方欧氏距离
+    NumpyStore    归一化向量放在 memmap 矩阵里，点积暴力检索（可选 IVF 分区只扫 nprobe 个分区）；
+                  免去 chromadb 客户端与 SQLite 的启动和单次查询开销，适合几千到几十万片段的库。
+                  距离为单位向量的平方欧氏距离 2 - 2·cos，与 Chroma 一样越小越相关
+
+组合：
+    QuantizedStore  量化索引（quantized_index.py）粗排，正文与过滤交给底层向量库
+    ShardedStore    多个分片（shards.py）并发查询后按距离合并 top-k；各分片应使用同一种后端，距离才可比
+
+NumpyStore 存储格式（chroma_db_data/numpy/，由 build_index.py --backend numpy 写入）：
+    meta.json         维度、条数、IVF 分区数
+    ids.txt           每行一个 chunk_id，行号即矩阵行号
+    vectors.f32       归一化 float32 矩阵 (n, dim)；IVF 时按分区连续存放
+    docs.jsonl        每行 {"text": 正文, "metadata": 元数据}，与矩阵行一一对应
+    ivf_centroids.f32 / ivf_offsets.i64   IVF 分区中心 (nlist, dim) 与各分区起始行 (nlist + 1)
+"""
+
+import os
+import json
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+try:
+    from filters import build_where, needs_post_filter, matches, filters_key
+    from query_cache import TTLCache
+    from quantized_index import kmeans
+    from shards import shard_may_match
+except ImportError:
+    from .filters import build_where, needs_post_filter, matches, filters_key
+    from .query_cache import TTLCache
+    from .quantized_index import kmeans
+    from .shards import shard_may_match
+
+DEFAULT_NPROBE = 8
+IVF_TRAIN_SAMPLE = 50000
+MASK_CACHE_SIZE = 64      # 过滤条件 -> 行号数组
+
+
+def _document(text, metadata):
+    from langchain_core.documents import Document
+    return Document(page_content=text or "", metadata=metadata or {})
+
+
+def _top_k(scores, k):
+    """返回分数最大的 k 个下标（降序）"""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class VectorStore(ABC):
+    """检索端向量库接口（后端缺少任一方法时实例化即报错，而不是查询到一半才失败）"""
+
+    backend = ""
+
+    @abstractmethod
+    def count(self):
+        ...
+
+    @abstractmethod
+    def query(self, vectors, k, filters=None):
+        ...
+
+    @abstractmethod
+    def get(self, ids):
+        ...
+
+    @abstractmethod
+    def get_vectors(self, ids):
+        ...
+
+    @abstractmethod
+    def filter_ids(self, filters):
+        ...
+
+
+class ChromaStore(VectorStore):
+    """LangChain Chroma 后端（db 为 langchain_community.vectorstores.Chroma）"""
+
+    backend = "chroma"
+
+    def __init__(self, db):
+        self.db = db
+
+    def count(self):
+        return self.db._collection.count()
+
+    def query(self, vectors, k, filters=None):
+        response = self.db._collection.query(
+            query_embeddings=vectors,
+            n_results=k,
+            where=build_where(filters),
+            include=["documents", "metadatas", "distances"],
+        )
+        results_lists = [
+            [(_document(text, meta), distance) for text, meta, distance in zip(texts, metas, distances)]
+            for texts, metas, distances in zip(response["documents"], response["metadatas"], response["distances"])
+        ]
+        if needs_post_filter(filters):
+            results_lists = [[(doc, distance) for doc, distance in results if matches(doc.metadata, filters)]
+                             for results in results_lists]
+        return results_lists
+
+    def get(self, ids):
+        if not ids:
+            return {}
+        rows = self.db._collection.get(ids=list(ids), include=["documents", "metadatas"])
+        return {chunk_id: _document(text, meta)
+                for chunk_id, text, meta in zip(rows["ids"], rows["documents"], rows["metadatas"])}
+
+    def get_vectors(self, ids):
+        if not ids:
+            return {}
+        rows = self.db._collection.get(ids=list(ids), include=["embeddings"])
+        return {chunk_id: np.asarray(vector, dtype=np.float32)
+                for chunk_id, vector in zip(rows["ids"], rows["embeddings"])}
+
+    def filter_ids(self, filters):
+        post_filter = needs_post_filter(filters)
+        rows = self.db._collection.get(where=build_where(filters), include=["metadatas"] if post_filter else [])
+        if post_filter:
+            return frozenset(i for i, meta in zip(rows["ids"], rows["metadatas"]) if matches(meta, filters))
+        return frozenset(rows["ids"])
+
+
+class NumpyStore(VectorStore):
+    """
+    NumPy 后端：归一化向量 memmap + 点积检索
+
+    - build() 由向量、正文、元数据构建并写盘
+    - load() 打开索引；正文与元数据读进内存（过滤在 Python 侧做），向量矩阵保持 memmap
+    """
+
+    backend = "numpy"
+
+    def __init__(self, index_dir, meta, ids, docs, nprobe=DEFAULT_NPROBE):
+        self.dir = index_dir
+        self.meta = meta
+        self.ids = ids
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self.texts = [doc.get("text", "") for doc in docs]
+        self.metadatas = [doc.get("metadata") or {} for doc in docs]
+        self.dim = meta["dim"]
+        self.nprobe = nprobe
+        n = len(ids)
+        self.vectors = np.memmap(os.path.join(index_dir, "vectors.f32"), dtype=np.float32, mode='r',
+                                 shape=(n, self.dim)) if n else np.zeros((0, self.dim), dtype=np.float32)
+        self.ivf_lists = meta.get("ivf_lists", 0)
+        self.centroids = None
+        self.offsets = None
+        if self.ivf_lists:
+            self.centroids = np.fromfile(os.path.join(index_dir, "ivf_centroids.f32"),
+                                         dtype=np.float32).reshape(self.ivf_lists, self.dim)
+            self.offsets = np.fromfile(os.path.join(index_dir, "ivf_offsets.i64"), dtype=np.int64)
+        self._masks = TTLCache(maxsize=MASK_CACHE_SIZE, ttl=None)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---------- 构建 ----------
+
+    @staticmethod
+    def build(index_dir, ids, vectors, texts, metadatas, ivf_lists=0):
+        """
+        归一化并写盘（先写临时目录再整体替换）
+
+        Args:
+            vectors: (n, dim) float 向量（不要求已归一化）
+            ivf_lists: IVF 分区数，0 表示不分区（暴力检索）
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        vectors = vectors / norms
+        order = np.arange(len(ids))
+        ivf_lists = min(ivf_lists, len(ids))
+
+        tmp_dir = index_dir + ".tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+
+        if ivf_lists:
+            rng = np.random.default_rng(0)
+            sample = vectors if len(vectors) <= IVF_TRAIN_SAMPLE else \
+                vectors[rng.choice(len(vectors), IVF_TRAIN_SAMPLE, replace=False)]
+            centroids = kmeans(sample, ivf_lists)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+            assign = (vectors @ centroids.T).argmax(1)
+            order = np.argsort(assign, kind="stable")
+            offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1)).astype(np.int64)
+            centroids.astype(np.float32).tofile(os.path.join(tmp_dir, "ivf_centroids.f32"))
+            offsets.tofile(os.path.join(tmp_dir, "ivf_offsets.i64"))
+            ivf_lists = len(centroids)
+
+        vectors[order].tofile(os.path.join(tmp_dir, "vectors.f32"))
+        with open(os.path.join(tmp_dir, "ids.txt"), 'w', encoding='utf-8') as f:
+            f.write("".join(ids[i] + "\n" for i in order))
+        with open(os.path.join(tmp_dir, "docs.jsonl"), 'w', encoding='utf-8') as f:
+            for i in order:
+                f.write(json.dumps({"text": texts[i], "metadata": metadatas[i] or {}}, ensure_ascii=False) + "\n")
+        with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({"dim": vectors.shape[1], "count": len(ids), "ivf_lists": ivf_lists}, f)
+
+        # 整体替换：旧目录先挪开再删除，读端最多看到完整的旧索引或新索引
+        old_dir = index_dir + ".old"
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        if os.path.exists(old_dir):
+            for name in os.listdir(old_dir):
+                os.remove(os.path.join(old_dir, name))
+            os.rmdir(old_dir)
+
+    @classmethod
+    def load(cls, index_dir, nprobe=DEFAULT_NPROBE):
+        """打开索引；不存在时返回 None"""
+        meta_path = os.path.join(index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, "ids.txt"), 'r', encoding='utf-8') as f:
+            ids = [line.rstrip("\n") for line in f if line.strip()]
+        with open(os.path.join(index_dir, "docs.jsonl"), 'r', encoding='utf-8') as f:
+            docs = [json.loads(line) for line in f if line.strip()]
+        return cls(index_dir, meta, ids, docs, nprobe=nprobe)
+
+    # ---------- 检索 ----------
+
+    def count(self):
+        return len(self.ids)
+
+    def _filter_rows(self, filters):
+        """满足过滤条件的行号（升序，按过滤条件缓存）"""
+        key = filters_key(filters)
+        rows = self._masks.get(key)
+        if rows is None:
+            rows = np.array([row for row, meta in enumerate(self.metadatas) if matches(meta, filters)],
+                            dtype=np.int64)
+            self._masks.put(key, rows)
+        return rows
+
+    def _probe_rows(self, query):
+        """IVF：与查询最接近的 nprobe 个分区的行号"""
+        lists = _top_k(self.centroids @ query, self.nprobe)
+        return np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+
+    def _hits(self, rows, scores, k):
+        order = _top_k(scores, k)
+        return [(_document(self.texts[rows[i]], self.metadatas[rows[i]]), float(2 - 2 * scores[i]))
+                for i in order]
+
+    def query(self, vectors, k, filters=None):
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if not self.ids:
+            return [[] for _ in queries]
+
+        if filters:
+            # 过滤后的行通常远少于全库，直接在这些行上精确检索（不走 IVF，避免分区内命中不足 k 个）
+            rows = self._filter_rows(filters)
+            if len(rows) == 0:
+                return [[] for _ in queries]
+            scores = np.asarray(self.vectors[rows]) @ queries.T
+            return [self._hits(rows, scores[:, j], k) for j in range(len(queries))]
+
+        if self.ivf_lists and self.nprobe < self.ivf_lists:
+            results_lists = []
+            for query in queries:
+                rows = self._probe_rows(query)
+                results_lists.append(self._hits(rows, np.asarray(self.vectors[rows]) @ query, k))
+            return results_lists
+
+        rows = np.arange(len(self.ids))
+        scores = self.vectors @ queries.T
+        return [self._hits(rows, scores[:, j], k) for j in range(len(queries))]
+
+    def get(self, ids):
+        return {chunk_id: _document(self.texts[self.rows[chunk_id]], self.metadatas[self.rows[chunk_id]])
+                for chunk_id in ids if chunk_id in self.rows}
+
+    def get_vectors(self, ids):
+        return {chunk_id: np.asarray(self.vectors[self.rows[chunk_id]]) for chunk_id in ids if chunk_id in self.rows}
+
+    def filter_ids(self, filters):
+        return frozenset(self.ids[row] for row in self._filter_rows(filters))
+
+
+class QuantizedStore(VectorStore):
+    """量化索引粗排（PQ / int8 / fp16 + float32 精确重排），正文、元数据与过滤交给底层向量库"""
+
+    def __init__(self, index, base, rescore_k=100, pq_shortlist=400):
+        self.index = index
+        self.base = base
+        self.rescore_k = rescore_k
+        self.pq_shortlist = pq_shortlist
+        self.backend = f"{base.backend}+{index.dtype}"
+        self._allowed = TTLCache(maxsize=MASK_CACHE_SIZE, ttl=None)
+
+    def count(self):
+        return self.base.count()
+
+    def query(self, vectors, k, filters=None):
+        allowed = self.filter_ids(filters) if filters else None
+        id_lists = [self.index.search(vector, k=k, allowed=allowed, rescore_k=self.rescore_k,
+                                      pq_shortlist=self.pq_shortlist) for vector in vectors]
+        docs = self.base.get({chunk_id for hits in id_lists for chunk_id, _ in hits})
+        return [[(docs[chunk_id], distance) for chunk_id, distance in hits if chunk_id in docs]
+                for hits in id_lists]
+
+    def get(self, ids):
+        return self.base.get(ids)
+
+    def get_vectors(self, ids):
+        # 从量化索引的 float32 memmap 按行读取，不向底层 Chroma 取 embedding
+        vectors = self.index.get_vectors(ids)
+        missing = set(ids) - vectors.keys()
+        if missing:
+            vectors.update(self.base.get_vectors(missing))
+        return vectors
+
+    def filter_ids(self, filters):
+        key = filters_key(filters)
+        allowed = self._allowed.get(key)
+        if allowed is None:
+            allowed = self.base.filter_ids(filters)
+            self._allowed.put(key, allowed)
+        return allowed
+
+
+class ShardedStore(VectorStore):
+    """
+    分片向量库：查询并发发往各分片，再按距离合并 top-k
+
+    Args:
+        stores: {分片名: VectorStore}
+        executor: concurrent.futures 执行器（None 时顺序查询）
+    """
+
+    backend = "sharded"
+
+    def __init__(self, stores, executor=None):
+        self.stores = stores
+        self.executor = executor
+
+    def _fan_out(self, fn, filters=None):
+        prefix = (filters or {}).get("path_prefix")
+        stores = [store for name, store in self.stores.items() if shard_may_match(name, prefix)]
+        if self.executor is None or len(stores) <= 1:
+            return [fn(store) for store in stores]
+        return list(self.executor.map(fn, stores))
+
+    def count(self):
+        return sum(self._fan_out(lambda store: store.count()))
+
+    def query(self, vectors, k, filters=None):
+        per_shard = self._fan_out(lambda store: store.query(vectors, k, filters), filters)
+        merged = []
+        for j in range(len(vectors)):
+            hits = [hit for results_lists in per_shard for hit in results_lists[j]]
+            merged.append(sorted(hits, key=lambda hit: hit[1])[:k])
+        return merged
+
+    def get(self, ids):
+        if not ids:
+            return {}
+        docs = {}
+        for part in self._fan_out(lambda store: store.get(ids)):
+            docs.update(part)
+        return docs
+
+    def get_vectors(self, ids):
+        if not ids:
+            return {}
+        vectors = {}
+        for part in self._fan_out(lambda store: store.get_vectors(ids)):
+            vectors.update(part)
+        return vectors
+
+    def filter_ids(self, filters):
+        return frozenset().union(*self._fan_out(lambda store: store.filter_ids(filters), filters))
@@ -0,0 +1,67 @@
+"""context_packer：中英文混排按 token 预算装填，不超预算"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "kai_engine"))
+
+import context_packer  # noqa: E402
+from context_packer import estimate_tokens, pack_contexts  # noqa: E402
+
+MIXED = [
+    "复盘是联想文化的重要组成部分。def score(x):\n    return {'gvm': x ** 2, \"ok\": True}  # GVM 公式\n" * 6,
+    "Growth = Volume × Margin；增长来自量与毛利的乘积。SELECT id, name FROM notes WHERE tag='gvm';" * 5,
+    "纯中文段落：如何把知识封装成产品，先定义用户、场景与交付物。" * 8,
+]
+
+
+def _char_tokenizer():
+    """每个字符一个 token 的分词器：token 数已知 = 字符数"""
+    tokenizers = pytest.importorskip("tokenizers")
+    vocab = {"[UNK]": 0}
+    for text in MIXED + [context_packer.TRUNCATION_MARK]:
+        for ch in text:
+            vocab.setdefault(ch, len(vocab))
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Split(tokenizers.Regex("."), behavior="isolated")
+    return tokenizer
+
+
+@pytest.fixture
+def use_tokenizer(monkeypatch):
+    def install(tokenizer):
+        monkeypatch.setattr(context_packer, "_tokenizer", tokenizer)
+        monkeypatch.setattr(context_packer, "_tokenizer_loaded", True)
+    return install
+
+
+def test_exact_count_with_tokenizer(use_tokenizer):
+    use_tokenizer(_char_tokenizer())
+    assert not context_packer.is_estimated()
+    for text in MIXED:
+        assert estimate_tokens(text) == len(text)
+
+
+@pytest.mark.parametrize("budget", [150, 400, 900])
+def test_pack_respects_known_token_count(use_tokenizer, budget):
+    use_tokenizer(_char_tokenizer())
+    hits = [{"text": text, "rerank_score": 1.0 - i * 0.1} for i, text in enumerate(MIXED)]
+    packed, report = pack_contexts(hits, budget, chunk_limit=300, min_tokens=20)
+    assert sum(len(text) for text in packed) == report["tokens"] <= budget
+    assert report["estimated"] is False
+    assert all(len(text) <= 300 for text in packed)
+
+
+def test_estimate_is_conservative(use_tokenizer):
+    """估算模式：不低于官方换算（中文 0.6 / 英文 0.3 token 每字符），并在报告中标记为估算"""
+    use_tokenizer(None)
+    for text in MIXED:
+        cjk = len(context_packer._CJK.findall(text))
+        baseline = cjk * 0.6 + (len(text) - cjk) * 0.3
+        assert estimate_tokens(text) >= baseline * context_packer.ESTIMATE_MARGIN
+    hits = [{"text": text, "rerank_score": None} for text in MIXED]
+    packed, report = pack_contexts(hits, 200)
+    assert report["estimated"] is True
+    assert sum(estimate_tokens(text) for text in packed) <= 200
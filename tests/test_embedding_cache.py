@@ -0,0 +1,77 @@
+"""EmbeddingCache：中断写入（torn write）后 key 与向量行不能错位"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "kai_engine"))
+
+from embedding_cache import EmbeddingCache, text_key  # noqa: E402
+
+MODEL = "test/model"
+DIM = 4
+
+
+def _vec(value):
+    return np.full(DIM, value, dtype=np.float32)
+
+
+def _seed(tmp_path):
+    cache = EmbeddingCache(MODEL, cache_dir=str(tmp_path))
+    cache.add(["a"], [_vec(1)])
+    cache.flush()
+    return cache
+
+
+def _assert_lookup(cache, expected):
+    for text, value in expected.items():
+        (vector,) = cache.lookup([text])
+        assert vector is not None, text
+        np.testing.assert_array_equal(vector, _vec(value))
+
+
+def test_vectors_written_but_keys_not(tmp_path):
+    cache = _seed(tmp_path)
+    # 模拟 flush 中断：向量已追加，key 未写
+    with open(cache.vectors_path, 'ab') as f:
+        f.write(_vec(9).tobytes())
+
+    cache = EmbeddingCache(MODEL, cache_dir=str(tmp_path))
+    cache.add(["b"], [_vec(2)])
+    cache.flush()
+
+    cache = EmbeddingCache(MODEL, cache_dir=str(tmp_path))
+    _assert_lookup(cache, {"a": 1, "b": 2})
+    assert len(cache) == 2
+
+
+def test_partial_vector_row(tmp_path):
+    cache = _seed(tmp_path)
+    with open(cache.vectors_path, 'ab') as f:
+        f.write(_vec(9).tobytes()[:6])
+
+    cache = EmbeddingCache(MODEL, cache_dir=str(tmp_path))
+    cache.add(["b"], [_vec(2)])
+    cache.flush()
+
+    cache = EmbeddingCache(MODEL, cache_dir=str(tmp_path))
+    _assert_lookup(cache, {"a": 1, "b": 2})
+    assert os.path.getsize(cache.vectors_path) == 2 * DIM * 4
+
+
+def test_extra_and_partial_keys(tmp_path):
+    cache = _seed(tmp_path)
+    # 多出一整行 key（没有对应向量）和半行 key
+    with open(cache.keys_path, 'a', encoding='utf-8') as f:
+        f.write(text_key("orphan") + "\n" + text_key("c")[:10])
+
+    cache = EmbeddingCache(MODEL, cache_dir=str(tmp_path))
+    assert cache.lookup(["orphan"]) == [None]
+    cache.add(["b", "c"], [_vec(2), _vec(3)])
+    cache.flush()
+
+    cache = EmbeddingCache(MODEL, cache_dir=str(tmp_path))
+    _assert_lookup(cache, {"a": 1, "b": 2, "c": 3})
+    assert cache.lookup(["orphan"]) == [None]
+    assert len(cache) == 3